@@ -13,6 +13,7 @@ import functools
 
 from .py_utils import check_iterable, process_list
 from .framedata import FrameData, imhdus
+from .framedata.compressed import write_compressed_hdu
 from .logger import logger
 
 __all__ = ['imhdus', 'check_header_keys', 'check_image_hdu', 'fits_yielder',
@@ -92,7 +93,15 @@ def save_image_hdu(hdu, filename, overwrite=False, logger=logger):
     filename = base + ext
     logger.debug(f'Saving fits file to: {filename}')
 
-    if ext == '.fz':
+    if ext == '.fz' and hdu.data is not None:
+        if os.path.exists(filename):
+            if not overwrite:
+                raise OSError(f'File {filename} already exists.')
+            os.remove(filename)
+        # tiles compressed in threads
+        write_compressed_hdu(filename, hdu.header, hdu.data,
+                             compression='RICE_1')
+    elif ext == '.fz':
         p = fits.PrimaryHDU()
         c = fits.CompImageHDU(hdu.data, header=hdu.header,
                               compression_type='RICE_1')
@@ -1,6 +1,10 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
 from .framedata import FrameData, setup_filename, extract_units  # noqa
+from .framedata import FrameTile, tile_slices  # noqa
 from .memmap import MemMapArray, create_array_memmap, delete_array_memmap  # noqa
+from .backends import get_backend, register_backend, available_backends  # noqa
+from .cache_manager import CacheManager, cache_manager  # noqa
+from .mask import MaskFlags, PackedMask, FlagMask, pack_mask, unpack_mask  # noqa
 from .utils import check_framedata, framedata_read_fits, framedata_write_fits  # noqa
 from .compat import imhdus, EmptyDataError  # noqa
@@ -0,0 +1,152 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Storage backends of the data contained in `MemMapArray`."""
+
+import numpy as np
+
+try:
+    import dask.array as da
+except ImportError:
+    da = None
+
+
+__all__ = ['ArrayBackend', 'NumpyBackend', 'MemmapBackend', 'DaskBackend',
+           'get_backend', 'register_backend', 'available_backends']
+
+
+class ArrayBackend:
+    """Storage of the data contained in a `MemMapArray`.
+
+    Backends create the contained array from array_like data and convert it
+    back to `numpy.ndarray`. The contained array must support numpy ufuncs,
+    indexing and the ``shape``, ``ndim`` and ``dtype`` attributes.
+    """
+    name = None
+    memmap = False  # data stored in a cache file
+    lazy = False  # operations build task graphs, computed on demand
+
+    def create(self, data, filename=None, dtype=None):
+        """Create the contained array from array_like data.
+
+        Parameters:
+        -----------
+            data : array_like
+                Data to be stored.
+            filename : string or None (optional)
+                Cache file name, for file based backends.
+            dtype : string or `numpy.dtype` (optional)
+                Imposed data type.
+        """
+        raise NotImplementedError
+
+    def to_numpy(self, contained):
+        """Convert the contained array to a `numpy.ndarray`."""
+        return np.asarray(contained)
+
+    def contains(self, value):
+        """Check if a value is an array of this backend."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name}>'
+
+
+class NumpyBackend(ArrayBackend):
+    """In-memory `numpy.ndarray` storage."""
+    name = 'numpy'
+
+    def create(self, data, filename=None, dtype=None):
+        return np.array(data, dtype=dtype)
+
+    def contains(self, value):
+        return isinstance(value, np.ndarray) and \
+            not isinstance(value, np.memmap)
+
+
+class MemmapBackend(ArrayBackend):
+    """`numpy.memmap` storage, in the cache file of the container."""
+    name = 'memmap'
+    memmap = True
+
+    def create(self, data, filename=None, dtype=None):
+        from .memmap import create_array_memmap
+        return create_array_memmap(filename, np.asarray(data), dtype)
+
+    def contains(self, value):
+        return isinstance(value, np.memmap)
+
+
+class DaskBackend(ArrayBackend):
+    """Lazy `dask.array.Array` storage.
+
+    Operations build task graphs, that run chunked, in parallel, in the
+    dask scheduler, only when the values are needed.
+
+    Parameters:
+    -----------
+        chunks : int, tuple or 'auto' (optional)
+            Chunks of new dask arrays. Dask arrays given to the container
+            keep their own chunks.
+        scheduler : string or None (optional)
+            Dask scheduler used to compute, like ``'threads'`` or
+            ``'processes'``. If None, the dask default is used.
+    """
+    name = 'dask'
+    lazy = True
+
+    def __init__(self, chunks='auto', scheduler=None):
+        if da is None:
+            raise ImportError('dask is needed to use the dask backend.')
+        self.chunks = chunks
+        self.scheduler = scheduler
+
+    def create(self, data, filename=None, dtype=None):
+        if not isinstance(data, da.Array):
+            data = da.from_array(np.asarray(data), chunks=self.chunks)
+        if dtype is not None and np.dtype(dtype) != data.dtype:
+            data = data.astype(dtype)
+        return data
+
+    def to_numpy(self, contained):
+        if isinstance(contained, da.Array):
+            contained = contained.compute(scheduler=self.scheduler)
+        return np.asarray(contained)
+
+    def contains(self, value):
+        return isinstance(value, da.Array)
+
+
+_backends = {'numpy': NumpyBackend,
+             'memmap': MemmapBackend,
+             'dask': DaskBackend}
+
+
+def register_backend(name, backend):
+    """Register a new `ArrayBackend` subclass with a name."""
+    if not (isinstance(backend, type) and issubclass(backend, ArrayBackend)):
+        raise TypeError('backend must be an ArrayBackend subclass.')
+    _backends[name] = backend
+
+
+def available_backends():
+    """Names of the backends that can be used in this environment."""
+    names = list(_backends.keys())
+    if da is None:
+        names.remove('dask')
+    return names
+
+
+def get_backend(backend, **options):
+    """Get a backend instance from its name.
+
+    Parameters:
+    -----------
+        backend : string or `ArrayBackend`
+            Backend name or instance. Instances are returned untouched.
+        options :
+            Options passed to the backend constructor.
+    """
+    if isinstance(backend, ArrayBackend):
+        return backend
+    if backend not in _backends:
+        raise ValueError(f'Backend {backend} not in {list(_backends)}.')
+    return _backends[backend](**options)
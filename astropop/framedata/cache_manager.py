@@ -0,0 +1,347 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Process-wide manager of the memmap cache files."""
+
+import os
+import uuid
+import atexit
+import shutil
+import weakref
+import threading
+from collections import OrderedDict
+from tempfile import mkdtemp
+
+from ..logger import logger
+
+
+__all__ = ['CacheManager', 'cache_manager']
+
+
+def _physical_memory():
+    """Total physical memory, in bytes, or None if unknown."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _remove_file(filename):
+    """Remove a cache file, if it still exists."""
+    try:
+        os.remove(filename)
+    except (FileNotFoundError, PermissionError, TypeError):
+        pass
+
+
+class CacheManager:
+    """Owner of the cache files of all `~astropop.framedata.MemMapArray`.
+
+    All cache files are created in one folder per process, removed at
+    interpreter exit. The file of an array is removed when the array is
+    garbage collected. If a ``quota`` is set, the least recently used
+    arrays are evicted when the memmapped files exceed it.
+
+    With a ``memory_budget``, it also works like a buffer pool: arrays
+    that do not fit in the budget are created memmapped, and the least
+    recently used arrays in memory are spilled to their cache files when
+    the budget is exceeded. Arrays created with ``memmap=False`` (or
+    frames with ``use_memmap_backend=False``) are pinned in memory.
+
+    Parameters:
+    -----------
+    - folder : string or None (optional)
+        Default cache folder. If None, a temporary folder is created in
+        the first use, and removed at exit.
+    - quota : int or None (optional)
+        Maximum size, in bytes, of the memmapped cache files. None means
+        no limit.
+    - policy : {'spill', 'drop'} (optional)
+        What to do with evicted arrays. ``'spill'`` reads the data to memory
+        and removes the file. ``'drop'`` discards the data and removes the
+        file, so only use it with scratch frames that can be recomputed.
+        Default: ``'spill'``
+    - memory_budget : int, 'auto' or None (optional)
+        Maximum size, in bytes, of the arrays kept in memory. ``'auto'``
+        uses half of the physical memory. If None, the
+        ``ASTROPOP_MEMORY_BUDGET`` environment variable is used, if set.
+        Otherwise, there is no limit.
+    """
+    policies = ('spill', 'drop')
+
+    def __init__(self, folder=None, quota=None, policy='spill',
+                 memory_budget=None):
+        self._folder = folder
+        self._own_folder = False
+        self._arrays = OrderedDict()  # id: weakref, least recent first
+        self._owners = {}  # file name: finalizer of the array owning it
+        self._ram = {}  # id: (bytes in memory, bytes never spilled)
+        self._ram_total = 0  # bytes in memory of all arrays
+        self._ram_fixed = 0  # bytes in memory of arrays never spilled
+        self._lock = threading.RLock()
+        self._enforcing = False  # avoid spill/evict loops
+        self._quota = None
+        self.quota = quota
+        self.policy = policy
+        if memory_budget is None:
+            memory_budget = os.environ.get('ASTROPOP_MEMORY_BUDGET')
+        self.memory_budget = memory_budget
+        atexit.register(self.cleanup)
+
+    @property
+    def folder(self):
+        """Default cache folder. Created in the first access."""
+        with self._lock:
+            if self._folder is None:
+                self._folder = mkdtemp(prefix='astropop')
+                self._own_folder = True
+            return self._folder
+
+    @folder.setter
+    def folder(self, value):
+        with self._lock:
+            self._folder = os.fspath(value) if value is not None else None
+            self._own_folder = False
+
+    @property
+    def quota(self):
+        """Maximum size, in bytes, of the memmapped files. None is no
+        limit."""
+        return self._quota
+
+    @quota.setter
+    def quota(self, value):
+        if value is not None and value < 0:
+            raise ValueError('quota must be a positive number of bytes.')
+        self._quota = value
+        self.enforce()
+
+    @property
+    def memory_budget(self):
+        """Maximum size, in bytes, of the arrays in memory. None is no
+        limit."""
+        return self._memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, value):
+        if isinstance(value, str):
+            value = value.strip().lower()
+            if value == 'auto':
+                value = _physical_memory()
+                value = None if value is None else value//2
+            else:
+                value = int(value)
+        if value is not None and value < 0:
+            raise ValueError('memory_budget must be a positive number of '
+                             'bytes.')
+        self._memory_budget = value
+        self.enforce_memory()
+
+    @property
+    def policy(self):
+        """Eviction policy: ``'spill'`` or ``'drop'``."""
+        return self._policy
+
+    @policy.setter
+    def policy(self, value):
+        if value not in self.policies:
+            raise ValueError(f'Eviction policy {value} not in '
+                             f'{self.policies}.')
+        self._policy = value
+
+    def new_filename(self, suffix=''):
+        """Unique cache file name, without creating the file."""
+        return f'astropop_{uuid.uuid4().hex}{suffix}'
+
+    def register(self, array):
+        """Track an array and remove its cache file when it is collected.
+
+        A file name is owned by the last array registered with it. So,
+        containers that take the file name of a discarded one, like the
+        copies of frames, keep the file.
+        """
+        key = id(array)
+        with self._lock:
+            self._arrays[key] = weakref.ref(array, self._forget(key))
+            array._cache_manager = self
+            self.account(array)
+            if array._filename is not None:
+                name = os.path.abspath(array._filename)
+                previous = self._owners.get(name)
+                if previous is not None:
+                    previous.detach()
+                self._owners[name] = weakref.finalize(array, self._release,
+                                                      name)
+        return key
+
+    def _release(self, name):
+        # Finalizer of the owner of a file
+        with self._lock:
+            self._owners.pop(name, None)
+        _remove_file(name)
+
+    def _forget(self, key):
+        def callback(ref):
+            with self._lock:
+                if self._arrays.get(key) is ref:
+                    del self._arrays[key]
+                    self._set_ram(key, (0, 0))
+        return callback
+
+    def _set_ram(self, key, sizes):
+        # Update the running counters of the memory usage
+        total, fixed = self._ram.pop(key, (0, 0))
+        self._ram_total += sizes[0] - total
+        self._ram_fixed += sizes[1] - fixed
+        if sizes[0]:
+            self._ram[key] = sizes
+
+    def account(self, array):
+        """Update the memory usage of an array, after its data changed.
+
+        Keeps running counters, so the memory budget never needs to sum the
+        sizes of all the arrays.
+        """
+        size = self._ram_size(array)
+        fixed = 0 if self._spillable(array) else size
+        key = id(array)
+        with self._lock:
+            if key in self._arrays:
+                self._set_ram(key, (size, fixed))
+
+    def touch(self, key):
+        """Mark an array as the most recently used."""
+        with self._lock:
+            try:
+                self._arrays.move_to_end(key)
+            except KeyError:
+                pass
+
+    def _live(self):
+        with self._lock:
+            refs = list(self._arrays.values())
+        return [a for a in (r() for r in refs) if a is not None]
+
+    @staticmethod
+    def _file_size(array):
+        # Size of the file owned by the array. Constants, lazy and shared
+        # data have no file of their own.
+        if array._owns_file():
+            return array._contained.nbytes
+        return 0
+
+    @staticmethod
+    def _ram_size(array):
+        # Size of the data owned by the array in memory.
+        if array._in_ram():
+            return array._contained.nbytes
+        return 0
+
+    def usage(self):
+        """Size, in bytes, of the memmapped cache files."""
+        return sum(self._file_size(a) for a in self._live())
+
+    def memory_usage(self):
+        """Size, in bytes, of the arrays in memory."""
+        return self._ram_total
+
+    @staticmethod
+    def _spillable(array):
+        return not array.pinned and array._cow is None and \
+            array._filename is not None
+
+    def wants_memmap(self, nbytes, array=None):
+        """Check if new data of ``nbytes`` must be memmapped to fit in the
+        memory budget.
+
+        New data goes to memory, like the most recently used, if it fits in
+        the budget after spilling the other arrays. Otherwise, it is
+        memmapped.
+
+        Parameters:
+        -----------
+        - nbytes : int
+            Size of the new data.
+        - array : `~astropop.framedata.MemMapArray` or None (optional)
+            Array that will hold the data. Its current data is released.
+        """
+        if self._memory_budget is None:
+            return False
+        fixed = self._ram_fixed
+        if array is not None:
+            fixed -= self._ram.get(id(array), (0, 0))[1]
+        return fixed + nbytes > self._memory_budget
+
+    def enforce_memory(self, keep=None):
+        """Spill the least recently used arrays in memory to their cache
+        files, until under the memory budget.
+
+        Parameters:
+        -----------
+        - keep : `~astropop.framedata.MemMapArray` or None (optional)
+            Array never spilled, like the one just written.
+        """
+        if self._memory_budget is None or self._enforcing or \
+           self._ram_total <= self._memory_budget:
+            return
+        self._enforcing = True
+        try:
+            usage = self._ram_total
+            for array in self._live():
+                if usage <= self._memory_budget:
+                    break
+                size = self._ram_size(array)
+                if array is keep or size == 0 or not self._spillable(array):
+                    continue
+                logger.debug('Memory budget exceeded. Spilling array to '
+                             f'{array._filename}.')
+                array.enable_memmap()
+                usage -= size
+        finally:
+            self._enforcing = False
+
+    def enforce(self, keep=None):
+        """Evict the least recently used arrays until under the quota.
+
+        Parameters:
+        -----------
+        - keep : `~astropop.framedata.MemMapArray` or None (optional)
+            Array never evicted, like the one just written.
+        """
+        if self._quota is None or self._enforcing:
+            return
+        self._enforcing = True
+        try:
+            arrays = self._live()
+            usage = sum(self._file_size(a) for a in arrays)
+            for array in arrays:
+                if usage <= self._quota:
+                    break
+                size = self._file_size(array)
+                if array is keep or size == 0 or array._cow is not None:
+                    continue
+                self.evict(array)
+                usage -= size
+        finally:
+            self._enforcing = False
+
+    def evict(self, array):
+        """Remove the cache file of an array, following the policy."""
+        name = array.filename
+        if self._policy == 'drop':
+            logger.warning(f'Cache quota exceeded. Dropping data of {name}.')
+            array.reset_data(None)
+            _remove_file(name)
+        else:
+            logger.debug(f'Cache quota exceeded. Spilling {name} to memory.')
+            array.disable_memmap(remove=True)
+
+    def cleanup(self):
+        """Remove the cache folder created by this manager."""
+        with self._lock:
+            if self._own_folder and self._folder is not None:
+                shutil.rmtree(self._folder, ignore_errors=True)
+                self._folder = None
+                self._own_folder = False
+
+
+# Manager of this process. Configure it before creating frames.
+cache_manager = CacheManager()
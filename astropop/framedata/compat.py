@@ -1,9 +1,12 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
+import numpy as np
 from astropy.io import fits
 
 
-__all__ = ['_unsupport_fits_open_keywords', 'imhdus', 'EmptyDataError']
+__all__ = ['_unsupport_fits_open_keywords', 'imhdus', 'EmptyDataError',
+           '_bitpix_dtypes', '_fits_dtype', '_fits_chunk',
+           '_fits_user_cards']
 
 
 _unsupport_fits_open_keywords = {
@@ -12,6 +15,60 @@ _unsupport_fits_open_keywords = {
 }
 
 
+# Raw (big endian) dtypes of FITS image BITPIX values
+_bitpix_dtypes = {8: np.dtype('uint8'),
+                  16: np.dtype('>i2'),
+                  32: np.dtype('>i4'),
+                  64: np.dtype('>i8'),
+                  -32: np.dtype('>f4'),
+                  -64: np.dtype('>f8')}
+
+
+# Structural keywords, always generated by the writers
+_fits_structural = ('SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'EXTEND',
+                    'PCOUNT', 'GCOUNT', 'BZERO', 'BSCALE')
+
+
+def _fits_user_cards(header):
+    """Cards of a header, without the structural keywords."""
+    for card in header.cards:
+        key = card.keyword
+        if key in _fits_structural or \
+           (key.startswith('NAXIS') and key[5:].isdigit()):
+            continue
+        yield card
+
+
+def _fits_dtype(dtype):
+    """Get the FITS dtype and BZERO needed to store a dtype.
+
+    Unsigned integers use the FITS BZERO convention. Booleans are stored
+    as uint8.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'b':
+        return np.dtype('uint8'), None
+    if dtype.kind == 'u' and dtype.itemsize > 1:
+        return np.dtype(f'int{8*dtype.itemsize}'), 2**(8*dtype.itemsize - 1)
+    if dtype.kind == 'i' and dtype.itemsize == 1:
+        return np.dtype('int16'), None
+    if dtype.kind == 'f' and dtype.itemsize < 4:
+        return np.dtype('float32'), None
+    if dtype.kind in 'uif' and dtype.itemsize <= 8:
+        return np.dtype(dtype.name), None
+    raise TypeError(f'dtype {dtype} not supported by FITS files.')
+
+
+def _fits_chunk(chunk, dtype, bzero):
+    """Convert a chunk of data to be written in a FITS file."""
+    chunk = np.asarray(chunk)
+    if bzero is not None:
+        # x - bzero, for unsigned x, is x with the sign bit flipped
+        flip = np.array(bzero, dtype=chunk.dtype)
+        return np.bitwise_xor(chunk, flip).view(dtype.newbyteorder('='))
+    return chunk.astype(dtype, copy=False)
+
+
 imhdus = (fits.ImageHDU, fits.PrimaryHDU, fits.CompImageHDU,
           fits.StreamingHDU)
 
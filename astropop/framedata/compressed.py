@@ -0,0 +1,310 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Tile-compressed FITS images, compressed and decompressed in threads.
+
+The tiles follow the FITS tiled image compression convention, so the files
+are read by any FITS reader, like `astropy.io.fits` and fpack/funpack.
+"""
+
+import os
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from astropy.io import fits
+
+from .compat import _fits_dtype, _fits_chunk, _fits_user_cards
+from ..logger import logger
+
+try:
+    # Per tile codecs of astropy. They release the GIL while compressing.
+    from astropy.io.fits._tiled_compression.codecs import Rice1, Gzip1, \
+        Gzip2
+except ImportError:
+    try:
+        from astropy.io.fits.hdu.compressed._codecs import Rice1, Gzip1, \
+            Gzip2
+    except ImportError:
+        Rice1 = Gzip1 = Gzip2 = None
+
+
+__all__ = ['write_compressed_hdu', 'read_compressed_hdu']
+
+
+# Compression types handled by the threaded writer. Others use astropy.
+threaded_compressions = ('RICE_1', 'GZIP_1', 'GZIP_2')
+
+# Reserved keywords of compressed HDUs, never copied from user headers
+_reserved_prefixes = ('ZIMAGE', 'ZTENSION', 'ZBITPIX', 'ZNAXIS', 'ZTILE',
+                      'ZCMPTYPE', 'ZNAME', 'ZVAL', 'ZPCOUNT', 'ZGCOUNT',
+                      'ZQUANTIZ', 'ZDITHER0', 'ZSIMPLE', 'ZEXTEND', 'TTYPE',
+                      'TFORM', 'TFIELDS', 'THEAP')
+
+
+def _n_threads(n_threads):
+    return n_threads or os.cpu_count() or 1
+
+
+def default_compression(dtype):
+    """Lossless compression type for a dtype: RICE_1 for integers up to 4
+    bytes and GZIP_2 for floats and 8 bytes integers."""
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f' or dtype.itemsize > 4:
+        return 'GZIP_2'
+    return 'RICE_1'
+
+
+def default_tile_shape(shape, rows=16):
+    """Tiles of ``rows`` full rows of the image."""
+    shape = tuple(shape)
+    if len(shape) == 1:
+        return shape
+    return (1,)*(len(shape) - 2) + (min(rows, shape[-2]), shape[-1])
+
+
+def _tile_slices(shape, tile_shape):
+    """Slices of the tiles, in the FITS order (first FITS axis faster)."""
+    ranges = [range(0, n, t) for n, t in zip(shape, tile_shape)]
+    for start in itertools.product(*ranges):
+        yield tuple(slice(i, min(i+t, n))
+                    for i, t, n in zip(start, tile_shape, shape))
+
+
+def _codec(compression, tile):
+    if compression == 'RICE_1':
+        return Rice1(blocksize=32, bytepix=tile.dtype.itemsize,
+                     tilesize=tile.size)
+    if compression == 'GZIP_1':
+        return Gzip1()
+    return Gzip2(itemsize=tile.dtype.itemsize)
+
+
+def _threaded_supported(compression, dtype):
+    if Rice1 is None or compression not in threaded_compressions:
+        return False
+    # RICE_1 on floats needs quantization. RICE_1 do not handle 8 bytes.
+    return not (compression == 'RICE_1' and (dtype.kind == 'f' or
+                                             dtype.itemsize > 4))
+
+
+def _compressed_header(header, shape, dtype, bzero, compression, tile_shape,
+                       n_tiles, descriptor):
+    hdr = fits.Header()
+    hdr['XTENSION'] = ('BINTABLE', 'binary table extension')
+    hdr['BITPIX'] = 8
+    hdr['NAXIS'] = 2
+    hdr['NAXIS1'] = 8 if descriptor == 'P' else 16
+    hdr['NAXIS2'] = n_tiles
+    hdr['PCOUNT'] = 0  # heap size, updated after write
+    hdr['GCOUNT'] = 1
+    hdr['TFIELDS'] = 1
+    if bzero is not None:
+        hdr['BSCALE'] = 1
+        hdr['BZERO'] = bzero
+    hdr['TTYPE1'] = 'COMPRESSED_DATA'
+    # max tile size, updated after write
+    hdr['TFORM1'] = f'1{descriptor}B(0)'
+    hdr['ZIMAGE'] = (True, 'extension contains compressed image')
+    hdr['ZTENSION'] = 'IMAGE'
+    hdr['ZBITPIX'] = dtype.itemsize*8*(-1 if dtype.kind == 'f' else 1)
+    hdr['ZNAXIS'] = len(shape)
+    for i, n in enumerate(shape[::-1]):
+        hdr[f'ZNAXIS{i+1}'] = n
+    hdr['ZPCOUNT'] = 0
+    hdr['ZGCOUNT'] = 1
+    for i, n in enumerate(tile_shape[::-1]):
+        hdr[f'ZTILE{i+1}'] = n
+    hdr['ZCMPTYPE'] = compression
+    if compression == 'RICE_1':
+        hdr['ZNAME1'] = 'BLOCKSIZE'
+        hdr['ZVAL1'] = 32
+        hdr['ZNAME2'] = 'BYTEPIX'
+        hdr['ZVAL2'] = dtype.itemsize
+    for card in _fits_user_cards(header):
+        if card.keyword.startswith(_reserved_prefixes):
+            continue
+        hdr.append(card, end=True)
+    return hdr
+
+
+def _astropy_compressed_hdu(filename, header, array, compression,
+                            tile_shape):
+    """Append a compressed HDU using the single-threaded astropy code."""
+    hdu = fits.CompImageHDU(np.asarray(array), header=header,
+                            compression_type=compression,
+                            tile_shape=tile_shape)
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(filename)
+    else:
+        with fits.open(filename, mode='append') as hdul:
+            hdul.append(hdu)
+
+
+def write_compressed_hdu(filename, header, array, compression=None,
+                         tile_shape=None, n_threads=None, batch=None):
+    """Append a tile-compressed image HDU to a FITS file.
+
+    Tiles are compressed in a thread pool and written to the file in
+    batches, so only ``batch`` compressed tiles are kept in memory. If the
+    file does not exist, it is created with an empty primary HDU.
+
+    Parameters
+    ----------
+    filename : str or `pathlib.Path`
+        FITS file name.
+    header : `~astropy.io.fits.Header`
+        Image header. Structural keywords are generated.
+    array : array_like
+        Image data. Only the tiles being compressed are read, so memmaps
+        are never loaded entirely to memory.
+    compression : str, optional
+        ``'RICE_1'``, ``'GZIP_1'`` or ``'GZIP_2'`` are compressed in
+        threads. Other types, and RICE_1 for floats (that needs lossy
+        quantization), use the single-threaded astropy code. Default is
+        lossless: RICE_1 for integers and GZIP_2 for floats.
+    tile_shape : tuple, optional
+        Shape of the tiles, in numpy order. Default is 16 full rows.
+    n_threads : int, optional
+        Number of threads. Default is the number of CPUs.
+    batch : int, optional
+        Number of tiles compressed at once. Default is 4 per thread.
+    """
+    filename = os.fspath(filename)
+    shape = tuple(array.shape)
+    dtype, bzero = _fits_dtype(array.dtype)
+    compression = (compression or default_compression(dtype)).upper()
+    tile_shape = tuple(tile_shape or default_tile_shape(shape))
+    if len(tile_shape) != len(shape):
+        raise ValueError(f'tile_shape {tile_shape} do not match data shape '
+                         f'{shape}.')
+
+    if not _threaded_supported(compression, dtype):
+        logger.debug(f'{compression} compression of {dtype} data is not '
+                     'threaded. Using astropy.')
+        _astropy_compressed_hdu(filename, header, array, compression,
+                                tile_shape)
+        return
+
+    n_threads = _n_threads(n_threads)
+    batch = batch or 4*n_threads
+    tiles = list(_tile_slices(shape, tile_shape))
+    # 32 bits descriptors, unless the heap may be too large
+    raw_size = int(np.prod(shape))*dtype.itemsize
+    descriptor = 'P' if raw_size*1.1 + 64*len(tiles) < 2**31 else 'Q'
+    hdr = _compressed_header(header, shape, dtype, bzero, compression,
+                             tile_shape, len(tiles), descriptor)
+
+    def compress(slices):
+        tile = np.ascontiguousarray(_fits_chunk(array[slices], dtype, bzero))
+        return _codec(compression, tile).encode(tile)
+
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        fits.PrimaryHDU().writeto(filename)
+
+    descriptors = np.zeros((len(tiles), 2),
+                           dtype='>i4' if descriptor == 'P' else '>i8')
+    with open(filename, 'r+b') as f, ThreadPoolExecutor(n_threads) as pool:
+        f.seek(0, os.SEEK_END)
+        hdr_start = f.tell()
+        f.write(hdr.tostring().encode('ascii'))
+        table_start = f.tell()
+        f.write(descriptors.tobytes())
+        offset = 0
+        for i in range(0, len(tiles), batch):
+            for j, cbytes in enumerate(pool.map(compress,
+                                                tiles[i:i+batch])):
+                f.write(cbytes)
+                descriptors[i+j] = (len(cbytes), offset)
+                offset += len(cbytes)
+        f.write(b'\0'*(-(f.tell() - table_start) % 2880))
+
+        # Write the final descriptors and heap sizes
+        hdr['PCOUNT'] = offset
+        hdr['TFORM1'] = f'1{descriptor}B({descriptors[:, 0].max()})'
+        f.seek(hdr_start)
+        f.write(hdr.tostring().encode('ascii'))
+        f.seek(table_start)
+        f.write(descriptors.tobytes())
+
+
+def _row_bands(start, stop, tile_rows, n_bands):
+    """Split rows in bands aligned with the tiles."""
+    first = start // tile_rows
+    last = -(-stop // tile_rows)
+    step = max(1, -(-(last - first) // n_bands))
+    for i in range(first, last, step):
+        yield max(start, i*tile_rows), min(stop, (i + step)*tile_rows)
+
+
+def read_compressed_hdu(filename, hdu=1, section=None, n_threads=None):
+    """Read the data of a tile-compressed HDU, decompressing in threads.
+
+    Only the tiles needed by ``section`` are decompressed. Each thread
+    reads its own bands of tiles, with its own file handle.
+
+    Parameters
+    ----------
+    filename : str or `pathlib.Path`
+        FITS file name.
+    hdu : int or str, optional
+        Compressed HDU index or name.
+    section : tuple of slices, optional
+        Subregion to read. Default is the whole image.
+    n_threads : int, optional
+        Number of threads. Default is the number of CPUs.
+
+    Returns
+    -------
+    `~numpy.ndarray` :
+        Image data, scaled.
+    """
+    filename = os.fspath(filename)
+    # The tiles are only described in the raw binary table header
+    with fits.open(filename, disable_image_compression=True) as hdul:
+        header = hdul[hdu].header
+        ndim = header['ZNAXIS']
+        shape = tuple(header[f'ZNAXIS{i}'] for i in range(ndim, 0, -1))
+        tile_rows = header.get(f'ZTILE{ndim}', 1) if ndim > 1 else shape[0]
+
+    if section is None:
+        section = ()
+    elif not isinstance(section, tuple):
+        section = (section,)
+    section = section + (slice(None),)*(ndim - len(section))
+    if ndim == 0 or not isinstance(section[0], slice) or \
+       section[0].step not in (None, 1):
+        # Not a simple row range. Read in one thread.
+        with fits.open(filename) as hdul:
+            return hdul[hdu].section[section]
+
+    n_threads = _n_threads(n_threads)
+    start, stop, _ = section[0].indices(shape[0])
+    stop = max(start, stop)
+    bands = list(_row_bands(start, stop, tile_rows, 4*n_threads))
+    if n_threads == 1 or len(bands) < 2:
+        with fits.open(filename) as hdul:
+            return hdul[hdu].section[section]
+
+    local = threading.local()
+    handles = []
+
+    def read(band):
+        if not hasattr(local, 'hdul'):
+            local.hdul = fits.open(filename)
+            handles.append(local.hdul)
+        return local.hdul[hdu].section[(slice(*band),) + section[1:]]
+
+    def read_to(band):
+        out[band[0] - start:band[1] - start] = read(band)
+
+    try:
+        # First band gives the dtype of the scaled data
+        first = read(bands[0])
+        out = np.empty((stop - start,) + first.shape[1:], dtype=first.dtype)
+        out[:len(first)] = first
+        del first
+        with ThreadPoolExecutor(n_threads) as pool:
+            list(pool.map(read_to, bands[1:]))
+    finally:
+        for h in handles:
+            h.close()
+    return out
@@ -5,8 +5,10 @@
 # handle disk memmap and an easier unit/uncertainty workflow
 
 import os
+import copy
+import itertools
 import numpy as np
-from tempfile import mkdtemp, mkstemp
+from collections import namedtuple
 from astropy import units as u
 from astropy.io import fits
 from astropy.wcs import WCS
@@ -14,10 +16,26 @@ from astropy.nddata.ccddata import _generate_wcs_and_update_header, CCDData
 
 from ..py_utils import mkdir_p
 from .memmap import MemMapArray
+from .backends import get_backend
+from .cache_manager import cache_manager
+from .mask import FlagMask, mask_container
 
 
-__all__ = ['FrameData', 'shape_consistency', 'unit_consistency',
-           'setup_filename', 'extract_units']
+__all__ = ['FrameData', 'FrameTile', 'shape_consistency', 'unit_consistency',
+           'setup_filename', 'extract_units', 'tile_slices']
+
+
+FrameTile = namedtuple('FrameTile', ['slices', 'core', 'region', 'data',
+                                     'uncertainty', 'mask'])
+FrameTile.__doc__ = """Tile of a FrameData, created by `FrameData.iter_tiles`.
+
+- slices : tuple of slices, the tile region in the frame, with overlap.
+- core : tuple of slices, the tile region without overlap, relative to
+  the tile.
+- region : tuple of slices, the tile region without overlap in the frame.
+- data, uncertainty, mask : views of the frame arrays in the tile. The
+  uncertainty is `None` if the frame has no uncertainty.
+"""
 
 
 def shape_consistency(data=None, uncertainty=None, mask=None):
@@ -39,7 +57,9 @@ def shape_consistency(data=None, uncertainty=None, mask=None):
             ushape = np.array(uncertainty).shape
 
         if ushape == ():
-            uncertainty = np.ones(dshape)*uncertainty
+            # Broadcasted constant. No memory allocated per pixel.
+            uncertainty = np.broadcast_to(np.ones((), dtype=float) *
+                                          uncertainty, dshape, subok=True)
             ushape = uncertainty.shape
 
         if ushape != dshape:
@@ -53,7 +73,7 @@ def shape_consistency(data=None, uncertainty=None, mask=None):
             mshape = np.array(mask).shape
 
         if mshape == ():
-            mask = np.logical_or(np.zeros(dshape), mask)
+            mask = np.broadcast_to(np.array(mask, dtype=bool), dshape)
             mshape = mask.shape
 
         if mask.shape != dshape:
@@ -63,6 +83,55 @@ def shape_consistency(data=None, uncertainty=None, mask=None):
     return data, uncertainty, mask
 
 
+def tile_slices(shape, tile_shape, overlap=0):
+    """Generate the slices to walk an array of ``shape`` in tiles.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the full array.
+    tile_shape : int or tuple
+        Shape of the tiles, without overlap. Tiles at the borders can be
+        smaller. If int, the same size is used for all axes.
+    overlap : int or tuple, optional
+        Number of extra pixels, in each side, included in the tiles. They are
+        clipped in the borders.
+
+    Yields
+    ------
+    slices, core, region : tuple of slices
+        Tile region with overlap in the array, tile region without overlap
+        relative to the tile, and tile region without overlap in the array.
+    """
+    ndim = len(shape)
+    if np.isscalar(tile_shape):
+        tile_shape = (tile_shape,)*ndim
+    if np.isscalar(overlap):
+        overlap = (overlap,)*ndim
+    if len(tile_shape) != ndim or len(overlap) != ndim:
+        raise ValueError(f'tile_shape and overlap must have {ndim} '
+                         'dimensions.')
+    if any(t < 1 for t in tile_shape) or any(o < 0 for o in overlap):
+        raise ValueError('tile_shape must be positive and overlap must be '
+                         'non negative.')
+
+    axes = []
+    for n, t, o in zip(shape, tile_shape, overlap):
+        axis = []
+        for start in range(0, n, t):
+            stop = min(start+t, n)
+            pstart = max(start-o, 0)
+            pstop = min(stop+o, n)
+            axis.append((slice(pstart, pstop),
+                         slice(start-pstart, stop-pstart),
+                         slice(start, stop)))
+        axes.append(axis)
+
+    for tile in itertools.product(*axes):
+        slices, core, region = zip(*tile)
+        yield slices, core, region
+
+
 def extract_units(data, unit):
     """Extract and compare units if they are consistent."""
     if hasattr(data, 'unit'):
@@ -103,7 +172,12 @@ def unit_consistency(data_unit=None, uncertainty_unit=None):
 
 
 def setup_filename(frame, cache_folder=None, filename=None):
-    """Setup filename and cache folder to a frame"""
+    """Setup filename and cache folder to a frame.
+
+    By default, files are named uniquely in the cache folder of the
+    process-wide `~astropop.framedata.cache_manager`, that removes them
+    when their arrays are collected or at exit.
+    """
     if hasattr(frame, 'cache_folder'):
         cache_folder_ccd = frame.cache_folder
     else:
@@ -115,13 +189,13 @@ def setup_filename(frame, cache_folder=None, filename=None):
         filename_ccd = None
 
     filename = filename_ccd or filename
-    filename = filename or mkstemp(suffix='.npy')[1]
+    filename = filename or cache_manager.new_filename(suffix='.npy')
     filename = os.path.basename(filename)
     if cache_folder is None and os.path.dirname(filename) != '':
         cache_folder = os.path.dirname(filename)
 
     cache_folder = cache_folder_ccd or cache_folder
-    cache_folder = cache_folder or mkdtemp(prefix='astropop')
+    cache_folder = cache_folder or cache_manager.folder
 
     frame.cache_folder = cache_folder
     frame.cache_filename = filename
@@ -166,11 +240,22 @@ class FrameData:
         Place to store the cached `FrameData`
     - cache_filename : string, `pathlib.Path` or `None` (optional)
         Base file name to store the cached `FrameData`.
-    - use_memmap_backend : `bool` (optional)
-        True if enable memmap in constructor.
+    - use_memmap_backend : `bool` or `None` (optional)
+        True if enable memmap in constructor. False keeps the frame always
+        in memory. If None, the memory budget of
+        `~astropop.framedata.cache_manager` decides where the frame lives,
+        and it may be spilled to disk later.
+    - mask_mode : {'bool', 'packed', 'flags'} (optional)
+        Mask storage. ``'bool'`` uses one byte per pixel, ``'packed'`` one
+        bit per pixel (`~astropop.framedata.PackedMask`) and ``'flags'`` a
+        `uint16` plane of named flags (`~astropop.framedata.FlagMask`).
+    - backend : string, `~astropop.framedata.backends.ArrayBackend` or \
+                `None` (optional)
+        Storage backend of the arrays: ``'numpy'``, ``'memmap'`` or
+        ``'dask'``. Overrides ``use_memmap_backend``. See
+        `FrameData.set_backend`.
     """
     # TODO: Complete reimplement the initialize
-    # TODO: __copy__
     _memmapping = False
     _data = None
     _mask = None
@@ -179,13 +264,15 @@ class FrameData:
     _meta = None
     _origin = None
     _history = None
+    _mask_mode = 'bool'
 
     def __init__(self, data, unit=None, dtype=None,
                  uncertainty=None, u_unit=None, u_dtype=None,
                  mask=None, m_dtype=bool,
                  wcs=None, meta=None, header=None,
                  cache_folder=None, cache_filename=None,
-                 use_memmap_backend=False, origin_filename=None):
+                 use_memmap_backend=None, origin_filename=None,
+                 mask_mode='bool', backend=None):
 
         if isinstance(data, u.Quantity):
             raise TypeError('astropy Quantity not supported yet.')
@@ -199,12 +286,18 @@ class FrameData:
                                     self.cache_filename)
         self._data = MemMapArray(None, filename=cache_file + '.data')
         self._unct = MemMapArray(None, filename=cache_file + '.unct')
-        self._mask = MemMapArray(None, filename=cache_file + '.mask')
+        self._mask = mask_container(mask_mode, filename=cache_file + '.mask')
+        self._mask_mode = mask_mode
 
         # Check for memmapping.
         self._memmapping = False
-        if use_memmap_backend:
+        if backend is not None:
+            self.set_backend(backend)
+        elif use_memmap_backend:
             self.enable_memmap()
+        elif use_memmap_backend is not None:
+            for container in (self._data, self._unct, self._mask):
+                container.pinned = True
 
         if hasattr(data, 'mask'):
             dmask = data.mask
@@ -349,6 +442,11 @@ class FrameData:
         _, _, value = shape_consistency(self.data, None, value)
         self._mask.reset_data(value)
 
+    @property
+    def mask_mode(self):
+        """Mask storage mode: ``'bool'``, ``'packed'`` or ``'flags'``."""
+        return self._mask_mode
+
     def enable_memmap(self, filename=None, cache_folder=None):
         """Enable array file memmapping.
 
@@ -370,6 +468,37 @@ class FrameData:
             self._unct.enable_memmap(cache_file + '.unct')
         self._memmapping = True
 
+    @property
+    def backend(self):
+        """Storage backend of the data: ``'numpy'``, ``'memmap'`` or
+        ``'dask'``."""
+        return self._data.backend
+
+    def set_backend(self, backend, **options):
+        """Change the storage backend of data, uncertainty and mask.
+
+        With the ``'dask'`` backend, the arrays are lazy dask arrays, so
+        `~astropop.image_processing.imarith` and the calibration functions
+        build task graphs, computed chunked and in parallel only when the
+        values are needed, like in `numpy.asarray` or when writing the
+        frame. Compact masks (``'packed'`` and ``'flags'``) are kept in
+        memory by the ``'dask'`` backend.
+
+        Parameters
+        ----------
+        backend : string or `~astropop.framedata.backends.ArrayBackend`
+            ``'numpy'``, ``'memmap'`` or ``'dask'``.
+        options :
+            Backend options, like ``chunks`` for dask.
+        """
+        backend = get_backend(backend, **options)
+        self._data.set_backend(backend)
+        self._unct.set_backend(backend)
+        if isinstance(self._mask, MemMapArray) or \
+           backend.name in ('numpy', 'memmap'):
+            self._mask.set_backend(backend)
+        self._memmapping = backend.memmap
+
     def disable_memmap(self):
         """Disable frame file memmapping (load to memory)."""
         self._data.disable_memmap(remove=True)
@@ -377,11 +506,226 @@ class FrameData:
         self._unct.disable_memmap(remove=True)
         self._memmapping = False
 
+    def copy(self):
+        """Copy the frame, without copying the data right now.
+
+        Data, uncertainty and mask buffers, in memory or memmapped, are
+        shared between the frames until one of them writes the data using
+        the `FrameData` or `MemMapArray` interfaces. Meanwhile, the shared
+        buffers are read-only.
+
+        Returns
+        -------
+        `FrameData` :
+            New frame, cached in the same folder of this one.
+        """
+        return self._copy(deep=False)
+
+    def __copy__(self):
+        return self._copy(deep=False)
+
+    def __deepcopy__(self, memo):
+        return self._copy(deep=True, memo=memo)
+
+    def _copy(self, deep=False, memo=None):
+        frame = FrameData(None, cache_folder=self.cache_folder,
+                          origin_filename=self._origin,
+                          mask_mode=self._mask_mode)
+        frame._data = self._data._copy(frame._data.filename, deep=deep)
+        frame._unct = self._unct._copy(frame._unct.filename, deep=deep)
+        frame._mask = self._mask._copy(frame._mask.filename, deep=deep)
+        frame._memmapping = self._memmapping
+        if deep:
+            frame._meta = copy.deepcopy(self._meta, memo)
+            frame._wcs = copy.deepcopy(self._wcs, memo)
+            frame._history = copy.deepcopy(self._history, memo)
+        else:
+            frame._meta = dict(self._meta)
+            frame._wcs = self._wcs
+            frame._history = list(self._history)
+        return frame
+
+    def iter_tiles(self, shape, overlap=0):
+        """Walk the frame in tiles.
+
+        Tiles contain views of the data, uncertainty and mask, so memmapped
+        frames are never read entirely to memory.
+
+        Parameters
+        ----------
+        shape : int or tuple
+            Shape of the tiles, without overlap.
+        overlap : int or tuple, optional
+            Number of extra pixels, in each side, included in the tiles.
+
+        Yields
+        ------
+        `FrameTile` :
+            Tile of the frame.
+        """
+        for slices, core, region in tile_slices(self.shape, shape, overlap):
+            if self._unct.empty:
+                unct = None
+            else:
+                unct = self._unct[slices]
+            yield FrameTile(slices, core, region, self._data[slices], unct,
+                            self._mask[slices])
+
+    def map_blocks(self, func, shape, overlap=0, dtype=None,
+                   use_memmap_backend=True, cache_folder=None, **kwargs):
+        """Apply a function to the frame data tile by tile.
+
+        The results are written directly to a new frame. Only the data is
+        processed. The new frame keeps the unit, header and WCS, but has no
+        mask or uncertainty.
+
+        Parameters
+        ----------
+        func : callable
+            Function to apply, like ``func(data, **kwargs)``. It must return
+            an array with the same shape of the tile data.
+        shape : int or tuple
+            Shape of the tiles, without overlap.
+        overlap : int or tuple, optional
+            Number of extra pixels, in each side, passed to ``func``. Useful
+            for filters. Only the tile core is written to the result.
+        dtype : string or `numpy.dtype`, optional
+            Data type of the result. Default is the frame dtype.
+        use_memmap_backend : `bool`, optional
+            Memmap the result frame, so it never needs to fit in memory.
+        cache_folder : str, optional
+            Folder to cache the result frame.
+        **kwargs :
+            Passed to ``func``.
+
+        Returns
+        -------
+        `FrameData` :
+            New frame with the results.
+        """
+        dtype = np.dtype(dtype or self.dtype)
+        frame = FrameData(None, cache_folder=cache_folder,
+                          use_memmap_backend=use_memmap_backend)
+        # Broadcasted zeros: no memory allocated for memmapped results
+        frame._data.reset_data(np.broadcast_to(np.zeros((), dtype=dtype),
+                                               self.shape),
+                               unit=self.unit, dtype=dtype)
+        frame.mask = False
+        frame.meta = dict(self.meta)
+        if self.wcs is not None:
+            frame.wcs = self.wcs
+
+        for tile in self.iter_tiles(shape, overlap):
+            result = np.asarray(func(tile.data, **kwargs))
+            if result.shape != tile.data.shape:
+                raise ValueError(f'func result shape {result.shape} do not '
+                                 f'match tile shape {tile.data.shape}.')
+            frame._data[tile.region] = result[tile.core]
+
+        frame._data.flush()
+        return frame
+
+    def to_shared(self):
+        """Share this frame with other processes, without copying the data.
+
+        Memmapped arrays are shared by their cache files and in-memory
+        arrays are moved to `multiprocessing.shared_memory` blocks. The
+        shared blocks live while this frame exists, so keep it alive while
+        workers use the data.
+
+        Returns
+        -------
+        dict :
+            Picklable handle to be passed to `FrameData.from_shared`, in the
+            worker process.
+        """
+        return {'data': self._data.to_shared(),
+                'unct': self._unct.to_shared(),
+                'mask': self._mask.to_shared(),
+                'meta': self.meta,
+                'wcs': self.wcs,
+                'origin_filename': self.origin_filename,
+                'mask_mode': self.mask_mode}
+
+    @classmethod
+    def from_shared(cls, handle, cache_folder=None):
+        """Create a FrameData attached to a frame shared by other process.
+
+        Data, uncertainty and mask are the same buffers of the original
+        frame, so no data is copied and changes are seen by all processes.
+        Setting new arrays (like ``frame.data = value``) creates private
+        arrays, not shared anymore.
+
+        Parameters
+        ----------
+        handle : dict
+            Handle created by `FrameData.to_shared`.
+        cache_folder : str, optional
+            Folder to cache new private arrays, if memmapped.
+
+        Returns
+        -------
+        `FrameData` :
+            Frame using the shared buffers.
+        """
+        frame = cls(None, meta=handle['meta'], wcs=handle['wcs'],
+                    cache_folder=cache_folder,
+                    origin_filename=handle['origin_filename'],
+                    mask_mode=handle.get('mask_mode', 'bool'))
+        frame._data.attach_shared(handle['data'])
+        frame._unct.attach_shared(handle['unct'])
+        frame._mask.attach_shared(handle['mask'])
+        frame._memmapping = frame._data.memmap
+        return frame
+
+    def _fits_planes(self, hdu_uncertainty='UNCERT', hdu_mask='MASK',
+                     unit_key='BUNIT', wcs_relax=True):
+        """Headers and arrays of the planes to be stored in FITS files.
+
+        Arrays are the containers of the frame, never copies. Empty
+        uncertainties are a broadcasted zero plane.
+        """
+        # TODO: Add history
+        header = fits.Header(self.header)
+        if self.wcs is not None:
+            header.extend(self.wcs.to_header(relax=wcs_relax),
+                          useblanks=False, update=True)
+        header[unit_key] = self.unit.to_string()
+        planes = [(header, self._data)]
+
+        if hdu_uncertainty is not None:
+            uncert = self._unct
+            uncert_unit = uncert.unit
+            if uncert.empty:
+                dtype = self.dtype if self.dtype.kind == 'f' else 'f8'
+                uncert = np.broadcast_to(np.zeros((), dtype=dtype),
+                                         self.shape)
+                uncert_unit = self.unit
+            uncert_h = fits.Header()
+            uncert_h['EXTNAME'] = hdu_uncertainty
+            uncert_h[unit_key] = uncert_unit.to_string()
+            planes.append((uncert_h, uncert))
+
+        if hdu_mask is not None and not self._mask.empty:
+            mask = self._mask
+            if isinstance(mask, FlagMask):
+                # Keep the named flags in the file
+                mask = mask.flags
+            mask_h = fits.Header()
+            mask_h['EXTNAME'] = hdu_mask
+            planes.append((mask_h, mask))
+
+        return planes
+
     def to_hdu(self, hdu_uncertainty='UNCERT',
                hdu_mask='MASK', unit_key='BUNIT',
                wcs_relax=True):
         """Generate an HDUList from this FrameData.
 
+        All data is copied to memory. To write memmapped frames to files,
+        use `~astropop.framedata.framedata_write_fits`, that streams the
+        data.
+
         Parameters
         ----------
         hdu_uncertainty : string, optional
@@ -400,30 +744,17 @@ class FrameData:
         `~astropy.fits.HDUList` :
             HDU storing all FrameData informations.
         """
-        # TODO: Add history
-        data = self.data.copy()
-        header = fits.Header(self.header)
-        if self.wcs is not None:
-            header.extend(self.wcs.to_header(relax=wcs_relax),
-                          useblanks=False, update=True)
-        header[unit_key] = self.unit.to_string()
-        hdul = fits.HDUList(fits.PrimaryHDU(data, header=header))
-
-        if hdu_uncertainty is not None and self.uncertainty is not None:
-            uncert = self.uncertainty
-            uncert_unit = uncert.unit.to_string()
-            uncert_h = fits.Header()
-            uncert_h[unit_key] = uncert_unit
-            hdul.append(fits.ImageHDU(uncert, header=uncert_h,
-                                      name=hdu_uncertainty))
-
-        if hdu_mask is not None and self.mask is not None:
-            mask = self.mask
-            if np.issubdtype(mask.dtype, np.bool):
+        planes = self._fits_planes(hdu_uncertainty=hdu_uncertainty,
+                                   hdu_mask=hdu_mask, unit_key=unit_key,
+                                   wcs_relax=wcs_relax)
+        hdul = fits.HDUList()
+        for i, (header, array) in enumerate(planes):
+            data = np.array(array)
+            if data.dtype == bool:
                 # Fits do not support bool
-                mask = mask.astype('uint8')
-            hdul.append(fits.ImageHDU(mask, name=hdu_mask))
-
+                data = data.astype('uint8')
+            hdu_class = fits.PrimaryHDU if i == 0 else fits.ImageHDU
+            hdul.append(hdu_class(data, header=header))
         return hdul
 
     def to_ccddata(self):
@@ -0,0 +1,530 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Compact mask containers: bit-packed masks and named flag planes."""
+
+import enum
+import numpy as np
+from astropy import units as u
+
+from .backends import get_backend
+from .memmap import MemMapArray, unwrap_array, _is_constant
+
+
+__all__ = ['MaskFlags', 'PackedMask', 'FlagMask', 'pack_mask', 'unpack_mask',
+           'mask_container']
+
+
+mask_modes = ('bool', 'packed', 'flags')
+
+# Number of set bits of each byte value
+_popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class MaskFlags(enum.IntFlag):
+    """Named bits of a `FlagMask` plane."""
+    MASKED = 1  # generic, set by boolean masks
+    SATURATED = 2
+    COSMIC = 4
+    BAD_COLUMN = 8
+    BAD_PIXEL = 16
+    HOT_PIXEL = 32
+    DEAD_PIXEL = 64
+    NONLINEAR = 128
+    INTERPOLATED = 256
+    OUT_OF_BOUNDS = 512
+
+
+def _flag_value(flag):
+    """Get the int value of a flag, by `MaskFlags`, name or int."""
+    if isinstance(flag, str):
+        try:
+            flag = MaskFlags[flag.upper()]
+        except KeyError:
+            raise ValueError(f'Unknown mask flag {flag}.')
+    return np.uint16(flag)
+
+
+def pack_mask(mask):
+    """Pack a boolean mask in bits, along the last axis.
+
+    Each byte stores 8 pixels. The last axis is padded to a multiple of 8.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if mask.ndim == 0:
+        return np.uint8(0x80 if mask else 0)
+    return np.packbits(mask, axis=-1)
+
+
+def unpack_mask(words, shape):
+    """Unpack a mask packed by `pack_mask` to a boolean array."""
+    words = np.asarray(words)
+    if len(shape) == 0:
+        return np.array(words & 0x80, dtype=bool)
+    return np.unpackbits(words, axis=-1, count=shape[-1]).view(bool)
+
+
+def _split_index(item, ndim):
+    """Split an index in the leading axes and last axis parts.
+
+    Return `None` if the index cannot be split without changing its
+    meaning.
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+    if ndim == 0 or len(item) > ndim:
+        return
+    for i in item:
+        if i is Ellipsis or i is None:
+            return
+        if isinstance(i, np.ndarray) and i.dtype == bool and i.ndim > 1:
+            return
+    item = item + (slice(None),)*(ndim - len(item))
+    lead, last = item[:-1], item[-1]
+    if not isinstance(last, (slice, int, np.integer)):
+        return
+    return lead, last
+
+
+def _as_array(value):
+    """Convert mask containers to boolean arrays, in lists and tuples too."""
+    if isinstance(value, _MaskPlane):
+        return np.asarray(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_as_array(i) for i in value)
+    return value
+
+
+class _MaskPlane:
+    """Base of mask containers storing compact words in a `MemMapArray`.
+
+    The containers behave like boolean arrays and follow the `MemMapArray`
+    storage interface, so they can be used as `FrameData` masks.
+    """
+    _words = None  # MemMapArray with the stored words
+    _shape = None
+
+    def __init__(self, mask=None, filename=None, memmap=None):
+        self._words = MemMapArray(None, filename=filename, memmap=memmap)
+        if mask is not None:
+            self.reset_data(mask)
+
+    @property
+    def empty(self):
+        """True if contained data is empty (None)."""
+        return self._words.empty
+
+    @property
+    def unit(self):
+        """Masks have no physical unit."""
+        return u.dimensionless_unscaled
+
+    @property
+    def filename(self):
+        """Name of the file where the words are cached, if memmapped."""
+        return self._words.filename
+
+    @property
+    def memmap(self):
+        """True if memmap is enabled."""
+        return self._words.memmap
+
+    @property
+    def lazy(self):
+        """True if the words are not owned yet. See `MemMapArray.lazy`."""
+        return self._words.lazy
+
+    @property
+    def pinned(self):
+        """True if never spilled to disk. See `MemMapArray.pinned`."""
+        return self._words.pinned
+
+    @pinned.setter
+    def pinned(self, value):
+        self._words.pinned = value
+
+    @property
+    def shape(self):
+        """Shape of the mask, not of the stored words."""
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self._shape))
+
+    @property
+    def dtype(self):
+        """Masks are seen as boolean arrays."""
+        return np.dtype(bool)
+
+    @property
+    def nbytes(self):
+        """Bytes used to store the mask words."""
+        return self._words.nbytes
+
+    def set_filename(self, value):
+        self._words.set_filename(value)
+
+    def enable_memmap(self, filename=None):
+        self._words.enable_memmap(filename)
+
+    def disable_memmap(self, remove=False):
+        self._words.disable_memmap(remove=remove)
+
+    @property
+    def backend(self):
+        """Storage backend of the words: ``'numpy'`` or ``'memmap'``."""
+        return self._words.backend
+
+    def set_backend(self, backend, **options):
+        """Change the storage backend. Only ``'numpy'`` and ``'memmap'``
+        are supported by compact masks."""
+        backend = get_backend(backend, **options)
+        if backend.name not in ('numpy', 'memmap'):
+            raise ValueError(f'Backend {backend.name} not supported by '
+                             f'{self.__class__.__name__}.')
+        self._words.set_backend(backend)
+
+    def flush(self):
+        self._words.flush()
+
+    def _copy(self, filename=None, deep=False):
+        new = type(self).__new__(type(self))
+        new._words = self._words._copy(filename, deep=deep)
+        new._shape = self._shape
+        return new
+
+    def _trim(self, item):
+        """Keep only a region of the mask."""
+        if not self.empty:
+            self.reset_data(self[item])
+
+    def __copy__(self):
+        return self._copy(deep=False)
+
+    def __deepcopy__(self, memo):
+        return self._copy(deep=True)
+
+    def to_shared(self):
+        """Share the mask words. See `MemMapArray.to_shared`."""
+        spec = self._words.to_shared()
+        if spec is None:
+            return None
+        return {'words': spec, 'shape': self._shape}
+
+    def attach_shared(self, spec):
+        """Use mask words shared by `to_shared`."""
+        self._words.attach_shared(None if spec is None else spec['words'])
+        self._shape = None if spec is None else tuple(spec['shape'])
+
+    def _new_words(self, words, shape):
+        new = type(self)()
+        new._words.reset_data(words)
+        new._shape = shape
+        return new
+
+    def astype(self, dtype):
+        return np.asarray(self).astype(dtype)
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __repr__(self):
+        return f'{type(self).__name__}:\n' + repr(np.asarray(self)) + \
+               f'\nfile: {self.filename}'
+
+    def __array__(self, dtype=None, copy=None):
+        if self.empty:
+            return np.array(None)
+        return np.asarray(self._unpack(), dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = _as_array(inputs)
+        out = kwargs.pop('out', None)
+        if out is not None and not any(isinstance(i, _MaskPlane)
+                                       for i in out):
+            kwargs['out'] = unwrap_array(out)
+            out = None
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if out is not None:
+            # Mask containers are written by their setitem
+            results = result if isinstance(result, tuple) else (result,)
+            for o, r in zip(out, results):
+                o[...] = r
+            return out[0] if len(out) == 1 else out
+        return result
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func is np.count_nonzero and len(args) == 1 and not kwargs:
+            return self.count()
+        args = _as_array(args)
+        kwargs = {k: _as_array(v) for k, v in kwargs.items()}
+        return func(*args, **kwargs)
+
+    def _bitwise(self, other, ufunc):
+        # Same kind of containers operate directly in the stored words
+        if isinstance(other, type(self)) and other.shape == self.shape:
+            words = ufunc(np.asarray(self._words), np.asarray(other._words))
+            return self._new_words(words, self._shape)
+        return ufunc(np.asarray(self), _as_array(other))
+
+    def __or__(self, other):
+        return self._bitwise(other, np.bitwise_or)
+
+    def __and__(self, other):
+        return self._bitwise(other, np.bitwise_and)
+
+    def __xor__(self, other):
+        return self._bitwise(other, np.bitwise_xor)
+
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def __eq__(self, other):
+        return np.equal(np.asarray(self), _as_array(other))
+
+    def __ne__(self, other):
+        return np.not_equal(np.asarray(self), _as_array(other))
+
+    def __invert__(self):
+        return np.logical_not(np.asarray(self))
+
+
+class PackedMask(_MaskPlane):
+    """Boolean mask stored bit-packed, 8 pixels per byte.
+
+    Packed words are stored in a `MemMapArray`, so they can be memmapped.
+    Reading returns boolean arrays. Row-based indexes, like tiles, only
+    unpack the selected rows. ``|``, ``&``, ``^`` and ``~`` between packed
+    masks operate directly in the packed words.
+
+    Parameters:
+    -----------
+        mask : array_like or None (optional)
+            Initial mask.
+        filename : string or None (optional)
+            Cache file name of the packed words, for memmapping.
+        memmap : bool (optional)
+            Store the packed words in the cache file.
+    """
+
+    def reset_data(self, data=None, unit=None, dtype=None):
+        """Set a new mask. ``unit`` and ``dtype`` are ignored."""
+        if data is None:
+            self._words.reset_data(None)
+            self._shape = None
+            return
+
+        if isinstance(data, PackedMask):
+            self._words.reset_data(data._words)
+            self._shape = data._shape
+            return
+
+        data = np.asarray(data)
+        shape = data.shape
+        if data.ndim > 0 and _is_constant(data):
+            # Constant masks keep constant words. Padding bits are ignored.
+            byte = np.uint8(0xFF if data.flat[0] else 0)
+            words = np.broadcast_to(byte, shape[:-1] + (-(-shape[-1]//8),))
+        else:
+            words = np.asarray(pack_mask(data))
+        self._words.reset_data(words)
+        self._shape = shape
+
+    def _unpack(self, lead=()):
+        return unpack_mask(np.asarray(self._words)[lead], self._shape)
+
+    def count(self):
+        """Number of masked elements."""
+        words = np.asarray(self._words)
+        if self.ndim == 0:
+            return int(bool(words & 0x80))
+        pad = -self._shape[-1] % 8
+        last = words[..., -1] & np.uint8((0xFF << pad) & 0xFF)
+        total = _popcount[words[..., :-1]].sum(dtype=np.int64)
+        total += _popcount[last].sum(dtype=np.int64)
+        return int(total)
+
+    def __getitem__(self, item):
+        if self.empty:
+            raise ValueError('Empty mask container.')
+        item = unwrap_array(item)
+        split = _split_index(item, self.ndim)
+        if split is None:
+            return self._unpack()[item]
+        lead, last = split
+        if isinstance(last, slice) and last.step in (None, 1):
+            # Unpack only the bytes of the selected columns
+            start, stop, _ = last.indices(self._shape[-1])
+            stop = max(start, stop)
+            first = start // 8
+            words = np.asarray(self._words)[lead + (slice(first,
+                                                          -(-stop//8)),)]
+            bits = np.unpackbits(words, axis=-1).view(bool)
+            return bits[..., start - 8*first:stop - 8*first]
+        return self._unpack(lead)[..., last]
+
+    def __setitem__(self, item, value):
+        if self.empty:
+            raise ValueError('Empty mask container.')
+        item = unwrap_array(item)
+        value = unwrap_array(value)
+        if isinstance(item, np.ndarray) and item.dtype == bool and \
+           item.shape == self._shape and np.ndim(value) == 0:
+            # Boolean selection: combine the packed words directly
+            if value:
+                self._words |= pack_mask(item)
+            else:
+                self._words &= ~pack_mask(item)
+            return
+
+        split = _split_index(item, self.ndim)
+        if split is None:
+            full = self._unpack()
+            full[item] = value
+            self.reset_data(full)
+            return
+        lead, last = split
+        rows = self._unpack(lead)
+        rows[..., last] = value
+        self._words[lead] = pack_mask(rows)
+
+    def __invert__(self):
+        return self._new_words(~np.asarray(self._words), self._shape)
+
+
+class FlagMask(_MaskPlane):
+    """Mask stored as a `uint16` plane of named flags.
+
+    Each bit of the plane is a `MaskFlags` reason for masking a pixel. A
+    pixel is masked if any flag is set. Setting boolean values sets, or
+    clears, only the generic `MaskFlags.MASKED` flag; pixels keeping other
+    flags stay masked.
+
+    Parameters:
+    -----------
+        mask : array_like or None (optional)
+            Initial mask. Boolean masks set `MaskFlags.MASKED`. Integer
+            masks are used as flags.
+        filename : string or None (optional)
+            Cache file name of the flag plane, for memmapping.
+        memmap : bool (optional)
+            Store the flag plane in the cache file.
+    """
+
+    @property
+    def flags(self):
+        """The `uint16` flag plane, as `MemMapArray`."""
+        return self._words
+
+    def reset_data(self, data=None, unit=None, dtype=None):
+        """Set a new mask. ``unit`` and ``dtype`` are ignored."""
+        if data is None:
+            self._words.reset_data(None)
+            self._shape = None
+            return
+
+        if isinstance(data, FlagMask):
+            self._words.reset_data(data._words)
+            self._shape = data._shape
+            return
+
+        data = np.asarray(data)
+        if data.dtype == bool and (data.ndim == 0 or _is_constant(data)):
+            flag = np.uint16(MaskFlags.MASKED if data.flat[0] else 0)
+            data = np.broadcast_to(flag, data.shape)
+        self._words.reset_data(data, dtype=np.uint16)
+        self._shape = data.shape
+
+    def _unpack(self, lead=()):
+        return np.asarray(self._words)[lead] != 0
+
+    def _trim(self, item):
+        """Keep only a region of the flags, as a view. See
+        `MemMapArray._trim`."""
+        self._words._trim(item)
+        if not self.empty:
+            self._shape = np.shape(self._words._contained)
+
+    def count(self):
+        """Number of masked elements."""
+        return int(np.count_nonzero(np.asarray(self._words)))
+
+    def get_flag(self, flag):
+        """Boolean array of the pixels with a given flag set.
+
+        Parameters:
+        -----------
+            flag : `MaskFlags`, string or int
+                Flag, or flag name, like ``'saturated'``.
+        """
+        return (np.asarray(self._words) & _flag_value(flag)) != 0
+
+    def set_flag(self, flag, where=Ellipsis):
+        """Set a flag in the selected pixels.
+
+        Parameters:
+        -----------
+            flag : `MaskFlags`, string or int
+                Flag, or flag name, like ``'saturated'``.
+            where : index or boolean array (optional)
+                Pixels to flag. Default is all.
+        """
+        where = unwrap_array(where)
+        current = np.asarray(self._words)[where]
+        self._words[where] = current | _flag_value(flag)
+
+    def clear_flag(self, flag, where=Ellipsis):
+        """Clear a flag in the selected pixels.
+
+        Parameters:
+        -----------
+            flag : `MaskFlags`, string or int
+                Flag, or flag name, like ``'saturated'``.
+            where : index or boolean array (optional)
+                Pixels to unflag. Default is all.
+        """
+        where = unwrap_array(where)
+        current = np.asarray(self._words)[where]
+        self._words[where] = current & ~_flag_value(flag)
+
+    def __getitem__(self, item):
+        if self.empty:
+            raise ValueError('Empty mask container.')
+        return np.asarray(self._words)[unwrap_array(item)] != 0
+
+    def __setitem__(self, item, value):
+        if self.empty:
+            raise ValueError('Empty mask container.')
+        item = unwrap_array(item)
+        value = np.asarray(unwrap_array(value), dtype=bool)
+        current = np.asarray(self._words)[item]
+        self._words[item] = np.where(value, current | MaskFlags.MASKED,
+                                     current & ~_flag_value(MaskFlags.MASKED)
+                                     ).astype(np.uint16)
+
+
+def mask_container(mode='bool', filename=None, memmap=None):
+    """Create an empty mask container.
+
+    Parameters:
+    -----------
+        mode : {'bool', 'packed', 'flags'}
+            ``'bool'`` uses a `MemMapArray` of booleans, ``'packed'`` a
+            `PackedMask` and ``'flags'`` a `FlagMask`.
+        filename : string or None (optional)
+            Cache file name, for memmapping.
+        memmap : bool or None (optional)
+            Enable memmapping. If None, the memory budget of
+            `~astropop.framedata.cache_manager` decides.
+    """
+    if mode == 'bool':
+        return MemMapArray(None, filename=filename, memmap=memmap)
+    if mode == 'packed':
+        return PackedMask(None, filename=filename, memmap=memmap)
+    if mode == 'flags':
+        return FlagMask(None, filename=filename, memmap=memmap)
+    raise ValueError(f'Mask mode {mode} not in {mask_modes}.')
@@ -2,26 +2,41 @@
 """Dynamic memmap arrays, that can be enabled or disabled."""
 
 import os
+import shutil
+import uuid
+import weakref
 import numpy as np
 from astropy import units as u
 
 from .compat import EmptyDataError
+from .cache_manager import cache_manager
+from .backends import get_backend
 
 
-__all__ = ['MemMapArray', 'create_array_memmap', 'delete_array_memmap']
+__all__ = ['MemMapArray', 'create_array_memmap', 'delete_array_memmap',
+           'open_array_memmap', 'wrap_array', 'unwrap_array']
 
 
-redirects = ['flags', 'shape', 'strides', 'ndim', 'data', 'size',
-             'itemsize', 'nbytes', 'base', 'dtype', 'T', 'real',
-             'imag', 'flat', 'ctypes', 'item', 'tolist', 'itemset',
-             'tostring', 'tobytes', 'tofile', 'dump', 'dumps', 'astype',
-             'byteswap', 'copy', 'view', 'getfield', 'setflags',
-             'reshape', 'resize', 'transpose', 'swapaxes', 'flatten',
-             'ravel', 'squeeze', 'take', 'put', 'repeat', 'choose', 'sort',
-             'argsort', 'partition', 'argpartition', 'searchsorted', 'nonzero',
-             'compress', 'diagonal', 'max', 'argmax', 'min', 'argmin', 'ptp',
-             'conj', 'round', 'trace', 'sum', 'cumsum', 'mean', 'var', 'std',
-             'prod', 'cumprod', 'all', 'any']
+# Attributes redirected to the contained array. They are set as properties
+# of MemMapArray class, so no check is done in regular attribute access.
+# Plain attributes are returned as they are, array attributes are wrapped
+# in MemMapArray and methods have their results wrapped.
+redirects_plain = ('flags', 'shape', 'strides', 'ndim', 'data', 'size',
+                   'itemsize', 'nbytes', 'dtype', 'flat', 'ctypes')
+redirects_array = ('base', 'T', 'real', 'imag')
+redirects_method = ('item', 'tolist', 'itemset', 'tostring', 'tobytes',
+                    'tofile', 'dump', 'dumps', 'astype', 'byteswap', 'copy',
+                    'view', 'getfield', 'setflags', 'reshape', 'resize',
+                    'transpose', 'swapaxes', 'flatten', 'ravel', 'squeeze',
+                    'take', 'put', 'repeat', 'choose', 'sort', 'argsort',
+                    'partition', 'argpartition', 'searchsorted', 'nonzero',
+                    'compress', 'diagonal', 'max', 'argmax', 'min', 'argmin',
+                    'ptp', 'conj', 'round', 'trace', 'sum', 'cumsum', 'mean',
+                    'var', 'std', 'prod', 'cumprod', 'all', 'any')
+redirects = frozenset(redirects_plain + redirects_array + redirects_method)
+# Methods that change the data in place. Lazy data is materialized first.
+redirects_inplace = frozenset(('itemset', 'put', 'sort', 'partition',
+                               'resize'))
 
 
 def create_array_memmap(filename, data, dtype=None):
@@ -42,6 +57,15 @@ def create_array_memmap(filename, data, dtype=None):
     return memmap
 
 
+def open_array_memmap(filename, dtype, shape, offset=0):
+    """Open an existing file as a copy-on-write memmap.
+
+    Changes in the data are kept in memory and never written to the file.
+    """
+    return np.memmap(filename, mode='c', dtype=dtype, shape=shape,
+                     offset=offset)
+
+
 def delete_array_memmap(memmap, read=True, remove=False):
     """Delete a memmap and read the data to a np.ndarray"""
     if memmap is None:
@@ -51,13 +75,68 @@ def delete_array_memmap(memmap, read=True, remove=False):
         data = np.array(memmap[:])
     else:
         data = None
-    name = memmap.filename
-    if remove:
+    name = getattr(memmap, 'filename', None)
+    if remove and name is not None:
         del memmap
         os.remove(name)
     return data
 
 
+def _move_array_memmap(memmap, filename):
+    """Move a memmap to a new file, renaming the file when possible."""
+    memmap.flush()
+    try:
+        os.replace(memmap.filename, filename)
+    except OSError:
+        # Other file system. Copy the data.
+        n_mm = create_array_memmap(filename, memmap)
+        delete_array_memmap(memmap, read=False, remove=True)
+        return n_mm
+    return np.memmap(filename, mode='r+', dtype=memmap.dtype,
+                     shape=memmap.shape)
+
+
+def _copy_filename(filename):
+    """Create a new file name, in the same folder, for a copy."""
+    if filename is None:
+        return None
+    root, ext = os.path.splitext(filename)
+    return f'{root}_{uuid.uuid4().hex[:8]}{ext}'
+
+
+def _is_constant(data):
+    """Check if an array is a broadcasted constant, with no memory per
+    element."""
+    return isinstance(data, np.ndarray) and data.ndim > 0 and \
+        data.size > 0 and not any(data.strides)
+
+
+def _nbytes(data, dtype=None):
+    """Size, in bytes, of an array_like converted to dtype."""
+    dtype = np.dtype(dtype or getattr(data, 'dtype', None) or
+                     np.asarray(data).dtype)
+    return dtype.itemsize*int(np.size(data))
+
+
+def _release_cow(counter):
+    """Drop one holder of a copy-on-write shared buffer."""
+    counter[0] -= 1
+
+
+def _release_shared_memory(shm, unlink=False):
+    """Close, and unlink if owner, a shared memory block."""
+    try:
+        shm.close()
+    except BufferError:
+        # Still exported buffers. Memory is freed when they are released.
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
 def to_memmap_operator(item):
     # TODO: direct operations fail with quantities
     def wrapper(self, *args, **kwargs):
@@ -70,25 +149,121 @@ def to_memmap_operator(item):
     return wrapper
 
 
+def to_memmap_ufunc(ufunc, reflected=False, inplace=False):
+    """Create an operator method that runs a ufunc over the contained data.
+
+    The result is computed only once, directly from the contained arrays,
+    and wrapped without copy. In-place operators write in the contained
+    buffer, so memmapped data stays in the memmap file.
+    """
+    def wrapper(self, *args):
+        if self.empty:
+            raise EmptyDataError('Empty data container.')
+        args = unwrap_array(args)
+        if inplace:
+            self._materialize()
+            ufunc(self._contained, *args, out=self._contained)
+            return self
+        if reflected:
+            result = ufunc(*args, self._contained)
+        else:
+            result = ufunc(self._contained, *args)
+        return wrap_array(result)
+    return wrapper
+
+
 def to_memmap_attr(func):
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
-        if isinstance(result, np.ndarray):
-            return MemMapArray(result, memmap=False)
-        return result
+        return wrap_array(result)
     return wrapper
 
 
+def wrap_array(result):
+    """Wrap a `numpy.ndarray` result in a `MemMapArray` without copying.
+
+    Tuples and lists are wrapped element by element. `~astropy.units.Quantity`
+    results keep their unit. Any other value is returned untouched.
+    """
+    if isinstance(result, (tuple, list)):
+        return type(result)(wrap_array(i) for i in result)
+    if not isinstance(result, np.ndarray):
+        return result
+
+    unit = None
+    if isinstance(result, u.Quantity):
+        unit = result.unit
+        result = result.view(np.ndarray)
+    elif isinstance(result, np.memmap):
+        # Results are never memmap owners. Keep a simple ndarray view.
+        result = result.view(np.ndarray)
+
+    # Bypass __init__ to avoid the np.array copy of the constructor.
+    wrapped = MemMapArray.__new__(MemMapArray)
+    wrapped._contained = result
+    wrapped.set_unit(unit)
+    wrapped._file_lock = True
+    return wrapped
+
+
+def unwrap_array(value):
+    """Return the contained data of a `MemMapArray`, or the value itself.
+
+    Lists and tuples are unwrapped element by element.
+    """
+    if isinstance(value, MemMapArray):
+        if value.empty:
+            raise EmptyDataError('Empty data container.')
+        return value._contained
+    if isinstance(value, (tuple, list)):
+        return type(value)(unwrap_array(i) for i in value)
+    return value
+
+
+def _redirect_property(name, kind):
+    """Generate a property that redirects an attribute to the contained
+    array."""
+    def plain(self):
+        contained = self._contained
+        if contained is None:
+            raise EmptyDataError('Empty data container')
+        return getattr(contained, name)
+
+    def array(self):
+        return wrap_array(plain(self))
+
+    def method(self):
+        return to_memmap_attr(plain(self))
+
+    def method_inplace(self):
+        self._materialize()
+        return to_memmap_attr(plain(self))
+
+    getter = {'plain': plain, 'array': array, 'method': method,
+              'method_inplace': method_inplace}[kind]
+    getter.__name__ = name
+    getter.__doc__ = f'Same as `numpy.ndarray.{name}` of the contained data.'
+    return property(getter)
+
+
 class MemMapArray:
-    # TODO: __copy__
     _filename = None  # filename of memmap
     _file_lock = False  # lock filename
     _contained = None  # Data contained: numpy ndarray or memmap
     _memmap = False
+    _lazy = False  # contained data not owned. Materialize before write
+    _shared = False  # contained data not owned, but shared for writing
+    _shm = None  # shared memory block holding the data, if any
+    _cow = None  # holders counter of a copy-on-write buffer
+    _cow_release = None  # finalizer that drops this holder from _cow
+    _cache_key = None  # key in the cache manager, for LRU tracking
+    _cache_manager = None  # cache manager tracking this instance
+    _pinned = False  # never spilled to disk by the memory budget
+    _backend = None  # external backend, like dask. None for numpy/memmap
     _unit = u.dimensionless_unscaled
 
     def __init__(self, data, filename=None, dtype=None, unit=None,
-                 memmap=False):
+                 memmap=None):
         if isinstance(data, u.Quantity) and unit is not None:
             raise ValueError('astropy Quantity and unit set together')
         elif isinstance(data, u.Quantity):
@@ -110,9 +285,27 @@ class MemMapArray:
         self.set_filename(filename)
         self.set_unit(unit)
         self._file_lock = True
+        self._pinned = memmap is False
+
+        # With memmap=None, the memory budget decides
+        if memmap is None and self._contained is not None and \
+           self._filename is not None:
+            memmap = cache_manager.wants_memmap(self._contained.nbytes)
+        self._cache_key = cache_manager.register(self)
 
         if memmap:
             self.enable_memmap()
+        elif self._contained is not None:
+            cache_manager.enforce_memory(keep=self)
+
+    # Attributes that change the memory usage tracked by the cache manager
+    _accounted = frozenset(['_contained', '_pinned', '_cow', '_lazy',
+                            '_shared', '_shm', '_filename'])
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._accounted and self._cache_manager is not None:
+            self._cache_manager.account(self)
 
     @property  # read only
     def empty(self):
@@ -127,7 +320,7 @@ class MemMapArray:
     @property  # read only
     def filename(self):
         """Name of the file where data is cached, if memmap enabled."""
-        if self.memmap and self._contained is not None:
+        if isinstance(self._contained, np.memmap) and not self._foreign:
             return self._contained.filename
         return self._filename
 
@@ -136,6 +329,84 @@ class MemMapArray:
         """True if memmap is enabled."""
         return self._memmap
 
+    @property  # read only
+    def lazy(self):
+        """True if the data is read from a file not owned by this instance.
+
+        In this case, the cache file is only created when data is written.
+        """
+        return self._lazy
+
+    @property  # read only
+    def shared(self):
+        """True if the data is a buffer shared with other processes."""
+        return self._shared or self._shm is not None
+
+    @property
+    def backend(self):
+        """Name of the storage backend: ``'numpy'``, ``'memmap'`` or an
+        external backend, like ``'dask'``."""
+        if self._backend is not None:
+            return self._backend.name
+        return 'memmap' if self._memmap else 'numpy'
+
+    def set_backend(self, backend, **options):
+        """Change the storage backend of the data.
+
+        Parameters:
+        -----------
+            backend : string or `~astropop.framedata.backends.ArrayBackend`
+                ``'numpy'`` keeps the data in memory, ``'memmap'`` in the
+                cache file and ``'dask'`` in a lazy dask array. Leaving a
+                lazy backend computes the data.
+            options :
+                Options of the backend, like ``chunks`` for dask.
+        """
+        backend = get_backend(backend, **options)
+        if backend.name in ('numpy', 'memmap'):
+            self._leave_backend()
+            if backend.memmap:
+                self.enable_memmap()
+            else:
+                self.disable_memmap(remove=True)
+            return
+
+        self._leave_backend()
+        self.disable_memmap(remove=True)
+        if not self.empty:
+            if not _is_constant(self._contained):
+                self._materialize()
+            self._contained = backend.create(self._contained, self._filename)
+        self._lazy = False
+        self._shared = False
+        self._shm = None
+        self._drop_cow()
+        self._backend = backend
+
+    def _leave_backend(self):
+        # Compute the data of an external backend to memory.
+        if self._backend is None:
+            return
+        if not self.empty:
+            self._contained = self._backend.to_numpy(self._contained)
+        self._backend = None
+
+    @property
+    def pinned(self):
+        """True if the data is never spilled to disk by the memory budget
+        of `~astropop.framedata.cache_manager`."""
+        return self._pinned
+
+    @pinned.setter
+    def pinned(self, value):
+        self._pinned = bool(value)
+
+    @property
+    def _foreign(self):
+        # True if the contained buffer is not owned. Its file must never be
+        # removed or moved.
+        return self._lazy or self._shared
+
     def set_filename(self, value):
         """Set the memmap filename.
 
@@ -152,11 +423,10 @@ class MemMapArray:
         elif value != self._filename:
             raise ValueError('Filename locked.')
 
-        if self.memmap:
+        if self.memmap and isinstance(self._contained, np.memmap) and \
+           not self._foreign:
             if value != self._contained.filename:
-                n_mm = create_array_memmap(value, self._contained)
-                delete_array_memmap(self._contained, read=False, remove=True)
-                self._contained = n_mm
+                self._contained = _move_array_memmap(self._contained, value)
 
     def set_unit(self, value=None):
         """Set the data physical unit.
@@ -185,11 +455,340 @@ class MemMapArray:
         if self.memmap:
             return
 
+        self._leave_backend()
         if filename is not None:
             self.set_filename(filename)
 
+        if _is_constant(self._contained):
+            # The file is created only when the data is written
+            self._memmap = True
+            return
+
         self._contained = create_array_memmap(self._filename, self._contained)
         self._memmap = True
+        self._shared = False
+        self._shm = None
+        if self._cow is not None:
+            # The new file is a private copy
+            self._lazy = False
+            self._drop_cow()
+        self._cache_written()
+
+    def attach_file(self, filename, dtype, shape, offset=0, unit=None):
+        """Use data stored in an existing file, without copying it.
+
+        The file is memmapped in copy-on-write mode and is never changed.
+        The instance cache file is only created when data is written using
+        this container.
+
+        Parameters:
+        -----------
+            filename : string
+                Name of the file containing the raw data.
+            dtype : string or `numpy.dtype`
+                Data type, including byte order, of the data in the file.
+            shape : tuple
+                Shape of the data.
+            offset : int (optional)
+                Position, in bytes, of the data in the file.
+            unit : string or `astropy.units.Unit` (optional)
+                Physical unit of the data.
+        """
+        if self.memmap and not self._foreign:
+            delete_array_memmap(self._contained, read=False, remove=True)
+        self._contained = open_array_memmap(filename, dtype, shape, offset)
+        self._drop_cow()
+        self._shared = False
+        self._memmap = True
+        self._lazy = True
+        self.set_unit(unit)
+
+    def to_shared(self):
+        """Share the data with other processes, without copies.
+
+        Memmapped data is shared using the cache file. In-memory data is
+        moved, only once, to a `multiprocessing.shared_memory` block, that is
+        released when this instance is garbage collected.
+
+        Returns
+        -------
+        dict or None :
+            Picklable description of the shared buffer, to be used in
+            `MemMapArray.attach_shared`. `None` for empty containers.
+        """
+        if self.empty:
+            return None
+
+        # Lazy backends are computed. Only real buffers can be shared.
+        self._leave_backend()
+        spec = {'dtype': self._contained.dtype.str,
+                'shape': self._contained.shape,
+                'unit': self.unit.to_string()}
+        if _is_constant(self._contained):
+            # Constants are sent by value, and stay not allocated
+            spec['constant'] = self._contained.flat[0]
+            return spec
+
+        # lazy data must be owned to be shared for writing
+        self._materialize()
+        if isinstance(self._contained, np.memmap):
+            self.flush()
+            spec['filename'] = self._contained.filename
+            spec['offset'] = self._contained.offset
+            return spec
+
+        if self._shm is None:
+            from multiprocessing import shared_memory
+            data = self._contained
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(data.nbytes, 1))
+            shared = np.ndarray(data.shape, dtype=data.dtype,
+                                buffer=shm.buf)
+            shared[...] = data
+            self._contained = shared
+            self._shm = shm
+            weakref.finalize(self, _release_shared_memory, shm, True)
+        spec['shm'] = self._shm.name
+        return spec
+
+    def attach_shared(self, spec):
+        """Use a buffer shared by other process with `to_shared`.
+
+        No data is copied. Changes in the data are seen by all processes.
+
+        Parameters:
+        -----------
+            spec : dict or None
+                Shared buffer description, returned by
+                `MemMapArray.to_shared`.
+        """
+        self.reset_data(None)
+        if spec is None:
+            return
+
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        if 'constant' in spec:
+            self.reset_data(np.broadcast_to(np.array(spec['constant'],
+                                                     dtype=dtype), shape),
+                            unit=spec['unit'])
+            return
+        if 'filename' in spec:
+            self._contained = np.memmap(spec['filename'], mode='r+',
+                                        dtype=dtype, shape=shape,
+                                        offset=spec['offset'])
+            self._memmap = True
+        else:
+            from multiprocessing import shared_memory
+            shm = shared_memory.SharedMemory(name=spec['shm'])
+            self._contained = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            weakref.finalize(self, _release_shared_memory, shm, False)
+            self._memmap = False
+        self._shared = True
+        self.set_unit(spec['unit'])
+
+    def __getstate__(self):
+        # Pickle by value. Memmap, lazy and shared states are not kept, so
+        # the new instance never touches the files of this one.
+        state = self.__dict__.copy()
+        state.pop('_shm', None)
+        state.pop('_cow', None)
+        state.pop('_cow_release', None)
+        state.pop('_backend', None)
+        state.pop('_cache_manager', None)
+        if self._backend is not None and self._contained is not None:
+            state['_contained'] = self._backend.to_numpy(self._contained)
+        elif self._contained is not None:
+            state['_contained'] = np.asarray(self._contained)
+        state['_memmap'] = False
+        state['_lazy'] = False
+        state['_shared'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # A new cache file, so memmap or memory budget spills of this
+        # instance never write in the file of the pickled one.
+        if self._filename is not None:
+            ext = os.path.splitext(self._filename)[1]
+            self._filename = os.path.join(os.path.dirname(self._filename),
+                                          cache_manager.new_filename(ext))
+        self._cache_key = cache_manager.register(self)
+
+    def _materialize(self):
+        """Create the owned data copy before writing, if lazy."""
+        if not self._lazy:
+            return
+        contained = self._contained
+        if self._cow is not None and self._cow[0] == 1 and \
+           self._owns(contained):
+            # Last holder of its own buffer. Just make it writeable again.
+            try:
+                contained.flags.writeable = True
+                contained = None
+            except ValueError:
+                contained = self._contained
+        if contained is None:
+            pass
+        elif self.memmap and contained.ndim > 0:
+            # Other copies may still map the old file. Unlink it first, so
+            # the new file does not truncate their data.
+            if self._filename is not None and os.path.exists(self._filename):
+                os.remove(self._filename)
+            self._contained = create_array_memmap(self._filename, contained)
+        else:
+            self._contained = np.array(contained)
+        if contained is not None:
+            self._shared = False
+        self._lazy = False
+        self._drop_cow()
+        if self.memmap:
+            self._cache_written()
+
+    def _owns(self, contained):
+        # Check if a copy-on-write buffer belongs to this instance.
+        if not isinstance(contained, np.memmap):
+            return not self.memmap
+        name = getattr(contained, 'filename', None)
+        return name is not None and self._filename is not None and \
+            os.path.abspath(name) == os.path.abspath(self._filename)
+
+    def _owns_file(self):
+        # True if the data is memmapped in the cache file of this instance.
+        return isinstance(self._contained, np.memmap) and \
+            self._owns(self._contained)
+
+    def _can_overwrite(self, data, dtype=None):
+        # Check if new data can be written in the owned memmap file.
+        c = self._contained
+        if not isinstance(c, np.memmap) or not c.flags.writeable or \
+           self._foreign or self._shm is not None or \
+           getattr(data, 'shape', None) != c.shape:
+            return False
+        return np.dtype(dtype or data.dtype) == c.dtype
+
+    def _inplace_buffer(self, shape, dtype):
+        # Writable contained buffer to receive a result of shape and dtype
+        # in place. None if the result does not fit in it.
+        c = self._contained
+        if self.empty or self._backend is not None or \
+           not isinstance(c, np.ndarray) or _is_constant(c) or \
+           c.shape != tuple(shape) or c.dtype != np.dtype(dtype):
+            return None
+        self._materialize()
+        if not self._contained.flags.writeable:
+            return None
+        if self._memmap or cache_manager._memory_budget is not None:
+            cache_manager.touch(self._cache_key)
+        return self._contained
+
+    def _in_ram(self):
+        # True if the data is owned by this instance and stored in memory.
+        c = self._contained
+        return isinstance(c, np.ndarray) and not isinstance(c, np.memmap) \
+            and not self._foreign and self._shm is None and c.ndim > 0 \
+            and not _is_constant(c)
+
+    def _cache_written(self):
+        # Data was written to the cache file. Keep the cache under quota.
+        cache_manager.touch(self._cache_key)
+        cache_manager.enforce(keep=self)
+
+    def _drop_cow(self):
+        # Leave the copy-on-write group, if any.
+        if self._cow_release is not None:
+            self._cow_release()
+        self._cow = None
+        self._cow_release = None
+
+    def _join_cow(self, counter):
+        # Join a copy-on-write group, sharing the buffer with other copies.
+        counter[0] += 1
+        self._cow = counter
+        self._cow_release = weakref.finalize(self, _release_cow, counter)
+
+    def _copy(self, filename=None, deep=False):
+        """Copy this instance.
+
+        Parameters:
+        -----------
+            filename : string or None (optional)
+                Cache file name of the new instance. If `None`, a new name
+                is created in the folder of the current file.
+            deep : bool (optional)
+                If `True`, the data is copied right now. Memmap files are
+                copied at file level. If `False`, the data is shared, as
+                read-only, until one of the instances writes it.
+        """
+        if filename is None:
+            filename = _copy_filename(self._filename)
+        new = MemMapArray(None, filename=filename, unit=self.unit)
+        new._memmap = self.memmap
+        new._backend = self._backend
+        if self.empty:
+            return new
+
+        if self._backend is not None:
+            # Graphs are immutable. A new array object is enough.
+            new._contained = self._contained.copy()
+            return new
+
+        contained = self._contained
+        if _is_constant(contained):
+            # Read-only constants are shared even by deep copies
+            new._contained = contained
+            new._lazy = True
+            return new
+
+        if deep:
+            if isinstance(contained, np.memmap) and not self._foreign:
+                contained.flush()
+                shutil.copyfile(contained.filename, filename)
+                new._contained = np.memmap(filename, mode='r+',
+                                           dtype=contained.dtype,
+                                           shape=contained.shape)
+            elif self.memmap and contained.ndim > 0:
+                new._contained = create_array_memmap(filename, contained)
+            else:
+                new._contained = np.array(contained)
+            if new.memmap:
+                new._cache_written()
+            return new
+
+        if self._cow is None:
+            # Both instances hold read-only views. Writes through the
+            # views raise errors, instead of changing the other copy.
+            view = contained.view()
+            view.flags.writeable = False
+            self._contained = view
+            self._lazy = True
+            self._join_cow([0])
+        new._contained = self._contained.view()
+        new._lazy = True
+        new._join_cow(self._cow)
+        return new
+
+    def _trim(self, item):
+        """Keep only a region of the data, without copying it.
+
+        The region is a read-only view of the current buffer, written only
+        on demand, like copy-on-write copies. So, only the region is ever
+        copied.
+        """
+        if self.empty:
+            return
+        view = self._contained[item]
+        if self._backend is None:
+            view = view.view()
+            view.flags.writeable = False
+            self._lazy = True
+        self._contained = view
+
+    def __copy__(self):
+        return self._copy(deep=False)
+
+    def __deepcopy__(self, memo):
+        return self._copy(deep=True)
 
     def disable_memmap(self, remove=False):
         """Disable data file memmapping (read to memory).
@@ -202,16 +801,29 @@ class MemMapArray:
         if not self.memmap:
             return
 
+        if _is_constant(self._contained):
+            self._memmap = False
+            return
+
+        if self._foreign:
+            # Never remove a file not owned by this instance
+            self._contained = np.array(self._contained)
+            self._memmap = False
+            self._lazy = False
+            self._shared = False
+            self._drop_cow()
+            return
+
         self._contained = delete_array_memmap(self._contained, read=True,
                                               remove=remove)
         self._memmap = False
 
     def flush(self):
         """Write changes to disk if memmapping."""
-        if self.memmap:
+        if self.memmap and not self._lazy:
             self._contained.flush()
 
-    def reset_data(self, data=None, unit=None, dtype=None):
+    def reset_data(self, data=None, unit=None, dtype=None, copy=True):
         """Set new data.
 
         Parameters:
@@ -222,6 +834,9 @@ class MemMapArray:
                 Physical unit of the data.
             dtype : string or `numpy.dtype` (optional)
                 Imposed data type.
+            copy : bool (optional)
+                If False, a `numpy.ndarray` kept in memory is owned without
+                a copy, so it must not be used by the caller anymore.
         """
         if data is None:
             if self.memmap:
@@ -232,20 +847,67 @@ class MemMapArray:
             else:
                 # don't need to delete memmap
                 self._contained = None
+            self._lazy = False
+            self._shared = False
+            self._shm = None
+            self._drop_cow()
             self.set_unit(None)
 
         # Not None data
         else:
             adata = data
             if isinstance(data, MemMapArray):
-                adata = MemMapArray._contained
-            if self.memmap:
+                adata = data._contained
+            constant = self._backend is None and _is_constant(adata)
+            if self._backend is not None:
+                self._contained = self._backend.create(adata, self._filename,
+                                                       dtype)
+            elif constant:
+                # Keep broadcasted constants. Full array is only allocated
+                # when some element is written.
+                if self.memmap and not self._foreign:
+                    delete_array_memmap(self._contained, read=False,
+                                        remove=True)
+                value = np.array(adata.flat[0], dtype=dtype or adata.dtype)
+                self._contained = np.broadcast_to(value, adata.shape)
+            elif self.memmap and self._foreign:
+                # Old file is not owned. Do not delete it. Own file may still
+                # be mapped by copies, so unlink it before creating again.
                 name = self.filename
-                mm = self._contained
+                if name is not None and os.path.exists(name):
+                    os.remove(name)
+                self._contained = create_array_memmap(name, adata, dtype)
+            elif self.memmap and self._can_overwrite(adata, dtype):
+                # Same shape and dtype. Write in the existing mapping,
+                # instead of creating a new file.
+                if adata is not self._contained:
+                    np.copyto(self._contained, np.asarray(adata),
+                              casting='unsafe')
+            elif self.memmap:
+                # Remove the old file first, since the new one has the
+                # same name. Old mapping keeps valid until dereferenced.
+                name = self.filename
+                delete_array_memmap(self._contained, read=False, remove=True)
                 self._contained = create_array_memmap(name, adata, dtype)
-                delete_array_memmap(mm, read=False, remove=True)
+            elif not self._pinned and self._filename is not None and \
+                    cache_manager.wants_memmap(_nbytes(adata, dtype), self):
+                # Does not fit in the memory budget. Go to disk.
+                self._contained = create_array_memmap(self._filename,
+                                                      np.asarray(adata),
+                                                      dtype)
+                self._memmap = True
             else:
-                self._contained = np.array(adata, dtype=dtype)
+                if copy:
+                    adata = np.array(adata, dtype=dtype)
+                self._contained = np.asarray(adata, dtype=dtype)
+                # Make room in the memory budget, if needed
+                cache_manager.enforce_memory(keep=self)
+            self._lazy = constant
+            self._shared = False
+            self._shm = None
+            self._drop_cow()
+            if self.memmap and not constant:
+                self._cache_written()
 
             # Unit handling
             if hasattr(data, 'unit'):
@@ -265,6 +927,9 @@ class MemMapArray:
         if self.empty:
             raise EmptyDataError('Empty data contaier')
 
+        if self._memmap or cache_manager._memory_budget is not None:
+            # Keep LRU order only if there is something to evict
+            cache_manager.touch(self._cache_key)
         # This cannot create a new MemMapArray to don't break a[x][y] = z
         result = self._contained[item]
         return result
@@ -272,70 +937,111 @@ class MemMapArray:
     def __setitem__(self, item, value):
         if self.empty:
             raise EmptyDataError('Empty data container')
+        self._materialize()
+        if self._memmap or cache_manager._memory_budget is not None:
+            cache_manager.touch(self._cache_key)
         self._contained[item] = value
 
-    def __getattribute__(self, item):
-        if item in redirects and not self.empty:
-            attr = getattr(self._contained, item)
-            if callable(attr):
-                attr = to_memmap_attr(attr)
-            elif isinstance(attr, np.ndarray):
-                attr = MemMapArray(attr, memmap=False)
-            return attr
-        elif item in redirects and self.empty:
-            raise EmptyDataError('Empty data container')
-
-        return object.__getattribute__(self, item)
-
     def __repr__(self):
         return 'MemMapArray:\n' + repr(self._contained) + \
                f'\nfile: {self.filename}'
 
-    def __array__(self, dtype=None):
+    def __array__(self, dtype=None, copy=None):
         if self.empty:
             return np.array(None)
-        else:
-            # Ignore memmapping
-            return np.array(self._contained, dtype=dtype)
-
-    __lt__ = to_memmap_operator('__lt__')
-    __le__ = to_memmap_operator('__le__')
-    __gt__ = to_memmap_operator('__gt__')
-    __ge__ = to_memmap_operator('__ge__')
-    __eq__ = to_memmap_operator('__eq__')
-    __ne__ = to_memmap_operator('__ne__')
-    __add__ = to_memmap_operator('__add__')
-    __sub__ = to_memmap_operator('__sub__')
-    __mul__ = to_memmap_operator('__mul__')
-    __pow__ = to_memmap_operator('__pow__')
-    __truediv__ = to_memmap_operator('__truediv__')
-    __floordiv__ = to_memmap_operator('__floordiv__')
-    __mod__ = to_memmap_operator('__mod__')
-    __lshift__ = to_memmap_operator('__lshift__')
-    __rshift__ = to_memmap_operator('__rshift__')
-    __and__ = to_memmap_operator('__and__')
-    __or__ = to_memmap_operator('__or__')
-    __xor__ = to_memmap_operator('__xor__')
-    __neg__ = to_memmap_operator('__neg__')
-    __pos__ = to_memmap_operator('__pos__')
-    __abs__ = to_memmap_operator('__abs__')
-    __invert__ = to_memmap_operator('__invert__')
-    __matmul__ = to_memmap_operator('__matmul__')
+        if self._memmap or cache_manager._memory_budget is not None:
+            cache_manager.touch(self._cache_key)
+        if copy:
+            return np.array(self._contained, dtype=dtype, copy=True)
+        # Ignore memmapping. Return a view when possible.
+        return np.asarray(self._contained, dtype=dtype).view(np.ndarray)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # numpy functions return numpy arrays, like before, but computed
+        # directly from the contained data, without intermediate copies.
+        inputs = unwrap_array(inputs)
+        out = kwargs.get('out', None)
+        if out is not None:
+            # Results are written directly in the out buffers, memmap or not.
+            for i in out:
+                if isinstance(i, MemMapArray):
+                    i._materialize()
+            kwargs['out'] = unwrap_array(out)
+
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+
+        if out is not None:
+            if len(out) == 1:
+                return out[0]
+            return out
+        return result
+
+    def __array_function__(self, func, types, args, kwargs):
+        args = unwrap_array(args)
+        kwargs = {k: unwrap_array(v) for k, v in kwargs.items()}
+        return func(*args, **kwargs)
+
+    __lt__ = to_memmap_ufunc(np.less)
+    __le__ = to_memmap_ufunc(np.less_equal)
+    __gt__ = to_memmap_ufunc(np.greater)
+    __ge__ = to_memmap_ufunc(np.greater_equal)
+    __eq__ = to_memmap_ufunc(np.equal)
+    __ne__ = to_memmap_ufunc(np.not_equal)
+    __add__ = to_memmap_ufunc(np.add)
+    __sub__ = to_memmap_ufunc(np.subtract)
+    __mul__ = to_memmap_ufunc(np.multiply)
+    __pow__ = to_memmap_ufunc(np.power)
+    __truediv__ = to_memmap_ufunc(np.true_divide)
+    __floordiv__ = to_memmap_ufunc(np.floor_divide)
+    __mod__ = to_memmap_ufunc(np.remainder)
+    __lshift__ = to_memmap_ufunc(np.left_shift)
+    __rshift__ = to_memmap_ufunc(np.right_shift)
+    __and__ = to_memmap_ufunc(np.bitwise_and)
+    __or__ = to_memmap_ufunc(np.bitwise_or)
+    __xor__ = to_memmap_ufunc(np.bitwise_xor)
+    __matmul__ = to_memmap_ufunc(np.matmul)
+    __radd__ = to_memmap_ufunc(np.add, reflected=True)
+    __rsub__ = to_memmap_ufunc(np.subtract, reflected=True)
+    __rmul__ = to_memmap_ufunc(np.multiply, reflected=True)
+    __rpow__ = to_memmap_ufunc(np.power, reflected=True)
+    __rtruediv__ = to_memmap_ufunc(np.true_divide, reflected=True)
+    __rfloordiv__ = to_memmap_ufunc(np.floor_divide, reflected=True)
+    __rmod__ = to_memmap_ufunc(np.remainder, reflected=True)
+    __rlshift__ = to_memmap_ufunc(np.left_shift, reflected=True)
+    __rrshift__ = to_memmap_ufunc(np.right_shift, reflected=True)
+    __rand__ = to_memmap_ufunc(np.bitwise_and, reflected=True)
+    __ror__ = to_memmap_ufunc(np.bitwise_or, reflected=True)
+    __rxor__ = to_memmap_ufunc(np.bitwise_xor, reflected=True)
+    __rmatmul__ = to_memmap_ufunc(np.matmul, reflected=True)
+    __neg__ = to_memmap_ufunc(np.negative)
+    __pos__ = to_memmap_ufunc(np.positive)
+    __abs__ = to_memmap_ufunc(np.absolute)
+    __invert__ = to_memmap_ufunc(np.invert)
+    __iadd__ = to_memmap_ufunc(np.add, inplace=True)
+    __isub__ = to_memmap_ufunc(np.subtract, inplace=True)
+    __ipow__ = to_memmap_ufunc(np.power, inplace=True)
+    __imul__ = to_memmap_ufunc(np.multiply, inplace=True)
+    __itruediv__ = to_memmap_ufunc(np.true_divide, inplace=True)
+    __ifloordiv__ = to_memmap_ufunc(np.floor_divide, inplace=True)
+    __imod__ = to_memmap_ufunc(np.remainder, inplace=True)
+    __ilshift__ = to_memmap_ufunc(np.left_shift, inplace=True)
+    __irshift__ = to_memmap_ufunc(np.right_shift, inplace=True)
+    __iand__ = to_memmap_ufunc(np.bitwise_and, inplace=True)
+    __ior__ = to_memmap_ufunc(np.bitwise_or, inplace=True)
+    __ixor__ = to_memmap_ufunc(np.bitwise_xor, inplace=True)
     __bool__ = to_memmap_operator('__bool__')
     __float__ = to_memmap_operator('__float__')
     __complex__ = to_memmap_operator('__complex__')
     __int__ = to_memmap_operator('__int__')
-    __iadd__ = to_memmap_operator('__iadd__')
-    __isub__ = to_memmap_operator('__isub__')
-    __ipow__ = to_memmap_operator('__ipow__')
-    __imul__ = to_memmap_operator('__imul__')
-    __itruediv__ = to_memmap_operator('__itruediv__')
-    __ifloordiv__ = to_memmap_operator('__ifloordiv__')
-    __imod__ = to_memmap_operator('__imod__')
-    __ilshift__ = to_memmap_operator('__ilshift__')
-    __irshift__ = to_memmap_operator('__irshift__')
-    __iand__ = to_memmap_operator('__iand__')
-    __ior__ = to_memmap_operator('__ior__')
-    __ixor__ = to_memmap_operator('__ixor__')
     __len__ = to_memmap_operator('__len__')
     __contains__ = to_memmap_operator('__contains__')
+
+
+for _kind, _names in [('plain', redirects_plain),
+                      ('array', redirects_array),
+                      ('method', redirects_method)]:
+    for _name in _names:
+        _prop = _redirect_property(_name, 'method_inplace'
+                                   if _name in redirects_inplace else _kind)
+        setattr(MemMapArray, _name, _prop)
+del _kind, _names, _name, _prop
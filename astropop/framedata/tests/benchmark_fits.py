@@ -0,0 +1,83 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Benchmark of tile-compressed FITS read/write.
+
+Compares the single-threaded `~astropy.io.fits.CompImageHDU` with the
+threaded tile codec of `astropop.framedata.compressed`. Not collected by
+pytest. Run with:
+
+    python -m astropop.framedata.tests.benchmark_fits
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+
+from astropop.framedata.compressed import write_compressed_hdu, \
+                                          read_compressed_hdu
+
+
+def _best(func, repeat=3):
+    """Best wall time of ``func``, in seconds."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def benchmark_compressed(size=4096, dtype='uint16', compression='RICE_1'):
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000, 30, (size, size)).astype(dtype)
+    folder = tempfile.mkdtemp(prefix='astropop_bench')
+    single = os.path.join(folder, 'single.fz')
+    threaded = os.path.join(folder, 'threaded.fz')
+    tile_shape = (16, size)
+    section = (slice(size//4, size//4 + 256), slice(0, size))
+
+    def write_single():
+        hdu = fits.CompImageHDU(data, compression_type=compression,
+                                tile_shape=tile_shape)
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(single,
+                                                       overwrite=True)
+
+    def write_threaded():
+        if os.path.exists(threaded):
+            os.remove(threaded)
+        write_compressed_hdu(threaded, fits.Header(), data,
+                             compression=compression, tile_shape=tile_shape)
+
+    def read_single():
+        with fits.open(single) as hdul:
+            return hdul[1].data
+
+    def read_section_single():
+        with fits.open(single) as hdul:
+            return hdul[1].section[section]
+
+    results = {}
+    results['write CompImageHDU'] = _best(write_single)
+    results['write threaded'] = _best(write_threaded)
+    results['read CompImageHDU'] = _best(read_single)
+    results['read threaded'] = _best(lambda: read_compressed_hdu(threaded))
+    results['read section CompImageHDU'] = _best(read_section_single)
+    results['read section threaded'] = _best(
+        lambda: read_compressed_hdu(threaded, section=section))
+    shutil.rmtree(folder)
+    return results
+
+
+def main():
+    print(f'{os.cpu_count()} CPUs')
+    for dtype, compression in [('uint16', 'RICE_1'), ('f4', 'GZIP_2')]:
+        print(f'4096x4096 {dtype} {compression}')
+        for name, value in benchmark_compressed(4096, dtype,
+                                                compression).items():
+            print(f'    {name:<28} {value*1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
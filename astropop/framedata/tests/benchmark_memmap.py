@@ -0,0 +1,78 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Microbenchmarks for MemMapArray.
+
+Not collected by pytest. Run with:
+
+    python -m astropop.framedata.tests.benchmark_memmap
+"""
+
+import os
+import timeit
+import itertools
+import tempfile
+import numpy as np
+
+from astropop.framedata import MemMapArray, FrameData
+
+
+def _timeit(stmt, number=100000, repeat=5, **namespace):
+    """Best time per call, in nanoseconds."""
+    timer = timeit.Timer(stmt, globals=namespace)
+    return min(timer.repeat(repeat=repeat, number=number))/number*1e9
+
+
+def benchmark_attribute_access(memmap=False):
+    """Attribute access latency of MemMapArray compared to numpy."""
+    arr = np.zeros((64, 64))
+    folder = tempfile.mkdtemp(prefix='astropop_bench')
+    fname = os.path.join(folder, 'bench.npy')
+    a = MemMapArray(arr, filename=fname, memmap=memmap)
+
+    results = {}
+    results['ndarray.shape'] = _timeit('arr.shape', arr=arr)
+    results['MemMapArray.shape'] = _timeit('a.shape', a=a)
+    results['MemMapArray.dtype'] = _timeit('a.dtype', a=a)
+    results['MemMapArray.unit'] = _timeit('a.unit', a=a)
+    results['MemMapArray.empty'] = _timeit('a.empty', a=a)
+    results['MemMapArray.memmap'] = _timeit('a.memmap', a=a)
+    results['MemMapArray._contained'] = _timeit('a._contained', a=a)
+    results['MemMapArray[0, 0]'] = _timeit('a[0, 0]', a=a)
+
+    a.disable_memmap(remove=True)
+    os.rmdir(folder)
+    return results
+
+
+def benchmark_data_assignment(size=2048, memmap=True, number=20):
+    """Repeated ``frame.data = ...`` assignments, like ccd_processing."""
+    folder = tempfile.mkdtemp(prefix='astropop_bench')
+    frame = FrameData(np.zeros((size, size)), cache_folder=folder,
+                      use_memmap_backend=memmap)
+    values = itertools.cycle([np.full((size, size), i, dtype='f8')
+                              for i in range(2)])
+
+    results = {}
+    results['same shape and dtype'] = _timeit(
+        'frame.data = next(values)', number=number, repeat=3,
+        frame=frame, values=values)
+    results['from own data'] = _timeit(
+        'frame.data = frame.data + 1', number=number, repeat=3,
+        frame=frame)
+    frame.disable_memmap()
+    os.rmdir(folder)
+    return results
+
+
+def main():
+    for memmap in [False, True]:
+        print(f'MemMapArray attribute access (memmap={memmap})')
+        for name, value in benchmark_attribute_access(memmap).items():
+            print(f'    {name:<26} {value:8.1f} ns')
+    for memmap in [False, True]:
+        print(f'FrameData 2048x2048 data assignment (memmap={memmap})')
+        for name, value in benchmark_data_assignment(memmap=memmap).items():
+            print(f'    {name:<26} {value/1e6:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
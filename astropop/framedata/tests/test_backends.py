@@ -0,0 +1,106 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import copy
+import pytest
+import numpy as np
+import numpy.testing as npt
+import pytest_check as check
+
+from astropop.framedata import FrameData, MemMapArray, get_backend, \
+                               register_backend, available_backends
+from astropop.framedata.backends import ArrayBackend, NumpyBackend
+
+
+def test_get_backend():
+    check.equal(get_backend('numpy').name, 'numpy')
+    check.equal(get_backend('memmap').name, 'memmap')
+    backend = NumpyBackend()
+    check.is_true(get_backend(backend) is backend)
+    with pytest.raises(ValueError):
+        get_backend('not_a_backend')
+
+
+def test_register_backend():
+    class Doubled(ArrayBackend):
+        name = 'doubled'
+
+        def create(self, data, filename=None, dtype=None):
+            return np.array(data, dtype=dtype)*2
+
+        def contains(self, value):
+            return isinstance(value, np.ndarray)
+
+    register_backend('doubled', Doubled)
+    check.is_in('doubled', available_backends())
+    a = MemMapArray(np.ones(3))
+    a.set_backend('doubled')
+    check.equal(a.backend, 'doubled')
+    npt.assert_array_equal(a, [2, 2, 2])
+    with pytest.raises(TypeError):
+        register_backend('wrong', int)
+
+
+def test_memmaparray_set_backend_numpy_memmap(tmpdir):
+    a = MemMapArray(np.arange(10), filename=tmpdir.join('a.npy').strpath)
+    check.equal(a.backend, 'numpy')
+    a.set_backend('memmap')
+    check.equal(a.backend, 'memmap')
+    check.is_true(a.memmap)
+    a.set_backend('numpy')
+    check.equal(a.backend, 'numpy')
+    check.is_false(a.memmap)
+    npt.assert_array_equal(a, np.arange(10))
+
+
+def test_memmaparray_dask(tmpdir):
+    da = pytest.importorskip('dask.array')
+    a = MemMapArray(np.arange(12.).reshape((3, 4)),
+                    filename=tmpdir.join('a.npy').strpath, unit='adu')
+    a.set_backend('dask', chunks=2)
+    check.equal(a.backend, 'dask')
+    check.is_instance(a._contained, da.Array)
+    check.equal(a.shape, (3, 4))
+    check.is_instance(a + 1, da.Array)
+
+    # new data is kept lazy
+    a.reset_data(a._contained*2)
+    check.is_instance(a._contained, da.Array)
+    npt.assert_array_equal(a, np.arange(12.).reshape((3, 4))*2)
+    a.reset_data(np.ones((2, 2)))
+    check.is_instance(a._contained, da.Array)
+
+    # copies do not share writes
+    b = copy.copy(a)
+    b[0, 0] = 10
+    check.equal(np.asarray(a)[0, 0], 1)
+    check.equal(np.asarray(b)[0, 0], 10)
+
+    # memmap computes the data
+    a.set_backend('memmap')
+    check.equal(a.backend, 'memmap')
+    check.is_instance(a._contained, np.memmap)
+    npt.assert_array_equal(a, np.ones((2, 2)))
+
+
+def test_framedata_dask():
+    da = pytest.importorskip('dask.array')
+    frame = FrameData(np.ones((10, 10)), unit='adu', uncertainty=2,
+                      backend='dask')
+    check.equal(frame.backend, 'dask')
+    check.is_instance(frame.data._contained, da.Array)
+    check.is_instance(frame._unct._contained, da.Array)
+    check.is_instance(frame.mask._contained, da.Array)
+    npt.assert_array_equal(frame.uncertainty, np.full((10, 10), 2))
+
+    frame.set_backend('numpy')
+    check.equal(frame.backend, 'numpy')
+    check.is_instance(frame.data._contained, np.ndarray)
+
+
+def test_framedata_dask_compact_mask():
+    pytest.importorskip('dask.array')
+    frame = FrameData(np.ones((10, 10)), mask_mode='packed', backend='dask')
+    check.equal(frame.backend, 'dask')
+    check.equal(frame.mask.backend, 'numpy')
+    with pytest.raises(ValueError):
+        frame.mask.set_backend('dask')
@@ -0,0 +1,242 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import os
+import gc
+import pytest
+import numpy as np
+import numpy.testing as npt
+import pytest_check as check
+
+from astropop.framedata import memmap
+
+from astropop.framedata import FrameData, MemMapArray, CacheManager, \
+                               cache_manager
+
+
+@pytest.fixture
+def quota(monkeypatch, tmpdir):
+    # A clean manager, tracking only the arrays of the test
+    manager = CacheManager(folder=tmpdir.strpath)
+    monkeypatch.setattr(memmap, 'cache_manager', manager)
+    return manager
+
+
+def _array(tmpdir, name, value=0, memmap=True):
+    return MemMapArray(np.full((10, 10), value, dtype='f8'),
+                       filename=tmpdir.join(name).strpath, memmap=memmap)
+
+
+def test_cache_manager_folder():
+    manager = CacheManager()
+    folder = manager.folder
+    check.is_true(os.path.isdir(folder))
+    check.equal(manager.folder, folder)
+    manager.cleanup()
+    check.is_false(os.path.exists(folder))
+
+
+def test_cache_manager_user_folder_kept(tmpdir):
+    manager = CacheManager(folder=tmpdir.strpath)
+    manager.cleanup()
+    check.is_true(os.path.isdir(tmpdir.strpath))
+
+
+def test_cache_manager_invalid():
+    with pytest.raises(ValueError):
+        CacheManager(policy='keep')
+    with pytest.raises(ValueError):
+        CacheManager(quota=-1)
+
+
+def test_cache_manager_new_filename():
+    manager = CacheManager()
+    a = manager.new_filename('.npy')
+    check.not_equal(a, manager.new_filename('.npy'))
+    check.is_true(a.endswith('.npy'))
+    check.equal(os.path.dirname(a), '')
+
+
+def test_frames_share_process_folder():
+    f1 = FrameData(np.zeros((10, 10)), use_memmap_backend=True)
+    f2 = FrameData(np.zeros((10, 10)), use_memmap_backend=True)
+    check.equal(f1.cache_folder, cache_manager.folder)
+    check.equal(f2.cache_folder, cache_manager.folder)
+    check.not_equal(f1.data.filename, f2.data.filename)
+
+
+def test_file_removed_on_collect(tmpdir):
+    a = _array(tmpdir, 'a.npy')
+    name = a.filename
+    check.is_true(os.path.exists(name))
+    del a
+    gc.collect()
+    check.is_false(os.path.exists(name))
+
+
+def test_frame_files_removed_on_collect():
+    frame = FrameData(np.zeros((10, 10)), uncertainty=np.ones((10, 10)),
+                      mask=np.zeros((10, 10)), use_memmap_backend=True)
+    names = [frame.data.filename, frame._unct.filename]
+    for name in names:
+        check.is_true(os.path.exists(name))
+    del frame
+    gc.collect()
+    for name in names:
+        check.is_false(os.path.exists(name))
+
+
+def test_usage(tmpdir, quota):
+    a = _array(tmpdir, 'a.npy')
+    check.equal(quota.usage(), a.nbytes)
+    # in memory arrays, constants and lazy copies have no files
+    b = _array(tmpdir, 'b.npy', memmap=False)
+    c = _array(tmpdir, 'c.npy')
+    c.reset_data(np.broadcast_to(1.0, (100, 100)))
+    check.equal(quota.usage(), a.nbytes)
+    del b, c
+
+
+def test_quota_spill_lru(tmpdir, quota):
+    a = _array(tmpdir, 'a.npy', 1)
+    b = _array(tmpdir, 'b.npy', 2)
+    quota.quota = a.nbytes + a.nbytes//2
+    # a is the least recently used
+    check.is_false(a.memmap)
+    check.is_true(b.memmap)
+    check.is_false(os.path.exists(tmpdir.join('a.npy').strpath))
+    npt.assert_array_equal(a, np.full((10, 10), 1))
+
+    c = _array(tmpdir, 'c.npy', 3)
+    quota.quota = quota.usage() - 1
+    _ = c[0, 0]  # c is now the most recent. b is evicted.
+    d = _array(tmpdir, 'd.npy', 4)
+    check.is_false(b.memmap)
+    check.is_true(d.memmap)
+    npt.assert_array_equal(b, np.full((10, 10), 2))
+
+
+def test_quota_keep_written(tmpdir, quota):
+    quota.quota = 0
+    a = _array(tmpdir, 'a.npy', 1)
+    # the array just written is never evicted
+    check.is_true(a.memmap)
+    b = _array(tmpdir, 'b.npy', 2)
+    check.is_false(a.memmap)
+    check.is_true(b.memmap)
+
+
+def test_quota_drop(tmpdir, quota):
+    quota.policy = 'drop'
+    a = _array(tmpdir, 'a.npy', 1)
+    quota.quota = 0
+    b = _array(tmpdir, 'b.npy', 2)
+    check.is_true(a.empty)
+    check.is_false(os.path.exists(tmpdir.join('a.npy').strpath))
+    check.is_true(b.memmap)
+
+
+def test_memory_budget_parse(monkeypatch):
+    check.is_none(CacheManager().memory_budget)
+    check.equal(CacheManager(memory_budget='1000').memory_budget, 1000)
+    check.greater(CacheManager(memory_budget='auto').memory_budget, 0)
+    monkeypatch.setenv('ASTROPOP_MEMORY_BUDGET', '2000')
+    check.equal(CacheManager().memory_budget, 2000)
+    with pytest.raises(ValueError):
+        CacheManager(memory_budget=-1)
+
+
+def test_memory_budget_construction(tmpdir, quota):
+    quota.memory_budget = 1000
+    a = _array(tmpdir, 'a.npy', 1, memmap=None)
+    check.is_false(a.memmap)
+    check.equal(quota.memory_usage(), 800)
+    # new data goes to memory, older is spilled
+    b = _array(tmpdir, 'b.npy', 2, memmap=None)
+    check.is_false(b.memmap)
+    check.is_true(a.memmap)
+    npt.assert_array_equal(a, np.full((10, 10), 1))
+    # explicit memmap=False is pinned in memory
+    c = _array(tmpdir, 'c.npy', 3, memmap=False)
+    check.is_false(c.memmap)
+    check.is_true(c.pinned)
+    check.is_true(b.memmap)
+    # no room left after the pinned array
+    d = _array(tmpdir, 'd.npy', 4, memmap=None)
+    check.is_true(d.memmap)
+    check.equal(quota.memory_usage(), 800)
+
+
+def test_memory_budget_reset_data(tmpdir, quota):
+    quota.memory_budget = 1000
+    a = _array(tmpdir, 'a.npy', 1, memmap=None)
+    # replacing the data of the same size fits in the budget
+    a.reset_data(np.zeros((10, 10)))
+    check.is_false(a.memmap)
+    a.reset_data(np.zeros((20, 10)))
+    check.is_true(a.memmap)
+    npt.assert_array_equal(a, np.zeros((20, 10)))
+    check.equal(quota.memory_usage(), 0)
+
+
+def test_memory_budget_spill_lru(tmpdir, quota):
+    quota.memory_budget = 10000
+    a = _array(tmpdir, 'a.npy', 1, memmap=None)
+    b = _array(tmpdir, 'b.npy', 2, memmap=None)
+    c = _array(tmpdir, 'c.npy', 3, memmap=None)
+    _ = a[0, 0]  # b is the least recently used now
+    quota.memory_budget = 1000
+    check.is_true(b.memmap)
+    check.is_true(c.memmap)
+    check.is_false(a.memmap)
+    check.equal(quota.memory_usage(), 800)
+    npt.assert_array_equal(b, np.full((10, 10), 2))
+
+    # new arrays in memory spill the least recently used
+    d = MemMapArray(None, filename=tmpdir.join('d.npy').strpath)
+    d.reset_data(np.zeros((10, 10)))
+    check.is_false(d.memmap)
+    check.is_true(a.memmap)
+
+
+def test_memory_budget_framedata(quota):
+    quota.memory_budget = 1000
+    auto = FrameData(np.zeros((20, 20)), uncertainty=np.ones((20, 20)))
+    check.is_true(auto.data.memmap)
+    check.is_true(auto._unct.memmap)
+    pinned = FrameData(np.zeros((20, 20)), use_memmap_backend=False)
+    check.is_false(pinned.data.memmap)
+    check.is_true(pinned.data.pinned)
+    check.is_true(pinned.mask.pinned)
+
+
+def test_memory_usage_counters(tmpdir, quota, monkeypatch):
+    def _usage():
+        arrays = quota._live()
+        return (sum(quota._ram_size(a) for a in arrays),
+                sum(quota._ram_size(a) for a in arrays
+                    if not quota._spillable(a)))
+
+    a = _array(tmpdir, 'a.npy', 1, memmap=False)
+    b = _array(tmpdir, 'b.npy', 2, memmap=None)
+    c = MemMapArray(None, filename=tmpdir.join('c.npy').strpath)
+    c.reset_data(np.zeros((20, 10)))
+    d = b.copy()
+    d[0, 0] = 5
+    b.enable_memmap()
+    a.pinned = False
+    c.reset_data(np.zeros((5, 10)))
+    e = a.copy()
+    check.equal((quota._ram_total, quota._ram_fixed), _usage())
+    del d, e
+    gc.collect()
+    check.equal((quota._ram_total, quota._ram_fixed), _usage())
+    b.disable_memmap()
+    c.enable_memmap()
+    check.equal((quota._ram_total, quota._ram_fixed), _usage())
+
+    # the budget never walks the arrays to check new data
+    monkeypatch.setattr(quota, '_live', None)
+    quota._memory_budget = 10**6
+    check.is_false(quota.wants_memmap(800))
+    check.is_true(quota.wants_memmap(10**6 + 1))
+    quota.enforce_memory()
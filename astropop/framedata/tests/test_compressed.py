@@ -0,0 +1,133 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import pytest
+import numpy as np
+import numpy.testing as npt
+import pytest_check as check
+from astropy.io import fits
+
+from astropop.framedata import FrameData
+from astropop.framedata.compressed import write_compressed_hdu, \
+                                          read_compressed_hdu
+from astropop.framedata.utils import framedata_read_fits, \
+                                     framedata_write_fits
+
+
+def _image(dtype, shape=(101, 67)):
+    rng = np.random.default_rng(42)
+    return rng.normal(1000, 30, shape).astype(dtype)
+
+
+@pytest.mark.parametrize('dtype,compression',
+                         [('uint16', None), ('int16', 'RICE_1'),
+                          ('int32', 'GZIP_1'), ('int64', None),
+                          ('f4', None), ('f8', 'GZIP_1'), ('f8', 'GZIP_2'),
+                          ('uint8', 'RICE_1')])
+def test_write_compressed_lossless(tmpdir, dtype, compression):
+    data = _image(dtype)
+    header = fits.Header({'OBSERVER': 'Edwin Hubble'})
+    filename = tmpdir.join('image.fz').strpath
+    write_compressed_hdu(filename, header, data, compression=compression,
+                         tile_shape=(10, 67), n_threads=4, batch=3)
+
+    with fits.open(filename) as hdul:
+        hdul.verify('exception')
+        check.equal(len(hdul), 2)
+        check.is_instance(hdul[1], fits.CompImageHDU)
+        check.equal(hdul[1].header['OBSERVER'], 'Edwin Hubble')
+        check.equal(hdul[1].data.dtype, data.dtype)
+        npt.assert_array_equal(hdul[1].data, data)
+
+
+def test_write_compressed_append(tmpdir):
+    data = _image('int32')
+    filename = tmpdir.join('image.fz').strpath
+    write_compressed_hdu(filename, fits.Header(), data)
+    write_compressed_hdu(filename, fits.Header({'EXTNAME': 'OTHER'}),
+                         data*2)
+    with fits.open(filename) as hdul:
+        check.equal(len(hdul), 3)
+        check.equal(hdul[2].name, 'OTHER')
+        npt.assert_array_equal(hdul['OTHER'].data, data*2)
+
+
+def test_write_compressed_rice_float(tmpdir):
+    # RICE_1 for floats is quantized by astropy, single threaded
+    data = _image('f4')
+    filename = tmpdir.join('image.fz').strpath
+    write_compressed_hdu(filename, fits.Header(), data,
+                         compression='RICE_1')
+    with fits.open(filename, disable_image_compression=True) as hdul:
+        check.equal(hdul[1].header['ZCMPTYPE'], 'RICE_1')
+    with fits.open(filename) as hdul:
+        npt.assert_allclose(hdul[1].data, data, atol=10)
+
+
+def test_write_compressed_wrong_tile(tmpdir):
+    with pytest.raises(ValueError):
+        write_compressed_hdu(tmpdir.join('image.fz').strpath, fits.Header(),
+                             _image('int16'), tile_shape=(10,))
+
+
+@pytest.mark.parametrize('section', [None, (slice(13, 77),),
+                                     (slice(13, 77), slice(5, 40)),
+                                     (slice(0, 101, 3), 7),
+                                     (50,)])
+def test_read_compressed_section(tmpdir, section):
+    data = _image('int32')
+    filename = tmpdir.join('image.fz').strpath
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.CompImageHDU(data, tile_shape=(67, 4))]
+                 ).writeto(filename)
+
+    result = read_compressed_hdu(filename, 1, section=section, n_threads=4)
+    expect = data if section is None else data[section]
+    npt.assert_array_equal(result, expect)
+
+
+def test_framedata_compressed_roundtrip(tmpdir):
+    data = _image('uint16')
+    mask = data > 1030
+    frame = FrameData(data, unit='adu', uncertainty=np.sqrt(data),
+                      u_unit='adu', mask=mask,
+                      meta={'CRPIX1': 10.0, 'CRPIX2': 20.0})
+    filename = tmpdir.join('frame.fits.fz').strpath
+    framedata_write_fits(frame, filename)
+
+    with fits.open(filename) as hdul:
+        check.equal(len(hdul), 4)
+        for h in hdul[1:]:
+            check.is_instance(h, fits.CompImageHDU)
+
+    cd = framedata_read_fits(filename, n_threads=2)
+    npt.assert_array_equal(cd.data, data)
+    npt.assert_array_equal(cd.uncertainty, np.sqrt(data))
+    npt.assert_array_equal(cd.mask, mask)
+    check.equal(cd.unit, 'adu')
+
+    section = (slice(30, 80), slice(10, 20))
+    cd = framedata_read_fits(filename, section=section)
+    npt.assert_array_equal(cd.data, data[section])
+    npt.assert_array_equal(cd.uncertainty, np.sqrt(data)[section])
+    npt.assert_array_equal(cd.mask, mask[section])
+    check.equal(cd.meta['CRPIX1'], 0.0)
+    check.equal(cd.meta['CRPIX2'], -10.0)
+
+
+def test_framedata_write_compression_keyword(tmpdir):
+    frame = FrameData(_image('f8'), unit='adu')
+    filename = tmpdir.join('frame.fits').strpath
+    framedata_write_fits(frame, filename, compression='GZIP_1',
+                         hdu_uncertainty=None, hdu_mask=None)
+    with fits.open(filename, disable_image_compression=True) as hdul:
+        check.equal(len(hdul), 2)
+        check.equal(hdul[1].header['ZCMPTYPE'], 'GZIP_1')
+    npt.assert_array_equal(framedata_read_fits(filename).data, frame.data)
+
+
+def test_read_fits_section_uncompressed(tmpdir):
+    data = _image('f4')
+    filename = tmpdir.join('frame.fits').strpath
+    framedata_write_fits(FrameData(data, unit='adu'), filename)
+    cd = framedata_read_fits(filename, section=(slice(5, 9), slice(1, 3)))
+    npt.assert_array_equal(cd.data, data[5:9, 1:3])
@@ -9,7 +9,8 @@ import numpy as np
 import numpy.testing as npt
 import pytest_check as check
 from astropop.framedata import FrameData, setup_filename, framedata_read_fits,\
-                               extract_units
+                               extract_units, tile_slices, \
+                               framedata_write_fits
 from astropy.io import fits
 from astropy.utils import NumpyRNGContext
 from astropy import units as u
@@ -311,6 +312,36 @@ def test_to_hdu_no_uncert_no_mask():
     check.equal(fits_hdulist[0].header['BUNIT'], 'adu')
 
 
+@pytest.mark.parametrize('scaled', [True, False])
+def test_initialize_from_fits_lazy_load_uncertainty_unit(tmpdir, scaled):
+    # scaled uncertainty is not memmapped, but read with its unit
+    data = np.arange(100, dtype='f8').reshape((10, 10))
+    hdu = fits.PrimaryHDU(data)
+    hdu.header['BUNIT'] = 'electron'
+    unct = np.full((10, 10), 3, dtype='uint16' if scaled else 'f8')
+    unct = fits.ImageHDU(unct, name='UNCERT')
+    unct.header['BUNIT'] = 'electron'
+    filename = tmpdir.join('afile.fits').strpath
+    fits.HDUList([hdu, unct]).writeto(filename)
+
+    lazy = framedata_read_fits(filename, lazy_load=True)
+    eager = framedata_read_fits(filename)
+    check.is_true(lazy.data.lazy)
+    check.equal(lazy._unct.lazy, not scaled)
+    check.is_true(lazy.uncertainty.unit is u.electron)
+    check.equal(lazy.uncertainty.unit, eager.uncertainty.unit)
+    npt.assert_array_equal(lazy.uncertainty, eager.uncertainty)
+    npt.assert_array_equal(lazy.uncertainty, np.full((10, 10), 3))
+
+    # incompatible units raise the same error in both paths
+    with fits.open(filename, mode='update') as hdul:
+        hdul['UNCERT'].header['BUNIT'] = 'adu'
+    with pytest.raises(ValueError, match='incompatible'):
+        framedata_read_fits(filename)
+    with pytest.raises(ValueError, match='incompatible'):
+        framedata_read_fits(filename, lazy_load=True)
+
+
 # TODO:
 @pytest.mark.skip('Wait Fits Implementation')
 def test_initialize_from_FITS(tmpdir):
@@ -346,6 +377,92 @@ def test_initialize_from_FITS_memmap(tmpdir):
     check.is_instance(cd1.data, np.memmap)
 
 
+def test_initialize_from_fits_lazy_load(tmpdir):
+    frame = create_framedata()
+    hdu = fits.PrimaryHDU(frame.data, header=fits.Header(frame.header))
+    unct = fits.ImageHDU(np.ones(frame.shape), name='UNCERT')
+    unct.header['BUNIT'] = 'adu'
+    hdu.header['BUNIT'] = 'adu'
+    filename = tmpdir.join('afile.fits').strpath
+    fits.HDUList([hdu, unct]).writeto(filename)
+
+    cd = framedata_read_fits(filename, lazy_load=True)
+    check.is_true(cd.data.lazy)
+    check.is_true(cd._unct.lazy)
+    check.is_true(cd.data.memmap)
+    check.is_true(cd.unit is u.adu)
+    check.is_true(cd.uncertainty.unit is u.adu)
+    npt.assert_array_equal(cd.data, frame.data)
+    npt.assert_array_equal(cd.uncertainty, np.ones(frame.shape))
+    npt.assert_array_equal(cd.mask, np.zeros(frame.shape, dtype=bool))
+    # no cache file until write
+    check.is_false(os.path.exists(cd.data.filename))
+
+    cd.data[0, 0] = 1000
+    check.is_false(cd.data.lazy)
+    check.is_true(os.path.exists(cd.data.filename))
+    check.equal(cd.data[0, 0], 1000)
+    npt.assert_array_equal(cd.data[1:], frame.data[1:])
+    # the original file is never changed
+    npt.assert_array_equal(fits.getdata(filename), frame.data)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+@pytest.mark.parametrize('dtype', ['f4', 'f8', 'i2', 'uint16', 'uint32',
+                                   'int8', 'bool'])
+def test_write_fits_streaming(tmpdir, memmap, dtype):
+    data = (np.arange(30*17) % 200).reshape((30, 17)).astype(dtype)
+    mask = np.zeros((30, 17), dtype=bool)
+    mask[3, 7] = True
+    frame = FrameData(data, unit='adu', uncertainty=np.ones((30, 17)),
+                      mask=mask, meta={'observer': 'Edwin Hubble'},
+                      cache_folder=str(tmpdir), use_memmap_backend=memmap)
+    filename = tmpdir.join('stream.fits').strpath
+    # small chunks to write many of them
+    framedata_write_fits(frame, filename, chunk_size=100)
+
+    with fits.open(filename) as hdul:
+        check.equal([h.name for h in hdul], ['PRIMARY', 'UNCERT', 'MASK'])
+        check.equal(hdul[0].header['OBSERVER'], 'Edwin Hubble')
+        check.equal(hdul[0].header['BUNIT'], 'adu')
+        npt.assert_array_equal(hdul[0].data, data)
+        npt.assert_array_equal(hdul['UNCERT'].data, np.ones((30, 17)))
+        npt.assert_array_equal(hdul['MASK'].data, mask)
+        # same result of the in-memory HDUList
+        expect = frame.to_hdu()
+        for a, b in zip(hdul, expect):
+            npt.assert_array_equal(a.data, b.data)
+
+    with pytest.raises(OSError):
+        framedata_write_fits(frame, filename)
+    frame.data[0, 0] = 1
+    framedata_write_fits(frame, filename, overwrite=True)
+    check.equal(fits.getdata(filename)[0, 0], 1)
+
+
+def test_write_fits_streaming_empty_uncertainty(tmpdir):
+    frame = FrameData(np.ones((10, 10)), unit='adu', mask_mode='packed')
+    filename = tmpdir.join('stream.fits').strpath
+    framedata_write_fits(frame, filename)
+    cd = framedata_read_fits(filename)
+    npt.assert_array_equal(cd.data, frame.data)
+    npt.assert_array_equal(cd.uncertainty, np.zeros((10, 10)))
+    npt.assert_array_equal(cd.mask, np.zeros((10, 10)))
+
+
+def test_initialize_from_fits_lazy_load_scaled(tmpdir):
+    # scaled data cannot be memmapped directly, read normally
+    data = np.arange(100, dtype='uint16').reshape((10, 10))
+    hdu = fits.PrimaryHDU(data)
+    hdu.header['BUNIT'] = 'adu'
+    filename = tmpdir.join('afile.fits').strpath
+    hdu.writeto(filename)
+
+    cd = framedata_read_fits(filename, lazy_load=True)
+    check.is_false(cd.data.lazy)
+    npt.assert_array_equal(cd.data, data)
+
+
 # TODO:
 @pytest.mark.skip('Wait Fits Implementation')
 def test_initialize_from_fits_with_unit_in_header(tmpdir):
@@ -478,8 +595,6 @@ def test_setting_bad_uncertainty_raises_error():
         # Uncertainty is supposed to be an instance of NDUncertainty
         frame.uncertainty = 'not a uncertainty'
 
-# TODO:
-@pytest.mark.skip('Wait Fits Implementation')
 def test_copy():
     frame = create_framedata()
     ccd_copy = frame.copy()
@@ -488,6 +603,89 @@ def test_copy():
     check.equal(ccd_copy.meta, frame.meta)
 
 
+@pytest.mark.parametrize('memmap', [True, False])
+def test_scalar_mask_uncertainty_not_allocated(tmpdir, memmap):
+    frame = FrameData(np.ones((100, 100)), unit='adu', uncertainty=2,
+                      cache_folder=str(tmpdir), use_memmap_backend=memmap)
+    check.equal(frame.mask.strides, (0, 0))
+    check.equal(frame.uncertainty.strides, (0, 0))
+    check.equal(frame.mask.dtype, bool)
+    check.is_false(os.path.exists(frame._mask.filename))
+    check.is_false(os.path.exists(frame._unct.filename))
+
+    frame.mask[1, 1] = True
+    check.equal(np.sum(frame.mask), 1)
+    check.not_equal(frame.mask.strides, (0, 0))
+    check.equal(os.path.exists(frame._mask.filename), memmap)
+    check.equal(frame.uncertainty.strides, (0, 0))
+    npt.assert_array_equal(frame.uncertainty, 2*np.ones((100, 100)))
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_copy_on_write(tmpdir, memmap):
+    frame = FrameData(np.ones((10, 10)), unit='adu', uncertainty=2,
+                      meta={'A': 1}, cache_folder=str(tmpdir),
+                      use_memmap_backend=memmap)
+    ccd_copy = frame.copy()
+    check.is_true(np.shares_memory(np.asarray(frame.data),
+                                   np.asarray(ccd_copy.data)))
+    check.equal(ccd_copy.cache_folder, frame.cache_folder)
+    check.equal(ccd_copy._memmapping, memmap)
+    ccd_copy.data[0, 0] = 5
+    ccd_copy.uncertainty = 3
+    ccd_copy.meta['B'] = 2
+    check.equal(frame.data[0, 0], 1)
+    check.equal(frame.uncertainty[0, 0], 2)
+    check.is_false('B' in frame.meta)
+    frame.mask[1, 1] = True
+    check.is_false(ccd_copy.mask[1, 1])
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_deepcopy(tmpdir, memmap):
+    import copy
+    frame = FrameData(np.ones((10, 10)), unit='adu', uncertainty=2,
+                      meta={'A': [1]}, wcs=WCS(naxis=2),
+                      cache_folder=str(tmpdir), use_memmap_backend=memmap)
+    ccd_copy = copy.deepcopy(frame)
+    npt.assert_array_equal(ccd_copy.data, frame.data)
+    npt.assert_array_equal(ccd_copy.uncertainty, frame.uncertainty)
+    check.equal(ccd_copy.unit, frame.unit)
+    check.is_false(np.shares_memory(np.asarray(frame.data),
+                                    np.asarray(ccd_copy.data)))
+    check.is_false(ccd_copy.meta['A'] is frame.meta['A'])
+    check.is_false(ccd_copy.wcs is frame.wcs)
+    check.equal(ccd_copy.data.memmap, memmap)
+    if memmap:
+        check.not_equal(ccd_copy.data.filename, frame.data.filename)
+
+
+def test_deepcopy_memmap_files(tmpdir):
+    import gc
+    import copy
+    data = np.arange(100, dtype='f8').reshape((10, 10))
+    frame = FrameData(data, unit='adu', uncertainty=np.ones((10, 10)),
+                      mask=data > 50, cache_folder=str(tmpdir),
+                      use_memmap_backend=True)
+    ccd_copy = copy.deepcopy(frame)
+    gc.collect()
+    names = [c.filename for c in [ccd_copy._data, ccd_copy._unct,
+                                  ccd_copy._mask]]
+    # the copy keeps its cache files
+    for name in names:
+        check.is_true(os.path.exists(name))
+    shared = FrameData.from_shared(ccd_copy.to_shared())
+    npt.assert_array_equal(shared.data, data)
+    npt.assert_array_equal(shared.uncertainty, np.ones((10, 10)))
+    npt.assert_array_equal(shared.mask, data > 50)
+    # and removes them when collected
+    del shared, ccd_copy
+    gc.collect()
+    for name in names:
+        check.is_false(os.path.exists(name))
+    npt.assert_array_equal(frame.data, data)
+
+
 def test_wcs_invalid():
     frame = create_framedata()
     with pytest.raises(TypeError):
@@ -499,3 +697,104 @@ def test_wcs_assign():
     wcs = WCS(naxis=2)
     frame.wcs = wcs
     check.equal(frame.wcs, wcs)
+
+
+@pytest.mark.parametrize('overlap', [0, 3])
+def test_tile_slices(overlap):
+    shape = (23, 17)
+    covered = np.zeros(shape, dtype=int)
+    for slices, core, region in tile_slices(shape, (10, 5), overlap):
+        tile = np.zeros(shape)[slices]
+        check.equal(tile[core].shape, np.zeros(shape)[region].shape)
+        for s, r in zip(slices, region):
+            check.less_equal(s.start, r.start)
+            check.greater_equal(s.stop, r.stop)
+            check.less_equal(r.start - s.start, overlap)
+            check.less_equal(s.stop - r.stop, overlap)
+        covered[region] += 1
+    # regions cover the full array only once
+    npt.assert_array_equal(covered, np.ones(shape))
+
+    with pytest.raises(ValueError):
+        list(tile_slices(shape, (10, 5, 3)))
+    with pytest.raises(ValueError):
+        list(tile_slices(shape, 0))
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_iter_tiles(memmap):
+    frame = FrameData(_random_array.copy(), unit='adu',
+                      uncertainty=np.ones(_random_array.shape),
+                      mask=_random_array > 1, use_memmap_backend=memmap)
+    n = 0
+    for tile in frame.iter_tiles(30, overlap=2):
+        npt.assert_array_equal(tile.data, _random_array[tile.slices])
+        npt.assert_array_equal(tile.mask, _random_array[tile.slices] > 1)
+        npt.assert_array_equal(tile.uncertainty,
+                               np.ones(_random_array.shape)[tile.slices])
+        # views, not copies
+        check.is_true(np.shares_memory(tile.data, frame.data._contained))
+        n += 1
+    check.equal(n, 16)
+
+    frame.uncertainty = None
+    for tile in frame.iter_tiles(50):
+        check.is_true(tile.uncertainty is None)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_map_blocks(memmap):
+    from scipy.ndimage import uniform_filter
+    frame = create_framedata()
+    res = frame.map_blocks(uniform_filter, (30, 40), overlap=3, size=5,
+                           mode='nearest', use_memmap_backend=memmap)
+    check.is_false(res is frame)
+    check.equal(res.data.memmap, memmap)
+    check.is_true(res.unit is u.adu)
+    check.equal(res.meta, frame.meta)
+    check.equal(res.mask.shape, frame.shape)
+    npt.assert_array_almost_equal(res.data,
+                                  uniform_filter(_random_array, 5,
+                                                 mode='nearest'))
+
+    res = frame.map_blocks(np.round, 30, dtype='int32')
+    check.equal(res.dtype, np.int32)
+    npt.assert_array_equal(res.data, np.round(_random_array))
+
+    with pytest.raises(ValueError):
+        frame.map_blocks(np.ravel, 30)
+
+
+def _shared_worker(handle):
+    frame = FrameData.from_shared(handle)
+    frame.data[0, 0] = 42
+    frame.data *= 2
+    return frame.meta['observer'], frame.unit.to_string()
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_shared_framedata(memmap):
+    import multiprocessing
+    frame = create_framedata()
+    frame.uncertainty = np.ones(frame.shape)
+    frame.mask = _random_array > 1
+    if memmap:
+        frame.enable_memmap()
+    handle = frame.to_shared()
+
+    # in the same process
+    shared = FrameData.from_shared(handle)
+    check.is_true(shared.unit is u.adu)
+    check.equal(shared.meta, frame.meta)
+    check.equal(shared.data.memmap, memmap)
+    npt.assert_array_equal(shared.data, _random_array)
+    npt.assert_array_equal(shared.uncertainty, np.ones(frame.shape))
+    npt.assert_array_equal(shared.mask, _random_array > 1)
+
+    # worker process
+    with multiprocessing.Pool(1) as pool:
+        res = pool.map(_shared_worker, [handle])
+    check.equal(res, [('astropop', 'adu')])
+    check.equal(frame.data[0, 0], 84)
+    npt.assert_array_almost_equal(frame.data[1:], _random_array[1:]*2)
+    npt.assert_array_almost_equal(shared.data[1:], _random_array[1:]*2)
@@ -0,0 +1,163 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import os
+import copy
+import pytest
+import pytest_check as check
+from astropop.framedata import FrameData, PackedMask, FlagMask, MaskFlags, \
+                               pack_mask, unpack_mask, framedata_read_fits
+from astropy.io import fits
+import numpy as np
+import numpy.testing as npt
+
+
+def create_mask(shape=(13, 21)):
+    rng = np.random.default_rng(42)
+    return rng.random(shape) > 0.7
+
+
+@pytest.mark.parametrize('shape', [(7,), (13, 21), (3, 4, 16)])
+def test_pack_unpack(shape):
+    mask = create_mask(shape)
+    words = pack_mask(mask)
+    check.equal(words.dtype, np.uint8)
+    check.equal(words.shape[-1], -(-shape[-1]//8))
+    npt.assert_array_equal(unpack_mask(words, shape), mask)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_packed_mask_read(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'packed.mask')
+    mask = create_mask()
+    m = PackedMask(mask, filename=f, memmap=memmap)
+    check.equal(m.shape, mask.shape)
+    check.equal(m.dtype, bool)
+    check.equal(m.nbytes, 13*3)
+    check.equal(m.memmap, memmap)
+    check.equal(os.path.exists(f), memmap)
+    npt.assert_array_equal(m, mask)
+    npt.assert_array_equal(m[2:5, 3:17], mask[2:5, 3:17])
+    npt.assert_array_equal(m[3], mask[3])
+    npt.assert_array_equal(m[:, 5], mask[:, 5])
+    npt.assert_array_equal(m[[1, 4], -2], mask[[1, 4], -2])
+    npt.assert_array_equal(m[mask], mask[mask])
+    check.equal(m.count(), np.sum(mask))
+    check.equal(np.count_nonzero(m), np.sum(mask))
+
+
+@pytest.mark.parametrize('mask_class', [PackedMask, FlagMask])
+def test_mask_write(mask_class):
+    mask = create_mask()
+    m = mask_class(mask)
+    mask[1:3, 2:9] = True
+    m[1:3, 2:9] = True
+    npt.assert_array_equal(m, mask)
+    sel = create_mask()[::-1]
+    mask[sel] = False
+    m[sel] = False
+    npt.assert_array_equal(m, mask)
+    mask[..., 20] = True
+    m[..., 20] = True
+    npt.assert_array_equal(m, mask)
+    mask[4] = mask[5]
+    m[4] = mask[5]
+    npt.assert_array_equal(m, mask)
+
+
+@pytest.mark.parametrize('mask_class', [PackedMask, FlagMask])
+def test_mask_combine(mask_class):
+    mask1 = create_mask()
+    mask2 = create_mask()[::-1]
+    m1 = mask_class(mask1)
+    m2 = mask_class(mask2)
+    res = m1 | m2
+    check.is_true(isinstance(res, mask_class))
+    npt.assert_array_equal(res, mask1 | mask2)
+    npt.assert_array_equal(m1 & m2, mask1 & mask2)
+    npt.assert_array_equal(m1 ^ m2, mask1 ^ mask2)
+    npt.assert_array_equal(~m1, ~mask1)
+    npt.assert_array_equal(np.logical_or(m1, mask2), mask1 | mask2)
+    check.equal(np.count_nonzero(~m1), np.sum(~mask1))
+
+
+def test_packed_mask_constant():
+    m = PackedMask(np.broadcast_to(np.array(False), (100, 100)))
+    check.is_true(m.lazy)
+    check.equal(m.count(), 0)
+    m = PackedMask(np.broadcast_to(np.array(True), (100, 101)))
+    check.equal(m.count(), 100*101)
+    m[0, 0] = False
+    check.is_false(m.lazy)
+    check.equal(m.count(), 100*101 - 1)
+
+
+def test_flag_mask_flags():
+    m = FlagMask(np.zeros((3, 3), dtype=bool))
+    m.set_flag('saturated', np.eye(3, dtype=bool))
+    m.set_flag(MaskFlags.COSMIC, (0, 1))
+    m[2, 0] = True
+    check.equal(m.flags.dtype, np.uint16)
+    npt.assert_array_equal(m.flags, [[2, 4, 0], [0, 2, 0], [1, 0, 2]])
+    npt.assert_array_equal(m.get_flag('cosmic'),
+                           [[0, 1, 0], [0, 0, 0], [0, 0, 0]])
+    check.equal(m.count(), 5)
+    m.clear_flag(MaskFlags.SATURATED)
+    npt.assert_array_equal(m.flags, [[0, 4, 0], [0, 0, 0], [1, 0, 0]])
+    # booleans only clear the generic flag
+    m[0, 1] = False
+    check.equal(m.count(), 2)
+    m[2, 0] = False
+    check.equal(m.count(), 1)
+    with pytest.raises(ValueError):
+        m.set_flag('not_a_flag')
+
+
+def test_flag_mask_bool_keeps_flags():
+    m = FlagMask(np.zeros((2, 3), dtype=bool))
+    m.set_flag('saturated', (0, 0))
+    m.set_flag('cosmic', (0, 0))
+    m[0, :] = True
+    npt.assert_array_equal(m.flags, [[7, 1, 1], [0, 0, 0]])
+    m[0, :] = False
+    npt.assert_array_equal(m.flags, [[6, 0, 0], [0, 0, 0]])
+    npt.assert_array_equal(m, [[1, 0, 0], [0, 0, 0]])
+    npt.assert_array_equal(m.get_flag('saturated'), m.get_flag('cosmic'))
+
+
+@pytest.mark.parametrize('mask_mode', ['packed', 'flags'])
+@pytest.mark.parametrize('memmap', [True, False])
+def test_framedata_mask_mode(tmpdir, mask_mode, memmap):
+    mask = create_mask()
+    frame = FrameData(np.ones((13, 21)), mask=mask, mask_mode=mask_mode,
+                      cache_folder=str(tmpdir), use_memmap_backend=memmap)
+    check.equal(frame.mask_mode, mask_mode)
+    check.equal(frame.mask.memmap, memmap)
+    npt.assert_array_equal(frame.mask, mask)
+    check.equal(frame.data[frame.mask].size, np.sum(mask))
+
+    ccd_copy = frame.copy()
+    ccd_copy.mask[0, 0] = not mask[0, 0]
+    check.equal(frame.mask[0, 0], mask[0, 0])
+    check.equal(copy.deepcopy(frame).mask_mode, mask_mode)
+    for tile in frame.iter_tiles((5, 5)):
+        npt.assert_array_equal(tile.mask, mask[tile.slices])
+
+    frame.mask = False
+    check.equal(frame.mask.count(), 0)
+    with pytest.raises(ValueError):
+        FrameData(np.ones((2, 2)), mask_mode='not_a_mode')
+
+
+@pytest.mark.parametrize('lazy', [True, False])
+def test_read_fits_flags(tmpdir, lazy):
+    f = os.path.join(tmpdir, 'flags.fits')
+    flags = np.zeros((10, 10), dtype=np.uint16)
+    flags[2, 3] = MaskFlags.SATURATED | MaskFlags.COSMIC
+    hdul = fits.HDUList([fits.PrimaryHDU(np.ones((10, 10))),
+                         fits.ImageHDU(flags, name='MASK')])
+    hdul.writeto(f)
+    frame = framedata_read_fits(f, unit='adu', mask_mode='flags',
+                                lazy_load=lazy)
+    check.is_true(isinstance(frame.mask, FlagMask))
+    npt.assert_array_equal(frame.mask.flags, flags)
+    check.is_true(frame.mask.get_flag('cosmic')[2, 3])
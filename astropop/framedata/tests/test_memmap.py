@@ -1,5 +1,7 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 import os
+import gc
+import copy
 import mmap
 import pytest
 import pytest_check as check
@@ -194,6 +196,270 @@ def test_reset_data(tmpdir):
     check.is_false(m.memmap)
 
 
+def test_reset_data_nocopy():
+    a = np.arange(100.).reshape((10, 10))
+    m = MemMapArray(None, memmap=False)
+    m.reset_data(a, copy=False)
+    check.is_true(m._contained is a)
+    m.reset_data(a)
+    check.is_false(m._contained is a)
+    npt.assert_array_equal(m, a)
+
+
+def test_reset_data_inplace(tmpdir):
+    f = os.path.join(tmpdir, 'inplace.npy')
+    m = MemMapArray(np.zeros((10, 10)), f, memmap=True)
+    mm = m._contained
+    inode = os.stat(f).st_ino
+
+    # same shape and dtype are written in the existing file
+    m.reset_data(np.ones((10, 10)), unit='adu')
+    check.is_true(m._contained is mm)
+    check.equal(os.stat(f).st_ino, inode)
+    check.is_true(m.unit is u.adu)
+    npt.assert_array_equal(m, np.ones((10, 10)))
+    npt.assert_array_equal(np.fromfile(f), np.ones(100))
+
+    # overlapping views of the own data
+    m.reset_data(np.arange(100.).reshape((10, 10)))
+    m.reset_data(m[::-1])
+    npt.assert_array_equal(m, np.arange(100.).reshape((10, 10))[::-1])
+    m.reset_data(m)
+    npt.assert_array_equal(m, np.arange(100.).reshape((10, 10))[::-1])
+
+    # other dtype creates a new file
+    m.reset_data(np.ones((10, 10), dtype='f4'))
+    check.is_false(m._contained is mm)
+    check.equal(m.dtype, np.dtype('f4'))
+
+    # copies are not changed
+    c = copy.copy(m)
+    m.reset_data(np.full((10, 10), 2, dtype='f4'))
+    npt.assert_array_equal(c, np.ones((10, 10)))
+    npt.assert_array_equal(m, np.full((10, 10), 2))
+    d = copy.deepcopy(m)
+    m.reset_data(np.full((10, 10), 3, dtype='f4'))
+    npt.assert_array_equal(d, np.full((10, 10), 2))
+
+
+def test_move_memmap_rename(tmpdir):
+    f = os.path.join(tmpdir, 'old.npy')
+    g = os.path.join(tmpdir, 'new.npy')
+    m = MemMapArray(np.arange(10.), f, memmap=True)
+    inode = os.stat(f).st_ino
+    m._file_lock = False
+    m.set_filename(g)
+    check.is_false(os.path.exists(f))
+    check.equal(os.stat(g).st_ino, inode)
+    check.equal(m.filename, g)
+    npt.assert_array_equal(m, np.arange(10.))
+    m[0] = 5
+    check.equal(np.fromfile(g)[0], 5)
+
+
+def test_attach_file(tmpdir):
+    f = os.path.join(tmpdir, 'source.raw')
+    g = os.path.join(tmpdir, 'cache.npy')
+    arr = np.arange(20, dtype='>f4').reshape((4, 5))
+    with open(f, 'wb') as fobj:
+        fobj.write(b'\0'*16)  # some header
+        fobj.write(arr.tobytes())
+
+    a = MemMapArray(None, filename=g)
+    a.attach_file(f, dtype='>f4', shape=(4, 5), offset=16, unit='adu')
+    check.is_true(a.lazy)
+    check.is_true(a.memmap)
+    check.is_true(a.unit is u.adu)
+    check.equal(a.filename, g)
+    check.is_false(os.path.exists(g))
+    npt.assert_array_equal(a, arr)
+
+    # write creates the cache file
+    a[0, 0] = 10
+    check.is_false(a.lazy)
+    check.is_true(os.path.exists(g))
+    check.equal(a[0, 0], 10)
+    check.equal(np.fromfile(f, dtype='>f4', offset=16)[0], 0)
+
+    # disable memmap never removes a not owned file
+    b = MemMapArray(None, filename=g+'b')
+    b.attach_file(f, dtype='>f4', shape=(4, 5), offset=16)
+    b.disable_memmap(remove=True)
+    check.is_false(b.lazy)
+    check.is_false(b.memmap)
+    check.is_true(os.path.exists(f))
+    npt.assert_array_equal(b, arr)
+
+    # reset data also don't remove the file
+    c = MemMapArray(None, filename=g+'c')
+    c.attach_file(f, dtype='>f4', shape=(4, 5), offset=16)
+    c.reset_data(np.zeros((2, 2)))
+    check.is_false(c.lazy)
+    check.is_true(os.path.exists(f))
+    npt.assert_array_equal(c, np.zeros((2, 2)))
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_to_shared_attach_shared(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'shared.npy')
+    g = os.path.join(tmpdir, 'attached.npy')
+    arr = np.arange(20, dtype='f4').reshape((4, 5))
+    a = MemMapArray(arr, filename=f, unit='adu', memmap=memmap)
+    spec = a.to_shared()
+    check.is_true(a.shared != memmap)
+    check.equal(spec['shape'], (4, 5))
+    check.equal(np.dtype(spec['dtype']), np.dtype('f4'))
+
+    b = MemMapArray(None, filename=g)
+    b.attach_shared(spec)
+    check.is_true(b.shared)
+    check.equal(b.memmap, memmap)
+    check.is_true(b.unit is u.adu)
+    npt.assert_array_equal(b, arr)
+
+    # same buffer in both
+    b[0, 0] = 100
+    check.equal(a[0, 0], 100)
+    a += 1
+    check.equal(b[0, 0], 101)
+
+    # disable memmap or reset data never remove the shared file
+    if memmap:
+        b.disable_memmap(remove=True)
+        check.is_false(b.shared)
+        check.is_true(os.path.exists(f))
+        b[0, 0] = 0
+        check.equal(a[0, 0], 101)
+
+    b.attach_shared(spec)
+    b.reset_data(np.zeros(3))
+    check.is_false(b.shared)
+    npt.assert_array_equal(a[0], [101, 2, 3, 4, 5])
+
+    # empty containers
+    check.is_true(MemMapArray(None).to_shared() is None)
+    b.attach_shared(None)
+    check.is_true(b.empty)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_pickle(tmpdir, memmap):
+    import pickle
+    f = os.path.join(tmpdir, 'pickle.npy')
+    arr = np.arange(20, dtype='f4').reshape((4, 5))
+    a = MemMapArray(arr, filename=f, unit='adu', memmap=memmap)
+    b = pickle.loads(pickle.dumps(a))
+    npt.assert_array_equal(b, arr)
+    check.is_true(b.unit is u.adu)
+    # unpickled is never memmapped to the same file
+    check.is_false(b.memmap)
+    b[0, 0] = 10
+    check.equal(a[0, 0], 0)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_pickle_new_file(tmpdir, memmap):
+    import pickle
+    f = os.path.join(tmpdir, 'pickle.npy')
+    arr = np.arange(20, dtype='f4').reshape((4, 5))
+    a = MemMapArray(arr, filename=f, unit='adu', memmap=memmap)
+    b = pickle.loads(pickle.dumps(a))
+    check.not_equal(b.filename, a.filename)
+    check.equal(os.path.dirname(b.filename), str(tmpdir))
+    b.enable_memmap()
+    b[0] = 100
+    npt.assert_array_equal(a, arr)
+    npt.assert_array_equal(b[0], 100)
+    a.enable_memmap()
+    npt.assert_array_equal(a, arr)
+    # the cache file of the unpickled instance is removed with it
+    name = b.filename
+    del b
+    gc.collect()
+    check.is_false(os.path.exists(name))
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_copy_on_write(tmpdir, memmap):
+    import copy
+    f = os.path.join(tmpdir, 'cow.npy')
+    arr = np.arange(20, dtype='f4').reshape((4, 5))
+    a = MemMapArray(arr, filename=f, unit='adu', memmap=memmap)
+    b = copy.copy(a)
+    # no data copied, until written
+    check.is_true(np.shares_memory(np.asarray(a), np.asarray(b)))
+    check.is_true(b.unit is u.adu)
+    check.equal(b.memmap, memmap)
+    check.not_equal(b.filename, a.filename)
+    # writes through views are blocked
+    with pytest.raises(ValueError):
+        b[0][0] = 10
+
+    a[0, 0] = 10
+    check.equal(a[0, 0], 10)
+    check.equal(b[0, 0], 0)
+    b += 1
+    check.equal(b[0, 0], 1)
+    check.equal(a[0, 1], 1)
+    check.equal(a[0, 0], 10)
+    if memmap:
+        check.is_true(os.path.exists(a.filename))
+        check.is_true(os.path.exists(b.filename))
+        npt.assert_array_equal(np.fromfile(a.filename, dtype='f4')[:2],
+                               [10, 1])
+
+
+def test_copy_on_write_last_holder():
+    import copy
+    a = MemMapArray(np.arange(10))
+    b = copy.copy(a)
+    buffer = np.asarray(a)
+    del b
+    # no other copy holds the buffer, so it is not copied
+    a[0] = 5
+    check.is_true(np.shares_memory(buffer, np.asarray(a)))
+    check.equal(buffer[0], 5)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_deepcopy(tmpdir, memmap):
+    import copy
+    f = os.path.join(tmpdir, 'deepcopy.npy')
+    arr = np.arange(20, dtype='f4').reshape((4, 5))
+    a = MemMapArray(arr, filename=f, unit='adu', memmap=memmap)
+    b = copy.deepcopy(a)
+    npt.assert_array_equal(b, arr)
+    check.is_true(b.unit is u.adu)
+    check.equal(b.memmap, memmap)
+    check.is_false(b.lazy)
+    check.is_false(np.shares_memory(np.asarray(a), np.asarray(b)))
+    b[0][0] = 10
+    check.equal(a[0, 0], 0)
+    if memmap:
+        check.not_equal(b.filename, a.filename)
+        check.is_true(os.path.exists(b.filename))
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_constant_not_allocated(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'constant.npy')
+    a = MemMapArray(None, filename=f, memmap=memmap)
+    a.reset_data(np.broadcast_to(np.array(2.0), (1000, 1000)), unit='adu')
+    check.is_true(a.lazy)
+    check.equal(a.shape, (1000, 1000))
+    check.equal(a.strides, (0, 0))
+    check.equal(a.unit, u.adu)
+    check.is_false(os.path.exists(f))
+    npt.assert_array_equal(a[10:12, 0], [2, 2])
+    # only allocated when written
+    a[0, 0] = 1
+    check.is_false(a.lazy)
+    check.equal(a.memmap, memmap)
+    check.equal(a[0, 0], 1)
+    check.equal(a[0, 1], 2)
+    check.equal(os.path.exists(f), memmap)
+
+
 # TODO: flush
 # TODO: repr
 
@@ -898,3 +1164,76 @@ def test_math_redirects(tmpdir, memmap):
     x = np.arange(20).astype(np.float)
     y = MemMapArray(x, filename=f, memmap=memmap)
     check_arr(x, y)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_math_reflected(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'reflected.npy')
+    arr = np.arange(1, 11, dtype='f8')
+    a = MemMapArray(arr, filename=f, memmap=memmap)
+    npt.assert_array_equal(2 + a, 2 + arr)
+    npt.assert_array_equal(2 - a, 2 - arr)
+    npt.assert_array_equal(2 * a, 2 * arr)
+    npt.assert_array_equal(2 / a, 2 / arr)
+    npt.assert_array_equal(2 // a, 2 // arr)
+    npt.assert_array_equal(2 ** a, 2 ** arr)
+    npt.assert_array_equal(2 % a, 2 % arr)
+    check.is_instance(2 + a, MemMapArray)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_math_inplace_keep_buffer(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'inplace.npy')
+    arr = np.arange(10, dtype='f8')
+    a = MemMapArray(arr, filename=f, memmap=memmap)
+    contained = a._contained
+    a += 1
+    a *= 2
+    check.is_true(a._contained is contained)
+    check.equal(a.memmap, memmap)
+    npt.assert_array_equal(a, (arr+1)*2)
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_math_ufunc_out(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'ufunc_out.npy')
+    g = os.path.join(tmpdir, 'ufunc_out_b.npy')
+    arr = np.arange(10, dtype='f8')
+    a = MemMapArray(arr, filename=f, memmap=memmap)
+    b = MemMapArray(np.zeros(10), filename=g, memmap=memmap)
+    contained = b._contained
+    res = np.add(a, a, out=b)
+    check.is_true(res is b)
+    check.is_true(b._contained is contained)
+    npt.assert_array_equal(b, arr*2)
+
+    # numpy functions return plain numpy arrays
+    res = np.sqrt(a)
+    check.is_instance(res, np.ndarray)
+    check.is_not_instance(res, MemMapArray)
+    npt.assert_array_equal(res, np.sqrt(arr))
+    check.equal(np.mean(a), np.mean(arr))
+
+
+@pytest.mark.parametrize('memmap', [True, False])
+def test_views_not_copied(tmpdir, memmap):
+    f = os.path.join(tmpdir, 'views.npy')
+    a = MemMapArray(np.arange(20, dtype='f8').reshape((4, 5)),
+                    filename=f, memmap=memmap)
+    check.is_true(np.shares_memory(np.asarray(a), a._contained))
+    check.is_true(np.shares_memory(a.T._contained, a._contained))
+    check.is_true(np.shares_memory(a.reshape((5, 4))._contained,
+                                   a._contained))
+    # np.array still copies
+    check.is_false(np.shares_memory(np.array(a), a._contained))
+
+
+def test_redirects_are_properties():
+    from astropop.framedata.memmap import redirects
+    for name in redirects:
+        check.is_instance(getattr(MemMapArray, name), property)
+
+    a = MemMapArray(None)
+    for name in ['shape', 'T', 'sum']:
+        with pytest.raises(EmptyDataError):
+            getattr(a, name)
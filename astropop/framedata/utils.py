@@ -1,34 +1,190 @@
+import os
 import six
 import numbers
 import numpy as np
 from astropy import units as u
 from astropy.io import fits
 from astropy.nddata import CCDData, NDData
-from .compat import imhdus, _unsupport_fits_open_keywords
+from .compat import imhdus, _unsupport_fits_open_keywords, _bitpix_dtypes, \
+                    _fits_dtype, _fits_chunk, _fits_user_cards
 
 from .memmap import MemMapArray
+from .compressed import write_compressed_hdu, read_compressed_hdu
 from ..logger import logger
-from .framedata import FrameData
-from .compat import imhdus
+from .framedata import FrameData, unit_consistency
 
 
 __all__ = ['check_framedata', 'framedata_read_fits',
            'framedata_write_fits']
 
 
+def _stream_plane(fileobj, header, array, chunk_size):
+    """Stream an array to a FITS file, in chunks of ``chunk_size`` bytes."""
+    shape = array.shape
+    dtype, bzero = _fits_dtype(array.dtype)
+    hdr = fits.Header()
+    hdr['SIMPLE'] = True
+    hdr['BITPIX'] = dtype.itemsize*8*(-1 if dtype.kind == 'f' else 1)
+    hdr['NAXIS'] = len(shape)
+    for i, n in enumerate(shape[::-1]):
+        hdr[f'NAXIS{i+1}'] = n
+    hdr['EXTEND'] = True
+    if bzero is not None:
+        hdr['BSCALE'] = 1
+        hdr['BZERO'] = bzero
+    for card in _fits_user_cards(header):
+        hdr.append(card, end=True)
+
+    shdu = fits.StreamingHDU(fileobj, hdr)
+    if len(shape) > 0:
+        row_bytes = dtype.itemsize*int(np.prod(shape[1:]))
+        step = max(1, chunk_size//max(row_bytes, 1))
+        for i in range(0, shape[0], step):
+            shdu.write(_fits_chunk(array[i:i+step], dtype, bzero))
+    shdu.close()
+
+
 def framedata_write_fits(framedata, filename, hdu_mask='MASK',
                          hdu_uncertainty='UNCERT', unit_key='BUNIT',
-                         wcs_relax=True, **kwargs):
-    """Write a framedata to a file."""
-    hdul = framedata.to_hdu(hdu_uncertainty=hdu_uncertainty, hdu_mask=hdu_mask,
-                            unit_key=unit_key, wcs_relax=wcs_relax)
-    hdul.writeto(filename, **kwargs)
+                         wcs_relax=True, chunk_size=16*1024**2,
+                         compression=None, tile_shape=None, n_threads=None,
+                         **kwargs):
+    """Write a framedata to a file.
+
+    Data, uncertainty and mask are streamed from their memory or memmap
+    buffers straight to the file, in chunks, using
+    `~astropy.io.fits.StreamingHDU`. So, the frame is never entirely
+    loaded to memory.
+
+    Files ending in ``.fz``, or with ``compression`` set, are written as
+    tile-compressed images, with tiles compressed in a thread pool.
+
+    Parameters:
+    -----------
+    - framedata : `~astropop.framedata.FrameData`
+        Frame to be written.
+    - filename : string or `pathlib.Path`
+        Name of the file.
+    - hdu_mask, hdu_uncertainty : string or None (optional)
+        Extension names of the mask and uncertainty. If None, they are
+        not written.
+    - unit_key : string (optional)
+        Header key for physical unit.
+    - wcs_relax : bool (optional)
+        Allow non-standard WCS keys.
+    - chunk_size : int (optional)
+        Maximum size, in bytes, of each written chunk.
+        Default: 16 MiB
+    - compression : string or None (optional)
+        Tile compression type, like ``'RICE_1'``, ``'GZIP_1'`` or
+        ``'GZIP_2'``. If None, only ``.fz`` files are compressed, lossless:
+        RICE_1 for integers and GZIP_2 for floats.
+        Default: ``None``
+    - tile_shape : tuple or None (optional)
+        Shape of compression tiles, in numpy order. If None, tiles of 16
+        full rows are used.
+    - n_threads : int or None (optional)
+        Number of threads used to compress the tiles. If None, the number
+        of CPUs is used.
+    - kwargs :
+        ``overwrite`` is supported by the streaming writer. Any other
+        argument is passed to `~astropy.io.fits.HDUList.writeto`, with
+        the whole HDUList created in memory.
+    """
+    overwrite = kwargs.pop('overwrite', False)
+    if kwargs or not isinstance(filename, (str, os.PathLike)):
+        hdul = framedata.to_hdu(hdu_uncertainty=hdu_uncertainty,
+                                hdu_mask=hdu_mask, unit_key=unit_key,
+                                wcs_relax=wcs_relax)
+        hdul.writeto(filename, overwrite=overwrite, **kwargs)
+        return
+
+    filename = os.fspath(filename)
+    if os.path.exists(filename):
+        if not overwrite:
+            raise OSError(f'File {filename} already exists.')
+        # Old file may be memmapped by the frame. Unlink, do not truncate.
+        os.remove(filename)
+
+    planes = framedata._fits_planes(hdu_uncertainty=hdu_uncertainty,
+                                    hdu_mask=hdu_mask, unit_key=unit_key,
+                                    wcs_relax=wcs_relax)
+    if compression is None and not filename.endswith('.fz'):
+        for header, array in planes:
+            _stream_plane(filename, header, array, chunk_size)
+        return
+
+    # Compressed images must be extensions. Primary HDU is kept empty.
+    fits.PrimaryHDU().writeto(filename)
+    for header, array in planes:
+        write_compressed_hdu(filename, header, array,
+                             compression=compression, tile_shape=tile_shape,
+                             n_threads=n_threads)
+
+
+def _fits_memmap_args(hdul, index):
+    """Get the arguments needed to memmap the data of a HDU directly.
+
+    Return `None` if the data cannot be memmapped, like compressed files,
+    compressed HDUs or scaled data.
+    """
+    hdu = hdul[index]
+    if not isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)):
+        return
+    header = hdu.header
+    if header.get('NAXIS', 0) == 0:
+        return
+    if header.get('BSCALE', 1) != 1 or header.get('BZERO', 0) != 0:
+        return
+    if header.get('BITPIX') not in _bitpix_dtypes:
+        return
+
+    info = hdul.fileinfo(index)
+    if info is None or info['filename'] is None or info['resized']:
+        return
+    if getattr(info['file'], 'compression', None) is not None:
+        return
+
+    return (info['filename'], _bitpix_dtypes[header['BITPIX']], hdu.shape,
+            info['datLoc'])
+
+
+def _read_plane(hdul, index, section=None, n_threads=None):
+    """Read the data of a HDU, or only a section of it.
+
+    Compressed HDUs of files are decompressed in threads, and only the
+    tiles covering the section are decompressed.
+    """
+    hdu = hdul[index]
+    filename = hdul.filename()
+    if isinstance(hdu, fits.CompImageHDU) and filename is not None:
+        return read_compressed_hdu(filename, hdul.index_of(index),
+                                   section=section, n_threads=n_threads)
+    if section is not None:
+        return hdu.section[section]
+    return hdu.data
+
+
+def _section_header(header, section):
+    """Shift the WCS reference pixel of a header to a section origin."""
+    header = header.copy()
+    if not isinstance(section, tuple):
+        section = (section,)
+    naxis = header.get('NAXIS', len(section))
+    for i, sl in enumerate(section):
+        key = f'CRPIX{naxis-i}'
+        if isinstance(sl, slice) and key in header:
+            start = sl.indices(header.get(f'NAXIS{naxis-i}', 0))[0]
+            header[key] = header[key] - start
+    return header
 
 
 def framedata_read_fits(filename=None, hdu=0, unit='BUNIT',
                         hdu_uncertainty='UNCERT',
                         hdu_mask='MASK',
-                        use_memmap_backend=False, **kwargs):
+                        use_memmap_backend=None, lazy_load=False,
+                        mask_mode='bool', section=None, n_threads=None,
+                        **kwargs):
     f"""Create a FrameData from a FITS file.
 
     Parameters:
@@ -57,6 +213,28 @@ def framedata_read_fits(filename=None, hdu=0, unit='BUNIT',
     - hdu_mask : string or int (optional)
         HDU containing the mask data.
         Default: ``'MASK'``
+    - use_memmap_backend : bool or None (optional)
+        Enable memmap in the created FrameData. If None, the memory budget
+        decides. See `~astropop.framedata.FrameData`.
+        Default: ``None``
+    - lazy_load : bool (optional)
+        Memmap data and uncertainty directly from the FITS file, in
+        copy-on-write mode, instead of reading them to memory. The file is
+        never changed and the FrameData cache file is only created when the
+        data is written. Compressed files and scaled data are read normally.
+        Default: ``False``
+    - mask_mode : {{'bool', 'packed', 'flags'}} (optional)
+        Storage of the mask in the created FrameData. With ``'flags'``,
+        integer masks are kept as flags.
+        Default: ``'bool'``
+    - section : tuple of slices or None (optional)
+        Read only this subregion of data, uncertainty and mask. For
+        tile-compressed HDUs, only the tiles covering the subregion are
+        decompressed. The WCS reference pixel is shifted to the subregion.
+        Default: ``None``
+    - n_threads : int or None (optional)
+        Number of threads used to decompress tile-compressed HDUs. If
+        None, the number of CPUs is used.
     - kwargs :
         Keyword arguments to be passed to `astropy.io.fits`. The following
         keyowrds are not supported:
@@ -74,18 +252,22 @@ def framedata_read_fits(filename=None, hdu=0, unit='BUNIT',
         hdul = fits.open(filename, **kwargs)
 
     # Read data and header
+    # Check NAXIS, not data, to not decompress the data here.
     data_hdu = hdul[hdu]
-    if data_hdu.data is None and hdu == 0:
+    if data_hdu.header.get('NAXIS', 0) == 0 and hdu == 0:
         # Seek for first valid image data
-        i = 1
-        while i < len(hdul):
-            if isinstance(hdul[i], imhdus):
+        for i in range(1, len(hdul)):
+            if isinstance(hdul[i], imhdus) and \
+               hdul[i].header.get('NAXIS', 0) > 0:
                 data_hdu = hdul[i]
                 hdu = i
                 break
-    if data_hdu.data is None:
+    if not isinstance(data_hdu, imhdus) or \
+       data_hdu.header.get('NAXIS', 0) == 0:
         raise ValueError('No valid image HDU found in fits file.')
     header = data_hdu.header
+    if section is not None:
+        header = _section_header(header, section)
 
     # Unit
     dunit = None
@@ -113,7 +295,7 @@ def framedata_read_fits(filename=None, hdu=0, unit='BUNIT',
                              'same!')
         uncertainty = hdul[hdu_uncertainty]
         unc_header = uncertainty.header
-        uncertainty = uncertainty.data
+        uncertainty = _read_plane(hdul, hdu_uncertainty, section, n_threads)
         uunit = None
         try:
             uunit = u.Unit(unit)
@@ -140,13 +322,40 @@ def framedata_read_fits(filename=None, hdu=0, unit='BUNIT',
         if hdul[hdu_mask] == hdul[hdu]:
             raise ValueError('`hdu_mask` and `hdu` cannot be the '
                              'same!')
-        mask = mask_hdu.data
+        mask = _read_plane(hdul, hdu_mask, section, n_threads)
     else:
         mask = None
 
-    frame = FrameData(data_hdu.data, unit=dunit, meta=header,
-                      uncertainty=uncertainty, u_unit=uunit,
-                      mask=mask, use_memmap_backend=use_memmap_backend)
+    data_mm = None
+    unct_mm = None
+    if lazy_load and section is None:
+        data_mm = _fits_memmap_args(hdul, hdu)
+        if hdu_uncert is not None:
+            unct_mm = _fits_memmap_args(hdul, hdul.index_of(hdu_uncertainty))
+
+    if data_mm is not None:
+        # Same unit checks of the FrameData creation
+        if hdu_uncert is not None:
+            unit_consistency(dunit, uunit)
+        frame = FrameData(None, meta=header, use_memmap_backend=True,
+                          origin_filename=data_mm[0], mask_mode=mask_mode)
+        frame._data.attach_file(*data_mm, unit=dunit)
+        if unct_mm is not None:
+            frame._unct.attach_file(*unct_mm, unit=uunit)
+        elif uncertainty is not None:
+            frame._unct.reset_data(uncertainty, unit=uunit)
+        if mask is not None and mask_mode == 'flags':
+            frame.mask = mask
+        elif mask is not None:
+            frame.mask = np.array(mask, dtype=bool)
+        else:
+            frame.mask = False
+    else:
+        data = _read_plane(hdul, hdu, section, n_threads)
+        frame = FrameData(data, unit=dunit, meta=header,
+                          uncertainty=uncertainty, u_unit=uunit,
+                          mask=mask, use_memmap_backend=use_memmap_backend,
+                          mask_mode=mask_mode)
     hdul.close()
 
     return frame
@@ -1,25 +1,35 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import astroscrappy
+from scipy.interpolate import UnivariateSpline
+from astropy import units as u
 
 from ..logger import logger
+from ..py_utils import pool_context
 from .imarith import imarith
-from ..framedata import check_framedata
+from ..framedata import check_framedata, FrameData, framedata_read_fits, \
+                        framedata_write_fits
+from ..file_manager import FileGroup
+from ..framedata.memmap import unwrap_array
 
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
 
-__all__ = ['cosmics_lacosmic', 'gain_correct', 'subtract_bias', 'subtract_dark',
-           'flat_correct', 'process_ccd']
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
-# TODO: replace ccdproc functions by built-in, skiping units
-# block_reduce = ccdproc.block_reduce
-# block_replicate = ccdproc.block_replicate
-# trim_image = ccdproc.trim_image
-# subtract_overscan = partial(ccdproc.subtract_overscan,
-#                             add_keyword='hierarch astropop'
-#                             ' overscan_subtracted')
+__all__ = ['cosmics_lacosmic', 'gain_correct', 'subtract_bias', 'subtract_dark',
+           'flat_correct', 'subtract_overscan', 'trim_image', 'block_reduce',
+           'calibrate_frame', 'process_image', 'process_ccd']
 
 
 ###############################################################################
@@ -70,7 +80,7 @@ def subtract_bias(image, master_bias, inplace=False,
     nim = imarith(image, master_bias, '-', inplace=False, logger=logger)
 
     nim.header['hierarch astropop bias_corrected'] = True
-    name = master_bias.filename
+    name = master_bias.origin_filename
     if name is not None:
         nim.header['hierarch astropop bias_corrected_file'] = name
 
@@ -99,7 +109,7 @@ def subtract_dark(image, master_dark, dark_exposure, image_exposure,
 
     nim.header['hierarch astropop dark_corrected'] = True
     nim.header['hierarch astropop dark_corrected_scale'] = scale
-    name = master_dark.filename
+    name = master_dark.origin_filename
     if name is not None:
         name = os.path.basename(name)
         nim.header['hierarch astropop dark_corrected_file'] = name
@@ -115,8 +125,9 @@ def flat_correct(image, master_flat, min_value=None, norm_value=None,
 
     if min_value is not None:
         logger.debug(f'Set lower flat value to {min_value}')
-        mask = master_flat.data < min_value
-        master_flat.data[np.where(mask)] = min_value
+        # boolean index works with lazy backends too
+        mask = unwrap_array(master_flat.data < min_value)
+        master_flat.data[mask] = min_value
 
     if norm_value is not None:
         logger.debug(f'Normalizing flat with {norm_value} value.')
@@ -127,7 +138,7 @@ def flat_correct(image, master_flat, min_value=None, norm_value=None,
 
     nim.header['hierarch astropop flat_corrected'] = True
 
-    name = master_flat.filename
+    name = master_flat.origin_filename
     if name is not None:
         name = os.path.basename(name)
         nim.header['hierarch astropop flat_corrected_file'] = name
@@ -135,12 +146,899 @@ def flat_correct(image, master_flat, min_value=None, norm_value=None,
     return nim
 
 
-def process_ccd(ccddata, master_bias=None, master_dark=None, master_flat=None,
-                gain=None, image_exposure=None, dark_exposure=None, trim=None,
-                lacosmic=False, rebin_func=np.sum,
-                rebin_size=None, readnoise=None, badpixmask=None,
-                overscan=None,
-                logger=logger):
-    """Process all the default steps of CCD calibration."""
+###############################################################################
+# Overscan, trim and rebin
+###############################################################################
+
+overscan_fit_methods = ['median', 'poly', 'spline']
+
+
+def _parse_section(section, shape):
+    """Numpy slices of a section.
+
+    Sections can be tuples of slices, in numpy order, or FITS strings, like
+    ``'[1:100,*]'``, 1-indexed, inclusive and in FITS order.
+    """
+    if isinstance(section, str):
+        items = section.strip().strip('[]').split(',')
+        if len(items) != len(shape):
+            raise ValueError(f'Section {section} do not match the image '
+                             f'dimensions {len(shape)}.')
+        slices = []
+        for item in items[::-1]:
+            item = item.strip()
+            if item == '*':
+                slices.append(slice(None))
+                continue
+            try:
+                start, stop = (int(i) for i in item.split(':'))
+            except ValueError:
+                raise ValueError(f'Invalid FITS section {section}.')
+            if start > stop:
+                raise ValueError(f'Flipped sections, like {section}, are '
+                                 'not supported.')
+            slices.append(slice(start-1, stop))
+        return tuple(slices)
+
+    if isinstance(section, slice):
+        section = (section,)
+    section = tuple(section)
+    if len(section) > len(shape) or \
+       not all(isinstance(i, slice) and i.step in (None, 1)
+               for i in section):
+        raise ValueError(f'Section {section} must be a tuple of contiguous '
+                         'slices, one per image axis.')
+    return section + (slice(None),)*(len(shape) - len(section))
+
+
+def _fits_section(slices, shape):
+    """FITS string of numpy slices, to be stored in headers."""
+    items = []
+    for sl, n in zip(slices[::-1], shape[::-1]):
+        start, stop, _ = sl.indices(n)
+        items.append(f'{start+1}:{stop}')
+    return '[' + ','.join(items) + ']'
+
+
+def subtract_overscan(image, overscan, overscan_axis=1, fit='median',
+                      fit_order=3, spline_smoothing=None, inplace=False,
+                      logger=logger):
+    """Subtract the overscan level of an image.
+
+    The overscan region is collapsed by a median along ``overscan_axis``.
+    Only the region is read, so memmapped images are not loaded entirely.
+
+    Parameters
+    ----------
+    image : `~astropop.framedata.FrameData` compatible
+        Image to process.
+    overscan : str or tuple of slices
+        Overscan region, as a FITS section string, like ``'[1025:1056,*]'``,
+        or a tuple of slices in numpy order.
+    overscan_axis : int, optional
+        Axis along which the overscan is collapsed, in numpy order. Default
+        is 1, giving one value per row.
+    fit : {``'median'``, ``'poly'``, ``'spline'``}, optional
+        Model of the collapsed overscan. ``'median'`` uses the collapsed
+        values directly, ``'poly'`` a polynomial of ``fit_order`` and
+        ``'spline'`` a smoothing spline of ``fit_order`` degree.
+    fit_order : int, optional
+        Order of the polynomial or of the spline.
+    spline_smoothing : float, optional
+        Smoothing factor of the spline. See
+        `~scipy.interpolate.UnivariateSpline`.
+    inplace : bool, optional
+        Subtract the overscan in the image buffers.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+
+    Returns
+    -------
+    `~astropop.framedata.FrameData`:
+        Image with the overscan subtracted.
+    """
+    image = check_framedata(image)
+    if fit not in overscan_fit_methods:
+        raise ValueError(f'Fit {fit} not in {overscan_fit_methods}.')
+    if len(image.shape) != 2 or overscan_axis not in (0, 1):
+        raise ValueError('Overscan is only supported for 2D images, with '
+                         'overscan_axis 0 or 1.')
+    section = _parse_section(overscan, image.shape)
+    axis = 1 - overscan_axis
+    region = np.asarray(unwrap_array(image.data)[section])
+    profile = np.median(region, axis=overscan_axis)
+    n = image.shape[axis]
+    x = np.arange(n)[section[axis]]
+
+    logger.debug(f'Subtracting overscan {_fits_section(section, image.shape)}'
+                 f' with {fit} fit.')
+    if fit == 'median':
+        if len(x) != n:
+            raise ValueError('Median overscan must cover the entire axis '
+                             f'{axis} of the image.')
+        model = profile
+    elif fit == 'poly':
+        poly = np.polynomial.Polynomial.fit(x, profile, fit_order)
+        model = poly(np.arange(n))
+    else:
+        spline = UnivariateSpline(x, profile, k=fit_order,
+                                  s=spline_smoothing)
+        model = spline(np.arange(n))
+    model = np.expand_dims(model, overscan_axis)
+
+    # The model has no errors or mask. Image ones are kept.
+    nim = imarith(image, FrameData(model, unit=image.unit), '-',
+                  inplace=inplace, propagate_errors=True, handle_mask=True,
+                  logger=logger)
+    nim.header['hierarch astropop overscan_subtracted'] = True
+    nim.header['hierarch astropop overscan_section'] = \
+        _fits_section(section, image.shape)
+    nim.header['hierarch astropop overscan_fit'] = fit
+    return nim
+
+
+def trim_image(image, section, inplace=False, logger=logger):
+    """Trim an image to a section, without copying the data.
+
+    Data, uncertainty and mask of the trimmed image are views of the
+    original buffers, including memmaps. Only the section is copied, when
+    the trimmed image is written.
+
+    Parameters
+    ----------
+    image : `~astropop.framedata.FrameData` compatible
+        Image to trim.
+    section : str or tuple of slices
+        Section to keep, as a FITS section string, like ``'[1:1024,*]'``,
+        or a tuple of slices in numpy order.
+    inplace : bool, optional
+        Trim the image itself, instead of a copy-on-write copy.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+
+    Returns
+    -------
+    `~astropop.framedata.FrameData`:
+        Trimmed image.
+    """
+    image = check_framedata(image)
+    shape = image.shape
+    section = _parse_section(section, shape)
+    fits_section = _fits_section(section, shape)
+    logger.debug(f'Trimming image to {fits_section} section.')
+
+    ccd = image if inplace else image.copy()
+    for container in (ccd._data, ccd._unct, ccd._mask):
+        container._trim(section)
+    if ccd.wcs is not None:
+        ccd.wcs = ccd.wcs.slice(section)
+    ccd.header['hierarch astropop trimmed_section'] = fits_section
+    return ccd
+
+
+def _block_shape(shape, block_size):
+    """Block size of each axis, checked against the image shape."""
+    block = np.broadcast_to(np.asarray(block_size, dtype=int),
+                            (len(shape),))
+    if np.any(block < 1) or np.any(block > np.array(shape)):
+        raise ValueError(f'Invalid block size {block_size} for shape '
+                         f'{shape}.')
+    return tuple(int(b) for b in block)
+
+
+def _reduce_blocks(values, block, func):
+    """Reduce blocks of an array using a reshape. Values must be cropped
+    to a multiple of the block size."""
+    shape = []
+    for n, b in zip(np.shape(values), block):
+        shape.extend([n//b, b])
+    return func(np.reshape(values, shape), axis=tuple(range(1, len(shape), 2)))
+
+
+def block_reduce(image, block_size, func=np.sum, inplace=False,
+                 logger=logger):
+    """Rebin an image, reducing blocks of pixels.
+
+    Blocks are reduced with a reshape of the data, in chunks of rows, so
+    memmapped images are never loaded entirely. Pixels left over the last
+    full block of each axis are dropped. Uncertainties are propagated for
+    `numpy.sum` and `numpy.mean` and a block is masked if any of its pixels
+    is masked.
+
+    Parameters
+    ----------
+    image : `~astropop.framedata.FrameData` compatible
+        Image to rebin.
+    block_size : int or tuple of int
+        Size of the blocks, for all axes or one per axis.
+    func : callable, optional
+        Reduce function, accepting the ``axis`` argument, like `numpy.sum`,
+        `numpy.mean` or `numpy.median`.
+    inplace : bool, optional
+        Replace the image data by the rebinned data.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+
+    Returns
+    -------
+    `~astropop.framedata.FrameData`:
+        Rebinned image.
+    """
+    image = check_framedata(image)
+    shape = image.shape
+    block = _block_shape(shape, block_size)
+    new_shape = tuple(n//b for n, b in zip(shape, block))
+    crop = tuple(slice(0, n*b) for n, b in zip(new_shape, block))
+    logger.debug(f'Rebinning image with {block} blocks.')
+
+    data = unwrap_array(image.data)
+    unct = None
+    if not image._unct.empty:
+        if func in (np.sum, np.mean):
+            unct = unwrap_array(image._unct)
+        else:
+            logger.debug(f'Uncertainties are not propagated by {func}.')
+    mask = image.mask
+
+    # Chunks of output rows, ~4 MiB of input each
+    row_bytes = np.dtype(image.dtype).itemsize*block[0] * \
+        int(np.prod(shape[1:]))
+    chunk_rows = max(1, (4*2**20)//max(row_bytes, 1))
+    n_blocks = int(np.prod(block))
+    out = uout = mout = None
+    for i in range(0, new_shape[0], chunk_rows):
+        rows = (slice(i*block[0], min(i+chunk_rows, new_shape[0])*block[0]),)
+        rows += crop[1:]
+        res = np.asarray(_reduce_blocks(data[rows], block, func))
+        if out is None:
+            out = np.empty(new_shape, dtype=res.dtype)
+            if unct is not None:
+                uout = np.empty(new_shape, dtype=np.result_type(unct, 'f4'))
+            mout = np.empty(new_shape, dtype=bool)
+        out_rows = slice(i, i+chunk_rows)
+        out[out_rows] = res
+        if unct is not None:
+            var = _reduce_blocks(np.square(unct[rows]), block, np.sum)
+            if func is np.mean:
+                var = var/n_blocks**2
+            np.sqrt(var, out=uout[out_rows])
+        mout[out_rows] = _reduce_blocks(np.asarray(mask[rows]), block,
+                                        np.any)
+
+    wcs = image.wcs
+    if wcs is not None:
+        wcs = wcs.slice(tuple(slice(None, None, b) for b in block))
+
+    if inplace:
+        ccd = image
+        ccd.data.reset_data(out, unit=image.unit, copy=False)
+        if uout is not None:
+            ccd._unct.reset_data(uout, unit=image._unct.unit, copy=False)
+        else:
+            ccd.uncertainty = None
+        ccd.mask = mout
+        if wcs is not None:
+            ccd.wcs = wcs
+    else:
+        u_unit = None if uout is None else image._unct.unit
+        ccd = FrameData(out, unit=image.unit, uncertainty=uout,
+                        u_unit=u_unit, mask=mout,
+                        meta=dict(image.meta), wcs=wcs,
+                        mask_mode=image.mask_mode,
+                        origin_filename=image.origin_filename)
+
+    ccd.header['hierarch astropop rebin_size'] = str(block)
+    ccd.header['hierarch astropop rebin_func'] = getattr(func, '__name__',
+                                                         str(func))
+    return ccd
+
+
+###############################################################################
+# Fused calibration
+###############################################################################
+
+# Engines of calibrate_frame, in the default preference order
+calibration_engines = ['numexpr', 'numba', 'numpy']
+
+# Calibration of one pixel, for numexpr. Absent corrections use neutral
+# values. var(r/f) = (var(r) + (r/f)**2*var(f))/f**2
+_calib_flat = '(where(flat < fmin, fmin, flat)/fnorm)'
+_calib_diff = '(img - bs*bias - ds*dark)'
+_calib_expr = f'{_calib_diff}/{_calib_flat}*gain'
+_calib_unct_expr = f'abs(gain)*sqrt(si**2 + (bs*sb)**2 + (ds*sd)**2 + ' \
+                   f'({_calib_diff}/{_calib_flat}*sf/fnorm)**2)/{_calib_flat}'
+
+_numba_kernels = []
+
+
+def _calibration_engine(engine):
+    """Check the engine, or choose the fastest available."""
+    if engine is None:
+        if ne is not None:
+            return 'numexpr'
+        if numba is not None:
+            return 'numba'
+        return 'numpy'
+    if engine not in calibration_engines:
+        raise ValueError(f'Engine {engine} not in {calibration_engines}.')
+    if engine == 'numexpr' and ne is None:
+        raise ImportError('numexpr is needed to use the numexpr engine.')
+    if engine == 'numba' and numba is None:
+        raise ImportError('numba is needed to use the numba engine.')
+    return engine
+
+
+def _get_numba_kernels():
+    """Compile the numba calibration ufuncs, only in the first use."""
+    if _numba_kernels:
+        return _numba_kernels
+    sig = ['float64(' + ', '.join(['float64']*9) + ')']
+
+    @numba.vectorize(sig, target='parallel')
+    def calib(img, bias, bs, dark, ds, flat, fmin, fnorm, gain):
+        fl = max(flat, fmin)/fnorm
+        return (img - bs*bias - ds*dark)/fl*gain
+
+    sig = ['float64(' + ', '.join(['float64']*13) + ')']
+
+    @numba.vectorize(sig, target='parallel')
+    def calib_unct(img, bias, bs, dark, ds, flat, fmin, fnorm, gain,
+                   si, sb, sd, sf):
+        fl = max(flat, fmin)/fnorm
+        q = (img - bs*bias - ds*dark)/fl
+        var = si*si + (bs*sb)**2 + (ds*sd)**2 + (q*sf/fnorm)**2
+        return abs(gain)*np.sqrt(var)/fl
+
+    _numba_kernels.extend([calib, calib_unct])
+    return _numba_kernels
+
+
+def _scaled(value, scale):
+    """Multiply by a scale, only if needed."""
+    return value if scale == 1.0 else np.multiply(value, scale)
+
+
+def _numpy_calibrate(t, out, uout):
+    """Calibrate a block with numpy, skipping the absent corrections."""
+    if t['bias'] is not None:
+        # dtype avoids integer wrapping
+        np.subtract(t['img'], _scaled(t['bias'], t['bs']), out=out,
+                    dtype=out.dtype)
+    else:
+        out[...] = t['img']
+    if t['dark'] is not None:
+        np.subtract(out, _scaled(t['dark'], t['ds']), out=out)
+    if uout is not None:
+        var = np.square(t['si'])
+        if t['bias'] is not None:
+            var = var + np.square(_scaled(t['sb'], t['bs']))
+        if t['dark'] is not None:
+            var = var + np.square(_scaled(t['sd'], t['ds']))
+    if t['flat'] is not None:
+        flat = t['flat']
+        if t['fmin'] != -np.inf:
+            flat = np.maximum(flat, t['fmin'])
+        flat = _scaled(flat, 1/t['fnorm'])
+        np.divide(out, flat, out=out)
+        if uout is not None:
+            # var(r/f) = (var(r) + (r/f)**2*var(f))/f**2
+            var = var + np.square(out*_scaled(t['sf'], 1/t['fnorm']))
+            var = var/np.square(flat)
+    if t['gain'] != 1.0:
+        np.multiply(out, t['gain'], out=out)
+    if uout is not None:
+        np.sqrt(var, out=uout)
+        if t['gain'] != 1.0:
+            np.multiply(uout, abs(t['gain']), out=uout)
+
+
+def _neutral(t):
+    """Fill absent corrections with neutral values, for fixed kernels."""
+    t = dict(t)
+    for key, value in [('bias', 0.0), ('dark', 0.0), ('flat', 1.0),
+                       ('sb', 0.0), ('sd', 0.0), ('sf', 0.0)]:
+        if t[key] is None:
+            t[key] = value
+    return t
+
+
+def _numexpr_calibrate(t, out, uout):
+    """Calibrate a block with numexpr, in its threads."""
+    t = _neutral(t)
+    # Uncertainties first, since out may be the image buffer
+    if uout is not None:
+        ne.evaluate(_calib_unct_expr, local_dict=t, out=uout,
+                    casting='same_kind')
+    ne.evaluate(_calib_expr, local_dict=t, out=out, casting='same_kind')
+
+
+def _numba_calibrate(t, out, uout):
+    """Calibrate a block with the parallel numba ufuncs."""
+    t = _neutral(t)
+    calib, calib_unct = _get_numba_kernels()
+    args = [t[k] for k in ('img', 'bias', 'bs', 'dark', 'ds', 'flat', 'fmin',
+                           'fnorm', 'gain')]
+    # Uncertainties first, since out may be the image buffer
+    if uout is not None:
+        calib_unct(*args, t['si'], t['sb'], t['sd'], t['sf'], out=uout)
+    calib(*args, out=out)
+
+
+_calibration_funcs = {'numpy': _numpy_calibrate,
+                      'numexpr': _numexpr_calibrate,
+                      'numba': _numba_calibrate}
+
+
+def _block(value, rows, ndim):
+    """Rows of a full array. Scalars and broadcasted values are kept."""
+    if value is None or np.ndim(value) != ndim or ndim == 0:
+        return value
+    return np.asarray(value[rows])
+
+
+def _unit_scale(frame, unit, name):
+    """Scale to convert the values of a master frame to unit."""
+    try:
+        return u.Unit(frame.unit).to(unit)
+    except u.UnitConversionError as e:
+        raise ValueError(f'{name} unit {frame.unit} is not compatible with '
+                         f'the image unit {unit}. Error: {e}')
+
+
+def calibrate_frame(image, master_bias=None, master_dark=None,
+                    master_flat=None, gain=None, gain_unit=None,
+                    dark_exposure=None, image_exposure=None,
+                    flat_min_value=None, flat_norm_value=None,
+                    propagate_errors=False, handle_mask=False, inplace=False,
+                    engine=None, chunk_rows=None, logger=logger):
+    """Bias, dark, flat and gain corrections in one pass over the pixels.
+
+    The result is ``(image - bias - scale*dark)/flat*gain``, computed in
+    chunks of rows, with the uncertainties and masks of all frames joined
+    in the same pass. Units are checked once, before the computation.
+    Different of `flat_correct`, ``flat_min_value`` do not change the
+    master flat.
+
+    Parameters
+    ----------
+    image : `~astropop.framedata.FrameData` compatible
+        Image to calibrate.
+    master_bias, master_dark, master_flat : `~astropop.framedata.FrameData`
+    compatible, optional
+        Master frames. Corrections of `None` frames are skipped.
+    gain : float or `~astropy.units.Quantity`, optional
+        Gain to multiply the image.
+    gain_unit : str or `~astropy.units.Unit`, optional
+        Unit of the gain, if it is not a `~astropy.units.Quantity`.
+    dark_exposure, image_exposure : float, optional
+        Exposures to scale the master dark. If not set, no scale is used.
+    flat_min_value : float, optional
+        Flat values lower than this are replaced by it.
+    flat_norm_value : float, optional
+        Value to normalize the master flat.
+    propagate_errors : bool, optional
+        Propagate the uncertainties of all frames.
+    handle_mask : bool, optional
+        Join the masks of all frames.
+    inplace : bool, optional
+        Write the results in the image buffers, when possible.
+    engine : {``'numexpr'``, ``'numba'``, ``'numpy'``}, optional
+        Computation engine. Default is the fastest one installed.
+    chunk_rows : int, optional
+        Number of rows of each chunk. Default is ~4 MiB of result per chunk.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+
+    Returns
+    -------
+    `~astropop.framedata.FrameData`:
+        Calibrated image. Lazy backends are computed to numpy.
+    """
+    image = check_framedata(image)
+    engine = _calibration_engine(engine)
+    unit = u.Unit(image.unit)
+    shape = image.shape
+    ndim = len(shape)
+    frames = {'bias': master_bias, 'dark': master_dark, 'flat': master_flat}
+    frames = {k: None if v is None else check_framedata(v)
+              for k, v in frames.items()}
+    for name, frame in frames.items():
+        if frame is not None and \
+           np.broadcast_shapes(shape, frame.shape) != shape:
+            raise ValueError(f'Master {name} shape {frame.shape} do not '
+                             f'match the image shape {shape}.')
+
+    def _values(frame):
+        return None if frame is None else unwrap_array(frame.data)
+
+    def _unct(frame):
+        if frame is None or frame._unct.empty:
+            return None if frame is None else 0.0
+        return unwrap_array(frame._unct)
+
+    terms = {'img': unwrap_array(image.data), 'bs': 1.0, 'ds': 1.0,
+             'fmin': -np.inf, 'fnorm': 1.0, 'gain': 1.0,
+             'si': _unct(image) if propagate_errors else None}
+    for name, frame in frames.items():
+        terms[name] = _values(frame)
+        terms['s'+name[0]] = _unct(frame) if propagate_errors else None
+
+    dark_scale = 1.0
+    if master_bias is not None:
+        terms['bs'] = _unit_scale(frames['bias'], unit, 'Master bias')
+    if master_dark is not None:
+        if dark_exposure is not None and image_exposure is not None:
+            dark_scale = image_exposure/dark_exposure
+        terms['ds'] = dark_scale*_unit_scale(frames['dark'], unit,
+                                             'Master dark')
+    if master_flat is not None:
+        unit = unit/u.Unit(frames['flat'].unit)
+        if flat_min_value is not None:
+            terms['fmin'] = flat_min_value
+        if flat_norm_value is not None:
+            terms['fnorm'] = flat_norm_value
+    if gain is not None:
+        if isinstance(gain, u.Quantity):
+            gain_unit = gain.unit
+            gain = gain.value
+        terms['gain'] = gain
+        if gain_unit is not None:
+            unit = unit*u.Unit(gain_unit)
+    unit = u.Unit(unit)
+
+    # Calibrated data are always float
+    dtype = np.result_type(*[v for v in (terms['img'], terms['bias'],
+                                         terms['dark'], terms['flat'])
+                             if v is not None])
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.dtype('f8')
+
+    if inplace:
+        ccd = image
+    else:
+        ccd = FrameData(None, mask_mode=image.mask_mode)
+        ccd.meta = image.header.copy()
+
+    # The image data is read by rows before they are written. So, inplace
+    # results can be written in the image buffers, if not shared by masters.
+    out = None
+    if inplace and not any(isinstance(terms[k], np.ndarray) and
+                           np.may_share_memory(terms['img'], terms[k])
+                           for k in frames):
+        out = ccd.data._inplace_buffer(shape, dtype)
+    own_out = out is None
+    if own_out:
+        out = np.empty(shape, dtype=dtype)
+    uout = None
+    if propagate_errors:
+        if inplace and not image._unct.empty:
+            uout = image._unct._inplace_buffer(shape, dtype)
+        own_unct = uout is None
+        if own_unct:
+            uout = np.empty(shape, dtype=dtype)
+
+    mask = None
+    if handle_mask:
+        masks = [f.mask for f in [image, *frames.values()] if f is not None]
+        mask = np.zeros(shape, dtype=bool)
+
+    if chunk_rows is None:
+        row_bytes = dtype.itemsize*int(np.prod(shape[1:]))
+        chunk_rows = max(1, (4*2**20)//max(row_bytes, 1))
+    n_rows = shape[0] if ndim > 0 else 1
+    logger.debug(f'Calibrating frame with {engine} engine, in chunks of '
+                 f'{chunk_rows} rows.')
+
+    func = _calibration_funcs[engine]
+    for i in range(0, n_rows, chunk_rows):
+        rows = slice(i, i+chunk_rows) if ndim > 0 else Ellipsis
+        block = {k: _block(v, rows, ndim) for k, v in terms.items()}
+        func(block, out[rows],
+             uout[rows] if uout is not None else None)
+        if mask is not None:
+            for m in masks:
+                if np.ndim(m) == ndim and ndim > 0:
+                    m = m[rows]
+                np.logical_or(mask[rows], m, out=mask[rows])
+
+    if own_out:
+        ccd.data.reset_data(out, unit=unit, copy=False)
+    else:
+        ccd.data.set_unit(unit)
+    if propagate_errors:
+        if own_unct:
+            ccd._unct.reset_data(uout, unit=unit, copy=False)
+        else:
+            ccd._unct.set_unit(unit)
+    else:
+        ccd.uncertainty = None
+    ccd.mask = mask if handle_mask else False
+
+    header = ccd.header
+    if master_bias is not None:
+        header['hierarch astropop bias_corrected'] = True
+        name = frames['bias'].origin_filename
+        if name is not None:
+            header['hierarch astropop bias_corrected_file'] = name
+    if master_dark is not None:
+        header['hierarch astropop dark_corrected'] = True
+        header['hierarch astropop dark_corrected_scale'] = dark_scale
+        name = frames['dark'].origin_filename
+        if name is not None:
+            name = os.path.basename(name)
+            header['hierarch astropop dark_corrected_file'] = name
+    if master_flat is not None:
+        header['hierarch astropop flat_corrected'] = True
+        name = frames['flat'].origin_filename
+        if name is not None:
+            name = os.path.basename(name)
+            header['hierarch astropop flat_corrected_file'] = name
+    if gain is not None:
+        header['hierarch astropop gain_corrected'] = True
+        header['hierarch astropop gain_corrected_value'] = gain
+        header['hierarch astropop gain_corrected_unit'] = str(gain_unit)
+
+    return ccd
+
+
+###############################################################################
+# Calibration engine
+###############################################################################
+
+# Masters and options of the calibration workers, set by _init_worker
+_worker_state = {}
+
+
+def _load_frame(value, ext=0, logger=logger):
+    """Load a frame from a file name, or check a FrameData compatible."""
+    if isinstance(value, (str, os.PathLike)):
+        logger.debug(f'Loading frame from {value} file.')
+        return framedata_read_fits(os.fspath(value), hdu=ext)
+    return check_framedata(value, logger=logger)
+
+
+def _output_name(filename, save_to, append_to_name=None):
+    """Name of the calibrated file, in the save_to folder."""
+    base = os.path.basename(os.fspath(filename))
+    # Results are written uncompressed
+    for extf in ('.gz', '.bz2', '.Z', '.zip'):
+        if base.endswith(extf):
+            base = base[:-len(extf)]
+    base, extf = os.path.splitext(base)
+    if extf not in ('.fits', '.fts', '.fit', '.fz'):
+        base = base + extf
+        extf = '.fits'
+    if append_to_name is not None:
+        base = base + append_to_name
+    return os.path.join(save_to, base + extf)
+
+
+def process_image(image, master_bias=None, master_dark=None,
+                  master_flat=None, gain=None, gain_key=None,
+                  readnoise=None, readnoise_key=None, exposure_key=None,
+                  image_exposure=None, dark_exposure=None,
+                  flat_min_value=None, flat_norm_value=None,
+                  lacosmic=False, lacosmic_params={}, badpixmask=None,
+                  trim=None, overscan=None, overscan_params={},
+                  rebin_size=None, rebin_func=np.sum, propagate_errors=False,
+                  handle_mask=False, inplace=False, engine=None,
+                  logger=logger, **kwargs):
+    """Process all the default steps of CCD calibration of one image.
+
+    The overscan is subtracted and the image is trimmed first, so the
+    later steps only handle the trimmed pixels. Bias, dark, flat and gain
+    corrections are done by `calibrate_frame`, in one pass. Cosmic rays are
+    removed in the calibrated data, before the rebin.
+
+    Parameters
+    ----------
+    image : `~astropop.framedata.FrameData` compatible or str
+        Image to calibrate, or the name of its file.
+    master_bias, master_dark, master_flat : `~astropop.framedata.FrameData`
+    compatible or str, optional
+        Master frames, or the names of their files. Corrections of `None`
+        frames are skipped.
+    gain : float or `~astropy.units.Quantity`, optional
+        Gain to multiply the image. If `None`, it is read from the
+        ``gain_key`` of the header, if available.
+    gain_key, readnoise_key, exposure_key : str, optional
+        Header keys of the gain, read noise and exposure.
+    readnoise : float, optional
+        Read noise, used by LAcosmic.
+    image_exposure, dark_exposure : float, optional
+        Exposures to scale the master dark. If `None`, they are read from
+        the ``exposure_key`` of the headers.
+    flat_min_value, flat_norm_value : float, optional
+        Flat options. See `calibrate_frame`.
+    lacosmic : bool, optional
+        Remove the cosmic rays with `cosmics_lacosmic`.
+    lacosmic_params : dict, optional
+        Arguments passed to `cosmics_lacosmic`.
+    badpixmask : array_like, optional
+        Bad pixels to be masked in the calibrated image, before the rebin.
+    trim : str or tuple of slices, optional
+        Section to keep. See `trim_image`.
+    overscan : str or tuple of slices, optional
+        Overscan section. See `subtract_overscan`.
+    overscan_params : dict, optional
+        Arguments passed to `subtract_overscan`.
+    rebin_size, rebin_func : optional
+        Block size and reduce function. See `block_reduce`.
+    propagate_errors, handle_mask, inplace, engine : optional
+        See `calibrate_frame`.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+
+    Returns
+    -------
+    `~astropop.framedata.FrameData`:
+        Calibrated image.
+    """
+    image = _load_frame(image, logger=logger)
+    masters = [None if m is None else _load_frame(m, logger=logger)
+               for m in (master_bias, master_dark, master_flat)]
+    master_bias, master_dark, master_flat = masters
+    header = image.header
+
+    if gain is None and gain_key is not None:
+        gain = header.get(gain_key, None)
+        if gain is None:
+            logger.debug(f'No {gain_key} key in header. Skipping gain '
+                         'correction.')
+    if readnoise is None and readnoise_key is not None:
+        readnoise = header.get(readnoise_key, None)
+    if master_dark is not None and exposure_key is not None:
+        if image_exposure is None:
+            image_exposure = header.get(exposure_key, None)
+        if dark_exposure is None:
+            dark_exposure = master_dark.header.get(exposure_key, None)
+
+    ccd = image
+    if overscan is not None:
+        ccd = subtract_overscan(ccd, overscan, inplace=inplace,
+                                logger=logger, **overscan_params)
+        inplace = True
+    if trim is not None:
+        ccd = trim_image(ccd, trim, inplace=inplace, logger=logger)
+        inplace = True
+
+    ccd = calibrate_frame(ccd, master_bias=master_bias,
+                          master_dark=master_dark, master_flat=master_flat,
+                          gain=gain, dark_exposure=dark_exposure,
+                          image_exposure=image_exposure,
+                          flat_min_value=flat_min_value,
+                          flat_norm_value=flat_norm_value,
+                          propagate_errors=propagate_errors,
+                          handle_mask=handle_mask, inplace=inplace,
+                          engine=engine, logger=logger)
+
+    if lacosmic:
+        lacosmic_params = dict(lacosmic_params)
+        if readnoise is not None:
+            lacosmic_params.setdefault('readnoise', readnoise)
+        ccd = cosmics_lacosmic(ccd, inplace=True, logger=logger,
+                               **lacosmic_params)
+
+    if badpixmask is not None:
+        ccd.mask = np.logical_or(ccd.mask, badpixmask)
+
+    if rebin_size is not None:
+        ccd = block_reduce(ccd, rebin_size, func=rebin_func, inplace=True,
+                           logger=logger)
+
+    return ccd
+
+
+def _init_worker(handles, options):
+    """Attach the shared master frames in a calibration worker."""
+    _worker_state['masters'] = {k: None if h is None
+                                else FrameData.from_shared(h)
+                                for k, h in handles.items()}
+    _worker_state['options'] = options
+
+
+def _process_file(filename, output, ext, overwrite):
+    """Calibrate one file and write the result, in a worker."""
+    image = framedata_read_fits(filename, hdu=ext, lazy_load=True)
+    ccd = process_image(image, inplace=True, **_worker_state['masters'],
+                        **_worker_state['options'])
+    framedata_write_fits(ccd, output, overwrite=overwrite)
+    return output
+
+
+def process_ccd(images, save_to, master_bias=None, master_dark=None,
+                master_flat=None, ext=0, append_to_name=None,
+                overwrite=False, n_processes=None, max_pending=None,
+                logger=logger, **kwargs):
+    """Calibrate a list of images, writing the results to disk.
+
+    Master frames are loaded only once and shared with the workers without
+    copies. Images are streamed through a pool of ``n_processes``
+    processes, with at most ``max_pending`` frames submitted at a time, and
+    each result is written to disk by its worker. So, the memory used does
+    not grow with the number of images.
+
+    Parameters
+    ----------
+    images : list of str or `~astropop.file_manager.FileGroup`
+        Files to calibrate. Generators are consumed as the work goes on.
+    save_to : str
+        Folder to write the calibrated files. Files keep their names.
+    master_bias, master_dark, master_flat : `~astropop.framedata.FrameData`
+    compatible or str, optional
+        Master frames, or the names of their files.
+    ext : int or str, optional
+        Extension of the image data. For `FileGroup`, its ``ext`` is used.
+    append_to_name : str, optional
+        String appended to the names of the calibrated files.
+    overwrite : bool, optional
+        Overwrite existing files.
+    n_processes : int, optional
+        Number of worker processes. Default is the number of CPUs. With 1,
+        images are processed in this process.
+    max_pending : int, optional
+        Maximum number of frames submitted and not finished. Default is
+        twice ``n_processes``.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+    **kwargs :
+        Options passed to `process_image`.
+
+    Returns
+    -------
+    list of str :
+        Names of the calibrated files, in the order of ``images``.
+    """
+    if isinstance(images, FileGroup):
+        ext = images.ext
+        images = images.files
+    os.makedirs(save_to, exist_ok=True)
+    n_processes = n_processes or os.cpu_count() or 1
+    max_pending = max_pending or 2*n_processes
+
+    masters = {'master_bias': master_bias, 'master_dark': master_dark,
+               'master_flat': master_flat}
+    masters = {k: None if v is None else _load_frame(v, logger=logger)
+               for k, v in masters.items()}
+    # Images are always calibrated in place, in their own buffers
+    kwargs.pop('inplace', None)
+    options = dict(kwargs, logger=logger)
+
+    outputs = []
+    start = time.perf_counter()
+    if n_processes == 1:
+        _worker_state.update(masters=masters, options=options)
+        try:
+            for filename in images:
+                output = _output_name(filename, save_to, append_to_name)
+                outputs.append(_process_file(filename, output, ext,
+                                             overwrite))
+        finally:
+            _worker_state.clear()
+    else:
+        # Masters must be alive while workers use the shared buffers
+        handles = {k: None if v is None else v.to_shared()
+                   for k, v in masters.items()}
+        with ProcessPoolExecutor(n_processes, mp_context=pool_context(),
+                                 initializer=_init_worker,
+                                 initargs=(handles, options)) as pool:
+            pending = set()
+            for filename in images:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for f in done:
+                        f.result()
+                output = _output_name(filename, save_to, append_to_name)
+                pending.add(pool.submit(_process_file, os.fspath(filename),
+                                        output, ext, overwrite))
+                outputs.append(output)
+            for f in wait(pending).done:
+                f.result()
 
-    raise NotImplementedError
+    elapsed = time.perf_counter() - start
+    n = len(outputs)
+    rate = n/elapsed if elapsed > 0 else float('inf')
+    logger.info(f'Calibrated {n} frames in {elapsed:.2f} s '
+                f'({rate:.2f} frames/s).')
+    return outputs
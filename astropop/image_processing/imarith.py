@@ -5,15 +5,21 @@ imarith
 
 Handle the IRAF's imarith and imcombine functions.
 '''
-# TODO: reimplement imcombine
 
+import os
+import numbers
+import warnings
 import numpy as np
 from astropy import units as u
 
-from ..framedata import FrameData, check_framedata, EmptyDataError
+from ..framedata import FrameData, check_framedata, EmptyDataError, \
+                        PackedMask, FlagMask, MemMapArray, \
+                        framedata_read_fits, framedata_write_fits
+from ..framedata.memmap import unwrap_array
+from ..framedata.framedata import shape_consistency
 from ..logger import logger, log_to_list
 
-__all__ = ['imarith']
+__all__ = ['imarith', 'imcombine', 'Combiner']
 
 
 _arith_funcs = {'+': np.add,
@@ -25,47 +31,133 @@ _arith_funcs = {'+': np.add,
                 '%': np.remainder}
 
 
+def _values(operand):
+    """Raw data values of a FrameData, in the array of its backend."""
+    return unwrap_array(operand.data)
+
+
+def _arith_units(operand1, operand2, operation):
+    """Compute the result unit once, using scalars.
+
+    Returns the unit of the result and the scale to convert the operand2
+    values before the operation.
+    """
+    unit1 = u.Unit(operand1.unit)
+    unit2 = u.Unit(operand2.unit)
+    if operation in {'*', '/'}:
+        return u.Unit(_arith_funcs[operation](unit1, unit2)), 1.0
+    if operation == '**':
+        scale = unit2.to(u.dimensionless_unscaled)
+        if unit1 == u.dimensionless_unscaled:
+            return unit1, scale
+        if operand2.size != 1:
+            raise ValueError('Only scalar exponents are supported for data'
+                             f' with unit {unit1}.')
+        exponent = float(np.asarray(_values(operand2)).ravel()[0])*scale
+        return unit1**exponent, scale
+    # +, -, //, % need compatible units
+    scale = unit2.to(unit1)
+    if operation == '//':
+        return u.dimensionless_unscaled, scale
+    return unit1, scale
+
+
+def _is_numpy(*values):
+    """Check if all values are numpy arrays or scalars, that accept
+    ``out=`` buffers."""
+    return all(isinstance(v, (np.ndarray, np.generic, numbers.Number))
+               for v in values)
+
+
+def _arith_error(operand1, operand2, operation, error):
+    """Error raised by any failure of the data arithmatics."""
+    return ValueError(f'Could not process the operation {operation} between'
+                      f'{operand1} and {operand2}. Error: {error}')
+
+
 def _arith_data(operand1, operand2, operation, logger):
-    """Handle the arithmatics of the data."""
-    data1 = u.Quantity(operand1.data)
-    data2 = u.Quantity(operand2.data)
+    """Handle the arithmatics of the data.
 
+    Units are handled once, with scalars, and the operation is done with
+    plain arrays of the data backend. So, lazy backends, like dask, build
+    task graphs.
+    """
     try:
-        return _arith_funcs[operation](data1, data2)
+        unit, scale = _arith_units(operand1, operand2, operation)
+        func = _arith_funcs[operation]
+        data1 = _values(operand1)
+        data2 = _values(operand2)
+        if scale == 1.0:
+            return func(data1, data2), unit
+
+        data2 = np.multiply(data2, scale)
+        if _is_numpy(data1, data2) and \
+           data2.shape == np.broadcast_shapes(np.shape(data1), data2.shape) \
+           and np.result_type(data1, data2) == data2.dtype:
+            # Reuse the scaled temporary as result buffer
+            return func(data1, data2, out=data2), unit
+        return func(data1, data2), unit
     except Exception as e:
-        raise ValueError(f'Could not process the operation {operation} between'
-                         f'{operand1} and {operand2}. Error: {e}')
+        raise _arith_error(operand1, operand2, operation, e)
 
 
 def _arith_unct(result, operand1, operand2, operation, logger):
-    """Handle the arithmatics of the uncertainties."""
+    """Handle the arithmatics of the uncertainties, given the result data.
+
+    Uncertainties are in the units of their data. Only uncorrelated errors
+    are propagated. With numpy arrays, the result is computed in one
+    preallocated buffer, with at most one temporary.
+    """
     def _extract(operand):
-        # Supose data is FrameData always
-        # Transform to quantity auto handles units
-        d = u.Quantity(operand.data)
         du = operand.uncertainty
-        try:
-            du = u.Quantity(du)
-        except TypeError:
-            du = 0.0*d.unit
-        return d, du
-
-    def _error_propagation(f, a, b, sa, sb):
-        # only deal with uncorrelated errors
+        if isinstance(du, MemMapArray):
+            du = unwrap_array(du)
+        else:
+            # Empty uncertainty
+            du = 0.0
+        return _values(operand), du
+
+    _, scale = _arith_units(operand1, operand2, operation)
+    a, sa = _extract(operand1)
+    b, sb = _extract(operand2)
+    f = result
+
+    if not _is_numpy(f, a, b, sa, sb):
+        # Lazy backends build their graphs
+        if scale != 1.0:
+            b = b*scale
+            sb = sb*scale
         if operation in {'+', '-'}:
-            return np.sqrt(sa**2 + sb**2)
+            return np.hypot(sa, sb)
         elif operation in {'*', '/', '//'}:
-            return f*np.sqrt((sa/a)**2 + (sb/b)**2)
+            return np.abs(f)*np.hypot(sa/a, sb/b)
         elif operation == '**':
-            return f*b*sa/a
-
-    data1, unct1 = _extract(operand1)
-    data2, unct2 = _extract(operand2)
-    resd, _ = _extract(result)
-
-    # Only propagate if operand1 has no empty uncertainty
-    nunct = _error_propagation(resd, data1, data2, unct1, unct2)
-    return nunct
+            return np.abs(f*b*sa/a)
+        return
+
+    shape = np.broadcast_shapes(*(np.shape(i) for i in (f, a, b, sa, sb)))
+    dtype = np.result_type(f, sa, sb, 0.0)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    out = np.empty(shape, dtype=dtype)
+
+    if operation in {'+', '-'}:
+        if scale != 1.0:
+            sb = np.multiply(sb, scale, out=out)
+        return np.hypot(sa, sb, out=out)
+    elif operation in {'*', '/', '//'}:
+        # Relative errors do not depend on the operand2 unit scale
+        np.divide(sa, a, out=out)
+        np.hypot(out, np.divide(sb, b), out=out)
+        np.multiply(out, f, out=out)
+        return np.abs(out, out=out)
+    elif operation == '**':
+        np.multiply(f, b, out=out)
+        if scale != 1.0:
+            np.multiply(out, scale, out=out)
+        np.multiply(out, sa, out=out)
+        np.divide(out, a, out=out)
+        return np.abs(out, out=out)
 
 
 def _arith_mask(operand1, operand2, operation, logger):
@@ -80,13 +172,148 @@ def _arith_mask(operand1, operand2, operation, logger):
     mask2 = operand2.mask
 
     old_n = np.count_nonzero(mask1)
-    nmask = np.logical_or(mask1, mask2)
+    if isinstance(mask1, (PackedMask, FlagMask)):
+        # Compact masks are combined directly in their packed words
+        nmask = mask1 | mask2
+    else:
+        nmask = np.logical_or(mask1, mask2)
     new_n = np.count_nonzero(nmask)
     logger.debug(f'Updating mask in math operation. '
                  f'From {old_n} to {new_n} masked elements.')
     return nmask
 
 
+def _result_dtype(func, *values):
+    """Data type of a ufunc result, following the numpy promotion rules.
+
+    Scalars and 0-d arrays are used by value, like in the real operation.
+    """
+    probes = [v if np.ndim(v) == 0 else np.ones(1, dtype=v.dtype)
+              for v in values]
+    with np.errstate(all='ignore'):
+        return np.result_type(func(*probes))
+
+
+def _arith_mask_inplace(ccd, operand2, logger):
+    """Join the operand2 mask in the buffer of the ccd mask.
+
+    Returns False if the mask buffer can not receive the result.
+    """
+    mask1 = ccd.mask
+    mask2 = operand2.mask
+    if isinstance(mask1, (PackedMask, FlagMask)):
+        # Same kind of compact masks are joined in their words
+        if type(mask2) is not type(mask1) or mask2.shape != mask1.shape:
+            return False
+        words2 = unwrap_array(mask2._words)
+        buffer = mask1._words._inplace_buffer(np.shape(words2),
+                                              words2.dtype)
+        if buffer is None:
+            return False
+        np.bitwise_or(buffer, words2, out=buffer)
+        return True
+
+    buffer = mask1._inplace_buffer(ccd.shape, bool)
+    if buffer is None:
+        return False
+    old_n = np.count_nonzero(buffer)
+    np.logical_or(buffer, np.asarray(mask2), out=buffer)
+    logger.debug(f'Updating mask in math operation. '
+                 f'From {old_n} to {np.count_nonzero(buffer)} masked '
+                 'elements.')
+    return True
+
+
+def _arith_inplace(ccd, operand2, operation, propagate_errors, handle_mask,
+                   logger):
+    """Perform the operation writing in the buffers of ``ccd``.
+
+    Data, uncertainty and mask are written in place only if the result has
+    the shape and the dtype of the ccd data. So, integer data are never
+    truncated by float operands or true divisions. Returns False, without
+    changing anything, if the operation can not be done in place.
+    """
+    try:
+        unit, scale = _arith_units(ccd, operand2, operation)
+    except Exception as e:
+        raise _arith_error(ccd, operand2, operation, e)
+    func = _arith_funcs[operation]
+    a = _values(ccd)
+    b = _values(operand2)
+    if not _is_numpy(a, b):
+        return False
+
+    sa = sb = 0.0
+    propagate_errors = propagate_errors and operation != '%'
+    if propagate_errors:
+        if not ccd._unct.empty:
+            sa = unwrap_array(ccd._unct)
+        if not operand2._unct.empty:
+            sb = unwrap_array(operand2._unct)
+        if not _is_numpy(sa, sb):
+            return False
+
+    # operand2 sharing the buffers would be changed during the operation
+    if any(isinstance(x, np.ndarray) and isinstance(y, np.ndarray) and
+           np.may_share_memory(x, y) for x in (a, sa) for y in (b, sb)):
+        return False
+
+    b_scaled = np.multiply(b, scale) if scale != 1.0 else b
+    shape = np.broadcast_shapes(np.shape(a), np.shape(b))
+    dtype = _result_dtype(func, a, b_scaled)
+    if dtype != a.dtype:
+        logger.debug(f'Result of {operation} is {dtype}, that does not fit '
+                     f'in {a.dtype} data. Operation not done in place.')
+        return False
+    buffer = ccd.data._inplace_buffer(shape, dtype)
+    if buffer is None:
+        return False
+
+    ubuffer = None
+    if propagate_errors:
+        udtype = np.result_type(dtype, sa, sb, 0.0)
+        if not np.issubdtype(udtype, np.floating):
+            udtype = np.float64
+        if not ccd._unct.empty:
+            ubuffer = ccd._unct._inplace_buffer(shape, udtype)
+        if ubuffer is None:
+            # Not possible to write in the current uncertainty
+            ubuffer = np.empty(shape, dtype=udtype)
+            ubuffer[...] = sa
+            ccd._unct.reset_data(ubuffer, unit=unit, copy=False)
+
+        # Stages that need the operand1 data before the operation
+        if operation in {'+', '-'}:
+            if scale != 1.0:
+                sb = np.multiply(sb, scale)
+            np.hypot(ubuffer, sb, out=ubuffer)
+        elif operation in {'*', '/', '//', '**'}:
+            np.divide(ubuffer, a, out=ubuffer)
+        if operation in {'*', '/', '//'}:
+            # Relative errors do not depend on the operand2 unit scale
+            np.hypot(ubuffer, np.divide(sb, b), out=ubuffer)
+
+    func(a, b_scaled, out=buffer)
+    ccd.data.set_unit(unit)
+
+    if propagate_errors:
+        # Stages that need the result
+        if operation in {'*', '/', '//', '**'}:
+            np.multiply(ubuffer, buffer, out=ubuffer)
+        if operation == '**':
+            np.multiply(ubuffer, b_scaled, out=ubuffer)
+        np.abs(ubuffer, out=ubuffer)
+        ccd._unct.set_unit(unit)
+    else:
+        ccd.uncertainty = None
+
+    if not handle_mask:
+        ccd.mask = False
+    elif not _arith_mask_inplace(ccd, operand2, logger):
+        ccd.mask = _arith_mask(ccd, operand2, operation, logger)
+    return True
+
+
 def _join_headers(operand1, operand2, operation, logger):
     """Join the headers to result."""
     # TODO: Think if this is the best behavior
@@ -123,6 +350,10 @@ def imarith(operand1, operand2, operation, inplace=False,
         Math operation.
     inplace : bool, optional
         If True, the operations will be performed inplace in the operand 1.
+        Data, uncertainty and mask are written directly in their buffers,
+        including memmap files, when the result has the shape and dtype of
+        the operand 1 data. Otherwise, like integer data divided or combined
+        with floats, new arrays are created for the operand 1.
     propagate_errors : bool, optional
         Propagate the uncertainties during the math process.
     handle_mask : bool, optional
@@ -148,27 +379,461 @@ def imarith(operand1, operand2, operation, inplace=False,
     if inplace:
         ccd = operand1
     else:
-        ccd = FrameData(None)
+        # Results of lazy backends stay lazy
+        backend = operand1.backend
+        ccd = FrameData(None, mask_mode=operand1.mask_mode,
+                        backend=backend if backend == 'dask' else None)
 
     lh = log_to_list(logger, ccd.history, full_record=True)
     # TODO: rewrite debug for better infos
     logger.debug(f'Operation {operation} between {operand1} and {operand2}')
 
-    # Perform data, mask and uncertainty operations
-    ccd.data = _arith_data(operand1, operand2, operation, logger)
-    if handle_mask:
-        ccd.mask = _arith_mask(operand1, operand2, operation, logger)
+    if inplace and _arith_inplace(ccd, operand2, operation, propagate_errors,
+                                  handle_mask, logger):
+        # Written directly in the buffers of operand1
+        pass
     else:
-        ccd.mask = False
-
-    if propagate_errors:
-        ccd.uncertainty = _arith_unct(ccd, operand1, operand2,
-                                      operation, logger)
-    else:
-        ccd.uncertainty = None
+        # Perform data, mask and uncertainty operations. Uncertainty and
+        # mask are computed first, since operand1 may be the result.
+        data, unit = _arith_data(operand1, operand2, operation, logger)
+        if handle_mask:
+            mask = _arith_mask(operand1, operand2, operation, logger)
+        if propagate_errors:
+            unct = _arith_unct(data, operand1, operand2, operation, logger)
+
+        # Results are new arrays. Owned without copies.
+        ccd.data.reset_data(data, unit=unit, copy=False)
+        if handle_mask:
+            ccd.mask = mask
+        else:
+            ccd.mask = False
+
+        if propagate_errors and unct is not None:
+            _, unct, _ = shape_consistency(data, unct, None)
+            ccd._unct.reset_data(unct, unit=unit, copy=False)
+        else:
+            ccd.uncertainty = None
 
     ccd.meta = _join_headers(operand1, operand2, operation, logger)
     # TODO: handle WCS
 
     logger.removeHandler(lh)
     return ccd
+
+
+###############################################################################
+# Combine
+###############################################################################
+
+combine_methods = ['median', 'average', 'sum']
+reject_methods = ['sigmaclip', 'minmax']
+
+# Uncertainty of the median, relative to the mean, for normal distributions
+_median_unct_factor = np.sqrt(np.pi/2)
+
+
+class _FrameSource:
+    """Rows of a FrameData to be combined. Memmaps are read by rows."""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.shape = frame.shape
+        self.unit = u.Unit(frame.unit)
+        self.header = frame.header
+        self.wcs = frame.wcs
+        self.has_unct = not frame._unct.empty
+
+    def read(self, rows):
+        """Data, uncertainty (or None) and mask of some rows."""
+        frame = self.frame
+        unct = None
+        if self.has_unct:
+            unct = np.asarray(unwrap_array(frame._unct)[rows])
+        return (np.asarray(unwrap_array(frame.data)[rows]), unct,
+                np.asarray(frame._mask[rows]))
+
+
+class _FitsSource(_FrameSource):
+    """Rows of a FITS file to be combined, read as FITS sections."""
+
+    def __init__(self, filename, hdu=0):
+        self.filename = filename
+        self.hdu = hdu
+        first = framedata_read_fits(filename, hdu=hdu,
+                                    section=(slice(0, 1),))
+        header = first.header
+        self.shape = tuple(header[f'NAXIS{i}']
+                           for i in range(header['NAXIS'], 0, -1))
+        self.unit = u.Unit(first.unit)
+        self.header = header
+        self.wcs = first.wcs
+        self.has_unct = not first._unct.empty
+
+    def read(self, rows):
+        self.frame = framedata_read_fits(self.filename, hdu=self.hdu,
+                                         section=(rows,))
+        try:
+            return super().read(slice(None))
+        finally:
+            self.frame = None
+
+
+def _combine_source(image, hdu, logger):
+    if isinstance(image, (str, os.PathLike)):
+        return _FitsSource(os.fspath(image), hdu)
+    return _FrameSource(check_framedata(image, logger=logger))
+
+
+def _sigma_clip(stack, low, high):
+    """Reject values out of low and high deviations from the median."""
+    with warnings.catch_warnings():
+        # All-NaN pixels
+        warnings.simplefilter('ignore', RuntimeWarning)
+        center = np.nanmedian(stack, axis=0)
+        dev = np.nanstd(stack, axis=0)
+    with np.errstate(invalid='ignore'):
+        return (stack < center - low*dev) | (stack > center + high*dev)
+
+
+def _minmax_clip(stack, nlow, nhigh):
+    """Reject the nlow lowest and the nhigh highest values of each pixel."""
+    n = len(stack)
+    valid = ~np.isnan(stack)
+    # NaNs are sorted to the end
+    order = np.argsort(stack, axis=0)
+    ranks = np.empty_like(order)
+    index = np.arange(n).reshape((n,) + (1,)*(stack.ndim-1))
+    np.put_along_axis(ranks, order, np.broadcast_to(index, order.shape),
+                      axis=0)
+    count = valid.sum(axis=0)
+    return valid & ((ranks < nlow) | (ranks >= count - nhigh))
+
+
+def _combine_chunk(stack, ustack, weights, method):
+    """Combine a stack of rows, with rejected values set to NaN.
+
+    Returns the data, the uncertainty and the number of used values.
+    """
+    valid = ~np.isnan(stack)
+    n = valid.sum(axis=0)
+    if weights is None or method == 'median':
+        w = valid.astype(stack.dtype)
+    else:
+        w = np.where(valid, weights, 0.0)
+    wsum = w.sum(axis=0)
+
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if method == 'median':
+            data = np.nanmedian(stack, axis=0)
+        else:
+            data = np.sum(np.where(valid, stack, 0.0)*w, axis=0)
+            if method == 'average':
+                data /= wsum
+
+        if ustack is not None:
+            # Propagated uncertainties
+            var = np.sum(np.square(np.where(valid, ustack, 0.0)*w), axis=0)
+            unct = np.sqrt(var)
+            if method != 'sum':
+                unct /= wsum
+        else:
+            # Scatter of the values
+            unct = np.nanstd(stack, axis=0)
+            if method == 'sum':
+                unct *= np.sqrt(n)
+            else:
+                unct /= np.sqrt(n)
+        if method == 'median':
+            unct *= _median_unct_factor
+    return data, unct, n
+
+
+def imcombine(image_list, output=None, method='median', weights=None,
+              scale=None, reject=None, sigma_clip_low=3, sigma_clip_high=3,
+              minmax_nlow=1, minmax_nhigh=1, mem_limit=1e8, hdu=0,
+              overwrite=False, logger=logger, **kwargs):
+    """Combine a list of images, in chunks of rows limited by memory.
+
+    Only chunks of the images, with the rows fitting in ``mem_limit``, are
+    in memory at a time. Memmapped frames are read by rows and files are
+    read as FITS sections, so the images are never entirely loaded.
+
+    Parameters
+    ----------
+    image_list : list
+        Images to combine. `~astropop.framedata.FrameData` compatibles or
+        FITS file names.
+    output : str, optional
+        File to write the combined image.
+    method : {``'median'``, ``'average'``, ``'sum'``}, optional
+        Combine method.
+    weights : array_like, optional
+        Weights of the images, one per image or one array per image. Used
+        by the average and sum methods.
+    scale : callable or array_like, optional
+        Scale factors multiplying the images, one per image. If callable,
+        it is called with the data of each image and returns its factor.
+    reject : str or list of str, optional
+        Rejection algorithms: ``'sigmaclip'`` and ``'minmax'``.
+    sigma_clip_low, sigma_clip_high : float, optional
+        Number of standard deviations, from the median, of the values kept
+        by sigma clip.
+    minmax_nlow, minmax_nhigh : int, optional
+        Number of lowest and highest values rejected by minmax.
+    mem_limit : float, optional
+        Maximum memory, in bytes, used by the chunks.
+    hdu : int or str, optional
+        Data extension of the files.
+    overwrite : bool, optional
+        Overwrite the output file.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+
+    Returns
+    -------
+    `~astropop.framedata.FrameData`:
+        Combined image. Masked, and rejected, values are not used. Pixels
+        without values are masked. Uncertainties are propagated if all
+        images have them, else they come from the scatter of the values.
+    """
+    if method not in combine_methods:
+        raise ValueError(f'Method {method} not in {combine_methods}.')
+    if reject is None:
+        reject = []
+    elif isinstance(reject, str):
+        reject = [reject]
+    for r in reject:
+        if r not in reject_methods:
+            raise ValueError(f'Rejection {r} not in {reject_methods}.')
+
+    sources = [_combine_source(i, hdu, logger) for i in image_list]
+    n_images = len(sources)
+    if n_images == 0:
+        raise ValueError('No images to combine.')
+    shape = sources[0].shape
+    unit = sources[0].unit
+    for s in sources:
+        if s.shape != shape:
+            raise ValueError(f'Images with different shapes: {shape} and '
+                             f'{s.shape}.')
+
+    # One factor per image, with the units conversion
+    factors = np.ones(n_images)
+    if callable(scale):
+        for i, s in enumerate(sources):
+            # One image in memory at a time
+            factors[i] = scale(s.read(slice(None))[0])
+    elif scale is not None:
+        factors[:] = np.ravel(scale)
+    for i, s in enumerate(sources):
+        try:
+            factors[i] *= s.unit.to(unit)
+        except u.UnitConversionError:
+            raise ValueError(f'Image unit {s.unit} is not compatible with '
+                             f'{unit}.')
+
+    if weights is not None:
+        weights = np.asarray(weights, dtype='f8')
+        if len(weights) != n_images:
+            raise ValueError('One weight per image is needed.')
+        if weights.ndim == 1:
+            weights = weights.reshape((n_images,) + (1,)*len(shape))
+    propagate = all(s.has_unct for s in sources)
+
+    # Stacks of data, uncertainties and temporaries, in float64
+    row_bytes = n_images*8*int(np.prod(shape[1:]))*6
+    chunk_rows = max(1, int(mem_limit//max(row_bytes, 1)))
+    logger.info(f'Combining {n_images} images with {method}, in chunks of '
+                f'{chunk_rows} rows.')
+
+    data = np.empty(shape, dtype='f8')
+    unct = np.empty(shape, dtype='f8')
+    mask = np.empty(shape, dtype=bool)
+    index = (slice(None),)*(1 + len(shape))
+    for i in range(0, shape[0], chunk_rows):
+        rows = slice(i, i+chunk_rows)
+        n_rows = len(range(*rows.indices(shape[0])))
+        stack = np.empty((n_images, n_rows) + shape[1:], dtype='f8')
+        ustack = np.empty_like(stack) if propagate else None
+        for j, s in enumerate(sources):
+            d, ud, m = s.read(rows)
+            np.multiply(d, factors[j], out=stack[j])
+            stack[j][np.broadcast_to(m, stack[j].shape)] = np.nan
+            if propagate:
+                np.multiply(ud, abs(factors[j]), out=ustack[j])
+
+        for r in reject:
+            if r == 'sigmaclip':
+                rejected = _sigma_clip(stack, sigma_clip_low, sigma_clip_high)
+            else:
+                rejected = _minmax_clip(stack, minmax_nlow, minmax_nhigh)
+            stack[rejected] = np.nan
+
+        w = weights
+        if w is not None and w.shape[1] != 1:
+            w = w[index[:1] + (rows,)]
+        d, ud, n = _combine_chunk(stack, ustack, w, method)
+        data[rows] = d
+        unct[rows] = ud
+        mask[rows] = n == 0
+
+    ccd = FrameData(data, unit=unit, uncertainty=unct, u_unit=unit,
+                    mask=mask, meta=dict(sources[0].header),
+                    wcs=sources[0].wcs)
+    ccd.header['hierarch astropop imcombine nimages'] = n_images
+    ccd.header['hierarch astropop imcombine method'] = method
+    if reject:
+        ccd.header['hierarch astropop imcombine reject'] = ','.join(reject)
+
+    if output is not None:
+        framedata_write_fits(ccd, output, overwrite=overwrite)
+    return ccd
+
+
+class Combiner:
+    """Online average or sum of frames, folded in one at a time.
+
+    Running sums, weights, counts and variances are updated with weighted
+    Welford updates, so only the accumulators, of one frame each, are kept
+    in memory. Frames can be added as they are read, like from
+    ``fits_yielder('data', ...)`` or from memmapped frames.
+
+    Parameters
+    ----------
+    method : {``'average'``, ``'sum'``}, optional
+        Combine method.
+    weights : {``None``, ``'inverse_variance'``}, optional
+        With ``'inverse_variance'``, pixels are weighted by the inverse of
+        their variances. So, all frames need uncertainties. Otherwise, the
+        weights passed to `Combiner.add` are used.
+    logger : `logging.Logger`
+        Python logger to log the actions.
+    """
+
+    def __init__(self, method='average', weights=None, logger=logger):
+        if method not in ('average', 'sum'):
+            raise ValueError(f'Method {method} not supported by Combiner.')
+        if weights not in (None, 'inverse_variance'):
+            raise ValueError(f'Weights {weights} not supported.')
+        self.method = method
+        self.weights = weights
+        self.logger = logger
+        self._n = 0
+        self._unit = None
+        self._meta = None
+        self._propagate = True
+
+    def __len__(self):
+        return self._n
+
+    def add(self, frame, weight=1.0):
+        """Fold a frame in the combination.
+
+        Parameters
+        ----------
+        frame : `~astropop.framedata.FrameData` compatible
+            Frame to add. Masked and non-finite pixels are not used.
+        weight : float or array_like, optional
+            Weight of the frame, when not using inverse variance weights.
+        """
+        if isinstance(frame, np.ndarray) and not isinstance(frame,
+                                                            np.ma.MaskedArray):
+            # Plain arrays, like from fits_yielder, are used without copies
+            data = frame
+            unct = None
+            valid = np.isfinite(data)
+            unit = u.dimensionless_unscaled
+            meta = {}
+        else:
+            frame = check_framedata(frame, logger=self.logger)
+            data = np.asarray(unwrap_array(frame.data))
+            unct = None
+            if not frame._unct.empty:
+                unct = np.asarray(unwrap_array(frame._unct))
+            valid = np.isfinite(data) & ~np.asarray(frame.mask)
+            unit = u.Unit(frame.unit)
+            meta = frame.meta
+
+        if self._n == 0:
+            self._unit = unit
+            self._meta = dict(meta)
+            zeros = np.zeros(data.shape, dtype='f8')
+            self._wsum = zeros
+            self._mean = zeros.copy()
+            self._m2 = zeros.copy()
+            self._sum = zeros.copy()
+            self._var = zeros.copy()
+            self._count = np.zeros(data.shape, dtype=np.int64)
+        elif data.shape != self._wsum.shape:
+            raise ValueError(f'Frame shape {data.shape} do not match the '
+                             f'combined shape {self._wsum.shape}.')
+        try:
+            factor = unit.to(self._unit)
+        except u.UnitConversionError:
+            raise ValueError(f'Frame unit {unit} is not compatible with '
+                             f'{self._unit}.')
+
+        x = np.where(valid, data, 0.0)
+        if factor != 1.0:
+            x *= factor
+        if unct is not None:
+            unct = np.abs(unct*factor)
+        if self.weights == 'inverse_variance':
+            if unct is None:
+                raise ValueError('Inverse variance weights need frames with '
+                                 'uncertainties.')
+            with np.errstate(divide='ignore'):
+                w = 1/np.square(unct)
+            valid = valid & np.isfinite(w)
+        else:
+            w = np.asarray(weight, dtype='f8')
+        w = np.where(valid, w, 0.0)
+
+        # Weighted Welford update
+        wsum = self._wsum + w
+        delta = x - self._mean
+        self._mean += np.divide(w, wsum, out=np.zeros_like(wsum),
+                                where=wsum > 0)*delta
+        self._m2 += w*delta*(x - self._mean)
+        self._wsum = wsum
+        self._sum += w*x
+        self._count += valid
+        if unct is None:
+            self._propagate = False
+        elif self._propagate:
+            self._var += np.square(w*np.where(valid, unct, 0.0))
+        self._n += 1
+
+    def result(self):
+        """Combined frame of the frames added until now.
+
+        Returns
+        -------
+        `~astropop.framedata.FrameData`:
+            Combined image. Pixels without values are masked. Uncertainties
+            are propagated if all frames have them, else they come from the
+            weighted scatter of the values.
+        """
+        if self._n == 0:
+            raise ValueError('No frames added to the combination.')
+        wsum = self._wsum
+        with np.errstate(all='ignore'):
+            if self._propagate:
+                unct = np.sqrt(self._var)
+                if self.method == 'average':
+                    unct /= wsum
+            else:
+                unct = np.sqrt(self._m2/wsum)
+                if self.method == 'average':
+                    unct /= np.sqrt(self._count)
+                else:
+                    unct *= np.sqrt(self._count)
+        data = self._mean if self.method == 'average' else self._sum
+        mask = self._count == 0
+        unct[mask] = np.nan
+        ccd = FrameData(data, unit=self._unit, uncertainty=unct,
+                        u_unit=self._unit, mask=mask, meta=self._meta)
+        ccd.header['hierarch astropop imcombine nimages'] = self._n
+        ccd.header['hierarch astropop imcombine method'] = self.method
+        return ccd
@@ -1,69 +1,333 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
-from skimage.feature import register_translation
-from scipy.ndimage import fourier_shift
-from scipy.ndimage import shift as scipy_shift
-from scipy.signal import correlate2d
+import os
+import json
+import time
+import hashlib
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from scipy import fft as scipy_fft
 import numpy as np
 try:
     import astroalign
 except Exception:
     astroalign = None
 
+try:
+    import pyfftw
+    from pyfftw.interfaces import scipy_fft as pyfftw_fft
+    # Keep the FFTW plans of the interfaces between calls
+    pyfftw.interfaces.cache.enable()
+except ImportError:
+    pyfftw = None
+
 from ..logger import logger
+from ..py_utils import pool_context
+
+
+def _integer_shift(image, shift, axis, cval, out):
+    """Shift an image by an integer number of pixels along an axis, filling
+    the empty pixels with cval."""
+    n = image.shape[axis]
+    shift = int(np.clip(shift, -n, n))
+    src = [slice(None)]*image.ndim
+    dst = [slice(None)]*image.ndim
+    empty = [slice(None)]*image.ndim
+    src[axis] = slice(max(-shift, 0), n - max(shift, 0))
+    dst[axis] = slice(max(shift, 0), n - max(-shift, 0))
+    empty[axis] = slice(0, shift) if shift >= 0 else slice(n + shift, n)
+    out[tuple(dst)] = image[tuple(src)]
+    out[tuple(empty)] = cval
+    return out
+
+
+def _shift_axis(image, shift, axis, cval, out, tmp=None):
+    """Shift an image along an axis, with linear interpolation.
+
+    ``out[x] = (1-f)*image[x-i] + f*image[x-i-1]``, where ``i`` and ``f``
+    are the integer and fractional parts of the shift.
+    """
+    i = int(np.floor(shift))
+    f = shift - i
+    _integer_shift(image, i, axis, cval, out)
+    if f > 0:
+        tmp = _integer_shift(image, i + 1, axis, cval,
+                             np.empty_like(out) if tmp is None else tmp)
+        out *= 1 - f
+        tmp *= f
+        out += tmp
+    return out
 
 
-# TODO: wrapping up with CCDPROC transform_image for translating
+def _footprint_profile(n, shift):
+    """Fraction of valid pixels of a 1D shifted line of n pixels."""
+    return _shift_axis(np.ones(n), shift, 0, 0, np.empty(n))
 
 
-def translate(image, shift, subpixel=True, cval=0):
-    """Translate an image by (dy, dx) using scipy.
+def _footprint(shape, shift):
+    """Fraction of valid pixels of a shifted 2D image.
+
+    Linear interpolation is separable, so the footprint is the outer
+    product of the footprints of each axis.
+    """
+    py = _footprint_profile(shape[0], shift[0])
+    px = _footprint_profile(shape[1], shift[1])
+    return np.outer(py, px)
+
 
-    Based on stsci.image.translation algorithm
+def translate(image, shift, subpixel=True, cval=0, footprint=False):
+    """Translate an image by (dy, dx).
+
+    Subpixel shifts use a bilinear interpolation, computed as two separable
+    linear interpolations made with slices. Without subpixel, the shift is
+    rounded to integer pixels and the image is only sliced. The result
+    keeps the image dtype.
 
     cval = value to fill empty pixels after shift.
+    footprint = also return the fraction of valid pixels of each pixel.
+    """
+    image = np.asarray(image)
+    shift = np.asarray(shift, dtype='f8')
+    if not subpixel:
+        shift = np.round(shift)
+
+    dtype = image.dtype if image.dtype.kind == 'f' else np.dtype('f8')
+    if np.all(shift == np.round(shift)):
+        # Integer shifts are only slices
+        nim = image
+        for axis, s in enumerate(shift):
+            if s != 0:
+                nim = _integer_shift(nim, s, axis, cval,
+                                     np.empty_like(image))
+        if nim is image:
+            nim = image.copy()
+    else:
+        nim = image
+        tmp = np.empty(image.shape, dtype=dtype)
+        for axis, s in enumerate(shift):
+            nim = _shift_axis(nim, s, axis, cval,
+                              np.empty(image.shape, dtype=dtype), tmp)
+        nim = nim.astype(image.dtype, copy=False)
+
+    if footprint:
+        return nim, _footprint(image.shape, shift)
+    return nim
+
+
+# Engines of the FFTs, in the default preference order
+fft_engines = ['pyfftw', 'scipy']
+
+
+def _fft_module(engine=None):
+    """Module with the FFT functions of an engine.
+
+    Both engines keep the plans of the used shapes, so batches of the same
+    shape reuse them.
+    """
+    if engine is None:
+        engine = 'pyfftw' if pyfftw is not None else 'scipy'
+    if engine not in fft_engines:
+        raise ValueError(f'FFT engine {engine} not in {fft_engines}.')
+    if engine == 'pyfftw':
+        if pyfftw is None:
+            raise ImportError('pyfftw is needed to use the pyfftw engine.')
+        return pyfftw_fft
+    return scipy_fft
+
+
+def _float_image(image):
+    """Image as a float array. Float32 data is kept, to halve the FFTs."""
+    image = np.asarray(image)
+    if image.dtype.kind != 'f':
+        image = image.astype('f8')
+    return image
+
+
+def _downsample(image, factor):
+    """Mean of factor x factor blocks, dropping the remaining pixels."""
+    ny, nx = (n//factor for n in image.shape)
+    image = image[:ny*factor, :nx*factor]
+    return image.reshape((ny, factor, nx, factor)).mean(axis=(1, 3))
+
+
+def _peak_shifts(cc, subpixel=False):
+    """Shifts of the cross-correlation peaks of a batch of images.
+
+    With subpixel, the peaks are refined by parabolas fitted to the peak
+    and its neighbours, in each axis.
     """
-    # for subpixel, a correlation kernel need translation
+    shape = np.array(cc.shape[1:])
+    cc = np.abs(cc)
+    index = np.argmax(cc.reshape((len(cc), -1)), axis=1)
+    peaks = np.array(np.unravel_index(index, cc.shape[1:]), dtype='f8').T
     if subpixel:
-        rot = 0
-        dy, dx = shift
-        dx, dy = -dx, -dy
-        if dx >= 0 and dy >= 0:
-            rot = 2
-        elif dx >= 0 and dy < 0:
-            rot = 1
-        elif dx < 0 and dy >= 0:
-            rot = 3
-        elif dx < 0 and dy < 0:
-            rot = 0
-        dx, dy = np.abs([dx, dy])
-        if rot % 2 != 0:
-            dx, dy = dy, dx
-
-        nim = np.rot90(image, rot)
-        nim = scipy_shift(nim, (dy, dx), mode='constant', cval=cval)
-
-        # correlation kernel to fix subpixel shifting
-        x, y = dx % 1.0, dy % 1.0
-        kernel = np.array([[x*y, (1-x)*y],
-                           [(1-y)*x, (1-y)*(1-x)]])
-        nim = correlate2d(nim, kernel, mode='full', fillvalue=cval)
-        return np.rot90(nim, -rot % 4).astype(image.dtype)[:-1, :-1]
-
-    return scipy_shift(image, shift, mode='constant', cval=cval)
-
-
-def create_fft_shift_list(image_list):
+        for b, peak in enumerate(peaks.astype(int)):
+            for axis in range(2):
+                lo, hi = peak.copy(), peak.copy()
+                lo[axis] = (lo[axis] - 1) % shape[axis]
+                hi[axis] = (hi[axis] + 1) % shape[axis]
+                c0, cl, ch = cc[b][tuple(peak)], cc[b][tuple(lo)], \
+                    cc[b][tuple(hi)]
+                den = cl - 2*c0 + ch
+                if den != 0:
+                    peaks[b, axis] += 0.5*(cl - ch)/den
+    # Wrap the shifts larger than the half of the image
+    mid = shape//2
+    peaks[peaks > mid] -= np.broadcast_to(shape, peaks.shape)[peaks > mid]
+    return peaks
+
+
+class FFTRegister:
+    """Register images to a reference by phase correlation of their FFTs.
+
+    The reference spectrum is computed only once. Images are transformed
+    in batches, with real FFTs computed by all the CPUs, and the plans of
+    the FFT engine are reused between batches.
+
+    Parameters
+    ----------
+    reference : array_like
+        Reference image.
+    region : tuple of slices, optional
+        Region of the images used in the registration. Default is the
+        entire image.
+    downsample : int, optional
+        Register first the images downsampled by this factor, and refine the
+        shifts in a ``refine_size`` window of the full images.
+    refine_size : int, optional
+        Size of the window used to refine downsampled shifts.
+    subpixel : bool, optional
+        Refine the shifts to subpixel precision, by parabolic interpolation
+        of the correlation peaks.
+    batch_size : int, optional
+        Number of images transformed in each FFT call.
+    engine : {``'pyfftw'``, ``'scipy'``}, optional
+        FFT engine. Default is pyfftw, if installed.
+    workers : int, optional
+        Number of threads of the FFTs. ``-1`` uses all CPUs.
+    """
+
+    def __init__(self, reference, region=None, downsample=None,
+                 refine_size=256, subpixel=False, batch_size=4, engine=None,
+                 workers=-1):
+        self.fft = _fft_module(engine)
+        self.engine = 'scipy' if self.fft is scipy_fft else 'pyfftw'
+        self.region = region
+        self.downsample = downsample
+        self.refine_size = refine_size
+        self.subpixel = subpixel
+        self.batch_size = batch_size
+        self.workers = workers
+        # Full resolution reference, for refinement
+        self._reference = _float_image(reference)
+        if region is not None:
+            self._reference = self._reference[region]
+        ref = self._reference
+        if downsample is not None and downsample > 1:
+            ref = _downsample(ref, downsample)
+        self.shape = ref.shape
+        self._ref_freq = self.fft.rfft2(ref, workers=workers)
+
+    def __getstate__(self):
+        # Modules are not picklable. Workers get the engine name.
+        state = dict(self.__dict__)
+        del state['fft']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.fft = _fft_module(self.engine)
+
+    def _prepare(self, image):
+        image = _float_image(image)
+        if self.region is not None:
+            image = image[self.region]
+        if image.shape != self._reference.shape:
+            raise ValueError(f'Image shape {image.shape} do not match the '
+                             f'reference shape {self._reference.shape}.')
+        return image
+
+    def _correlate(self, ref_freq, images, shape):
+        """Shifts of a batch of images to a reference spectrum."""
+        freq = self.fft.rfft2(np.stack(images), workers=self.workers)
+        np.multiply(np.conj(freq), ref_freq, out=freq)
+        cc = self.fft.irfft2(freq, s=shape, workers=self.workers)
+        return _peak_shifts(cc, self.subpixel)
+
+    def _refine(self, image, shift):
+        """Refine a coarse shift in a window of the full images."""
+        ref = self._reference
+        size = self.refine_size
+        sy, sx = np.round(shift).astype(int)
+        ny, nx = ref.shape
+        # Window in the reference, whose shifted copy fits in the image
+        y0 = max((ny - size)//2, sy, 0)
+        x0 = max((nx - size)//2, sx, 0)
+        y1 = min(y0 + size, ny, ny + sy)
+        x1 = min(x0 + size, nx, nx + sx)
+        if y1 - y0 < 8 or x1 - x0 < 8:
+            return shift
+        window = ref[y0:y1, x0:x1]
+        target = image[y0-sy:y1-sy, x0-sx:x1-sx]
+        freq = self.fft.rfft2(window, workers=self.workers)
+        residual = self._correlate(freq, [target], window.shape)[0]
+        return np.array([sy, sx]) + residual
+
+    def register(self, images):
+        """Compute the (dy, dx) shifts of images to the reference.
+
+        Parameters
+        ----------
+        images : iterable of array_like
+            Images to register. They are read in batches, so generators are
+            consumed as the work goes on.
+
+        Returns
+        -------
+        list of tuple :
+            Shifts (dy, dx) that align each image to the reference.
+        """
+        shifts = []
+        factor = self.downsample if self.downsample else 1
+        batch = []
+
+        def _flush():
+            small = batch
+            if factor > 1:
+                small = [_downsample(i, factor) for i in batch]
+            coarse = self._correlate(self._ref_freq, small, self.shape)
+            for image, shift in zip(batch, coarse):
+                shift = shift*factor
+                if factor > 1:
+                    shift = self._refine(image, shift)
+                shifts.append(tuple(float(i) for i in shift))
+            batch.clear()
+
+        for image in images:
+            batch.append(self._prepare(image))
+            if len(batch) >= self.batch_size:
+                _flush()
+        if batch:
+            _flush()
+        return shifts
+
+
+def create_fft_shift_list(image_list, logger=logger, **kwargs):
     """Use fft to calculate the shifts between images in a list.
 
-    Return a set os (y, x) shift pairs.
-    """
-    shifts = [(0.0, 0.0)]*len(image_list)
-    for i in range(len(image_list)-1):
-        shifts[i+1], _, _ = register_translation(image_list[0].data,
-                                                 image_list[i+1].data)
+    The first image is the reference. Its spectrum is computed only once.
+    Other arguments are passed to `FFTRegister`.
 
-    return shifts
+    Return a list of (y, x) shift pairs.
+    """
+    image_list = list(image_list)
+    if len(image_list) == 0:
+        return []
+    register = FFTRegister(image_list[0], **kwargs)
+    logger.debug(f'Registering {len(image_list)} images with FFT '
+                 'correlation.')
+    return [(0.0, 0.0)] + register.register(image_list[1:])
 
 
 def create_chi2_shift_list(image_list):
@@ -83,8 +347,82 @@ def create_chi2_shift_list(image_list):
     return shifts
 
 
+@functools.lru_cache(maxsize=256)
+def _phase_ramp(n, shift, real=False):
+    """Phase ramp of a shift along an axis of n pixels, cached per shift.
+
+    ``real`` gives the ramp of the last axis of real FFTs.
+    """
+    freq = scipy_fft.rfftfreq(n) if real else scipy_fft.fftfreq(n)
+    ramp = np.exp(-2j*np.pi*freq*shift)
+    if n % 2 == 0:
+        # The Nyquist term must stay real to keep the Hermitian symmetry of
+        # the half spectrum. Its imaginary part vanishes in the real image.
+        ramp[n//2] = np.cos(np.pi*shift)
+    # Shared by the cache. Never changed.
+    ramp.flags.writeable = False
+    return ramp
+
+
+def fft_shift(image, shift, engine=None, workers=-1):
+    """Shift a real image by (dy, dx) using real FFTs.
+
+    Only half of the spectrum of the real image is computed and the phase
+    ramps of each axis, cached per shift, are applied to it in place. So,
+    it uses half of the memory of complex FFTs. Shifts are periodic, like
+    `scipy.ndimage.fourier_shift`.
+
+    Parameters:
+        image : ndarray_like
+            The image to be shifted. Float32 images are shifted in float32.
+        shift : array_like
+            Shift to be applyed (dy, dx).
+        engine : {'pyfftw', 'scipy'} (optional)
+            FFT engine. Default is pyfftw, if installed.
+        workers : int (optional)
+            Number of threads of the FFTs. -1 uses all CPUs.
+
+    Return the shifted image, with the image dtype.
+    """
+    fft = _fft_module(engine)
+    image = np.asarray(image)
+    freq = fft.rfftn(_float_image(image), workers=workers)
+    ndim = image.ndim
+    shift = [float(s) for s in shift]
+
+    # Where more than one axis is at its Nyquist frequency, the phase is
+    # the real part of the joint ramp, which is not separable.
+    nyquist = [a for a in range(ndim)
+               if shift[a] != 0 and image.shape[a] % 2 == 0]
+    corners = []
+    for k in range(2, len(nyquist)+1):
+        for axes in itertools.combinations(nyquist, k):
+            idx = tuple(image.shape[a]//2 if a in axes else slice(None)
+                        for a in range(ndim))
+            corners.append((axes, idx, freq[idx].copy()))
+
+    for axis, s in enumerate(shift):
+        if s == 0:
+            continue
+        ramp = _phase_ramp(image.shape[axis], s, axis == ndim-1)
+        freq *= ramp.reshape([-1 if i == axis else 1 for i in range(ndim)])
+
+    # Larger sets of axes come last and override the smaller ones.
+    for axes, idx, corner in corners:
+        corner *= np.cos(np.pi*sum(shift[a] for a in axes))
+        rest = [a for a in range(ndim) if a not in axes]
+        for j, a in enumerate(rest):
+            if shift[a] != 0:
+                ramp = _phase_ramp(image.shape[a], shift[a], a == ndim-1)
+                corner *= ramp.reshape([-1 if i == j else 1
+                                        for i in range(len(rest))])
+        freq[idx] = corner
+    nimage = fft.irfftn(freq, s=image.shape, workers=workers)
+    return nimage.astype(image.dtype, copy=False)
+
+
 def apply_shift(image, shift, method='fft', subpixel=True, footprint=False,
-                logger=logger):
+                logger=logger, workers=-1):
     """Apply a shifts of (dy, dx) to a list of images.
 
     Parameters:
@@ -94,39 +432,36 @@ def apply_shift(image, shift, method='fft', subpixel=True, footprint=False,
             shift to be applyed (dy, dx)
         method : string
             The method used for shift images. Can be:
-            - 'fft' -> scipy fourier_shift
-            - 'simple' -> simples translate using scipy
+            - 'fft' -> real FFTs, see `fft_shift`
+            - 'simple' -> simples translate using slices
+        workers : int (optional)
+            Number of threads of the FFTs. -1 uses all CPUs.
 
     Return the shifted images.
     """
     # Shift with fft, much more precise and fast
     if method == 'fft':
-        nimage = fourier_shift(np.fft.fftn(image), np.array(shift))
-        nimage = np.fft.ifftn(nimage).real.astype(image.dtype)
+        nimage = fft_shift(image, shift, workers=workers)
         if footprint:
-            foot = np.ones(nimage.shape)
-            foot = translate(foot, shift, subpixel=True, cval=0)
-            return nimage, foot
+            return nimage, _footprint(nimage.shape, shift)
         else:
             return nimage
 
     elif method == 'simple':
-        nimage = translate(image, shift, subpixel=subpixel, cval=0)
-        if footprint:
-            foot = np.ones(nimage.shape)
-            foot = translate(foot, shift, subpixel=subpixel, cval=0)
-            return nimage, foot
-        else:
-            return nimage
+        return translate(image, shift, subpixel=subpixel, cval=0,
+                         footprint=footprint)
 
     else:
         raise ValueError('Unrecognized shift image method.')
 
 
-def apply_shift_list(image_list, shift_list, method='fft',
-                     logger=logger):
+def apply_shift_list(image_list, shift_list, method='fft', footprint=False,
+                     n_threads=None, logger=logger):
     """Apply a list of (y, x) shifts to a list of images.
 
+    Images are shifted in parallel threads, each one using single-threaded
+    FFTs. numpy and the FFT engines release the GIL in the heavy parts.
+
     Parameters:
         image_list : ndarray_like
             A list with the images to be shifted.
@@ -135,62 +470,235 @@ def apply_shift_list(image_list, shift_list, method='fft',
             create_fft_shift_list.
         method : string
             The method used for shift images. Can be:
-            - 'fft' -> scipy fourier_shift
-            - 'simple' -> simples translate using scipy
+            - 'fft' -> real FFTs, see `fft_shift`
+            - 'simple' -> simples translate using slices
+        footprint : bool (optional)
+            Return (image, footprint) pairs.
+        n_threads : int (optional)
+            Number of threads. Default is the number of CPUs.
 
     Return a new image_list with the shifted images.
     """
-    return [apply_shift(i, s, method=method, logger=logger)
-            for i, s in zip(image_list, shift_list)]
+    n_threads = n_threads or os.cpu_count() or 1
+
+    def _shift(args):
+        return apply_shift(*args, method=method, footprint=footprint,
+                           logger=logger, workers=1)
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        return list(pool.map(_shift, zip(image_list, shift_list)))
+
+
+register_methods = ['asterism', 'chi2', 'fft']
+
+# Method and reference features of the registration workers
+_register_state = {}
+
+
+def _frame_hash(data, chunk_rows=256):
+    """SHA256 of the data of a frame, read in chunks of rows."""
+    data = np.asarray(data)
+    h = hashlib.sha256(f'{data.dtype.str}{data.shape}'.encode())
+    if data.ndim == 0:
+        data = data.reshape(1)
+    for i in range(0, data.shape[0], chunk_rows):
+        h.update(np.ascontiguousarray(data[i:i+chunk_rows]))
+    return h.hexdigest()
+
+
+class _TransformStore:
+    """Sidecar JSON file with the transforms already computed."""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.transforms = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as f:
+                self.transforms = json.load(f)
+
+    def get(self, key):
+        return self.transforms.get(key)
+
+    def set(self, key, value):
+        self.transforms[key] = value
+
+    def save(self):
+        if self.filename is None:
+            return
+        # Written to a temporary file first, to never leave a broken store
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.transforms, f)
+        os.replace(tmp, self.filename)
+
+
+def _asterism_sources(image):
+    """(x, y) positions of the sources of an image, brightest first, used as
+    control points of astroalign."""
+    from ..photometry.detection import background, sepfind
+    bkg, rms = background(image, 64, 3, global_bkg=False)
+    sources = sepfind(image, 5, bkg, np.median(rms), minarea=5)
+    sources.sort('flux', reverse=True)
+    return np.array([sources['x'], sources['y']]).T
+
+
+def _reference_features(method, reference):
+    """Features of the reference, computed only once."""
+    if method == 'fft':
+        return FFTRegister(reference)
+    if method == 'asterism':
+        # Sources of the reference are detected only once
+        return _asterism_sources(reference)
+    return reference
+
+
+def _init_register(method, features):
+    """Set the reference features in a registration worker."""
+    _register_state['method'] = method
+    _register_state['features'] = features
+
+
+def _register_frame(data):
+    """Compute the transform of one frame to the reference, and the time
+    spent."""
+    t0 = time.perf_counter()
+    method = _register_state['method']
+    features = _register_state['features']
+    if method == 'fft':
+        transform = list(features.register([data])[0])
+    elif method == 'chi2':
+        from image_registration import chi2_shift
+        dx, dy, _, _ = chi2_shift(features, data, np.nanstd(data))
+        transform = [-dy, -dx]
+    else:
+        # Same detection in both frames, so the control points match
+        transf, _ = astroalign.find_transform(_asterism_sources(data),
+                                              features)
+        transform = np.asarray(transf.params).tolist()
+    return transform, time.perf_counter() - t0
+
+
+def _apply_asterism(data, params, reference, footprint):
+    """Apply an astroalign transform, stored as its matrix."""
+    from skimage.transform import SimilarityTransform
+    transf = SimilarityTransform(matrix=np.array(params))
+
+    def _apply(image):
+        res = astroalign.apply_transform(transf, image, reference)
+        # astroalign>=2 also returns its footprint
+        return res[0] if isinstance(res, tuple) else res
+
+    if footprint:
+        return _apply(data), _apply(np.ones(data.shape))
+    return _apply(data)
 
 
 def hdu_shift_images(hdu_list, method='fft', register_method='asterism',
-                     footprint=False, logger=logger):
+                     footprint=False, n_processes=None, cache_file=None,
+                     logger=logger):
     """Calculate and apply shifts in a set of ccddata images.
 
     The function process the list inplace. Original data altered.
 
+    The features of the reference (first) image are computed only once and
+    the other frames are registered in a pool of ``n_processes``
+    processes. The time spent in each frame is stored in its header.
+
     methods:
         - "asterism" : align images using asterism matching (astroalign)
         - "chi2" : align images using chi2 minimization (image_registration)
-        - "fft" : align images using fourier transform correlation (skimage)
+        - "fft" : align images using fourier transform correlation
+
+    n_processes : number of registration processes. Default is the number
+        of CPUs. With 1, frames are registered in this process.
+    cache_file : sidecar JSON file storing the computed transforms, keyed
+        by the hashes of the frame and reference data. Frames already in
+        it are not registered again.
     """
+    if method not in register_methods:
+        raise ValueError(f'Register method {method} not in '
+                         f'{register_methods}.')
     if method == "asterism":
         logger.info("Registering images with astroalign.")
         if astroalign is None:
             raise RuntimeError("astroaling module not available.")
-        im0 = hdu_list[0].data
-        for i in hdu_list[1:]:
-            transf, _ = astroalign.find_transform(i.data, im0)
-            i.data = astroalign.apply_transform(transf, i.data, im0)
-            if footprint:
-                i.footprint = astroalign.apply_transform(transf,
-                                                         np.ones(i.data.shape,
-                                                                 dtype=bool),
-                                                         im0)
-            s_method = 'similarity_transform'
-    else:
-        if method == 'chi2':
-            shifts = create_chi2_shift_list([ccd.data for ccd in hdu_list])
+    t_start = time.perf_counter()
+    datas = [np.asarray(ccd.data) for ccd in hdu_list]
+    im0 = datas[0]
+
+    # Transforms already computed
+    store = _TransformStore(cache_file)
+    keys = [None]*len(datas)
+    transforms = [None]*len(datas)
+    times = [0.0]*len(datas)
+    if cache_file is not None:
+        ref_hash = _frame_hash(im0)
+        for i in range(1, len(datas)):
+            keys[i] = f'{method}:{ref_hash}:{_frame_hash(datas[i])}'
+            transforms[i] = store.get(keys[i])
+    todo = [i for i in range(1, len(datas)) if transforms[i] is None]
+    logger.info(f'Registering {len(todo)} frames. '
+                f'{len(datas) - 1 - len(todo)} frames found in cache.')
+
+    if todo:
+        features = _reference_features(method, im0)
+        frames = [datas[i] for i in todo]
+        n_processes = n_processes or os.cpu_count() or 1
+        if n_processes == 1:
+            _init_register(method, features)
+            try:
+                results = [_register_frame(d) for d in frames]
+            finally:
+                _register_state.clear()
         else:
-            shifts = create_fft_shift_list([ccd.data for ccd in hdu_list])
+            with ProcessPoolExecutor(n_processes, mp_context=pool_context(),
+                                     initializer=_init_register,
+                                     initargs=(method, features)) as pool:
+                results = list(pool.map(_register_frame, frames))
+        for i, (transform, elapsed) in zip(todo, results):
+            transforms[i] = transform
+            times[i] = elapsed
+            logger.debug(f'Frame {i} registered in {elapsed:.3f} s.')
+            if keys[i] is not None:
+                store.set(keys[i], transform)
+        store.save()
+
+    if method == 'asterism':
+        s_method = 'similarity_transform'
+
+        def _apply(i):
+            if i == 0:
+                return (datas[0], np.ones(im0.shape)) if footprint \
+                    else datas[0]
+            return _apply_asterism(datas[i], transforms[i], im0, footprint)
+
+        with ThreadPoolExecutor(os.cpu_count() or 1) as pool:
+            results = list(pool.map(_apply, range(len(datas))))
+    else:
+        s_method = 'fft' if method == 'fft' else 'simple'
+        shifts = [(0.0, 0.0)] + [tuple(t) for t in transforms[1:]]
         logger.info(f"Aligning CCDData with shifts: {shifts}")
+        results = apply_shift_list(datas, shifts, method=s_method,
+                                   footprint=footprint, logger=logger)
         for ccd, shift in zip(hdu_list, shifts):
-            if method == 'fft':
-                s_method = method
-            else:
-                s_method = 'simple'
-            ccd.data = apply_shift(ccd.data, shift, method=s_method,
-                                   logger=logger)
             sh = [str(i) for i in shift[::-1]]
             ccd.header['hierarch astropop register_shift'] = ",".join(sh)
-            if footprint:
-                ccd.footprint = apply_shift(np.ones_like(ccd.data, dtype=bool),
-                                            shift, method='simple',
-                                            logger=logger)
+
+    for ccd, res, elapsed in zip(hdu_list, results, times):
+        if footprint:
+            ccd.data, ccd.footprint = res
+        else:
+            ccd.data = res
+        ccd.header['hierarch astropop register_time'] = elapsed
+
     for i in hdu_list:
         i.header['hierarch astropop registered'] = True
         i.header['hierarch astropop register_method'] = method
         i.header['hierarch astropop transform_method'] = s_method
 
+    n = len(hdu_list)
+    elapsed = time.perf_counter() - t_start
+    logger.info(f'Registered {n} frames in {elapsed:.2f} s '
+                f'({n/elapsed if elapsed > 0 else float("inf"):.2f} '
+                'frames/s).')
     return hdu_list
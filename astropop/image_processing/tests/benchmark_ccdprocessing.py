@@ -0,0 +1,81 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Benchmark of the chained calibration steps and `calibrate_frame`.
+
+Not collected by pytest. Run with:
+
+    python -m astropop.image_processing.tests.benchmark_ccdprocessing [sizes]
+
+Default sizes are 2048 4096. Peak memory is the largest memory allocated
+by numpy during the calibration, traced with `tracemalloc`.
+"""
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from astropop.framedata import FrameData
+from astropop.image_processing.ccd_processing import calibrate_frame, \
+    subtract_bias, subtract_dark, flat_correct, gain_correct, \
+    calibration_engines, _calibration_engine
+
+
+def _frames(size):
+    rng = np.random.default_rng(0)
+    shape = (size, size)
+    kwargs = {'unit': 'adu', 'use_memmap_backend': False}
+    image = FrameData(rng.normal(1000, 10, shape), **kwargs)
+    bias = FrameData(rng.normal(100, 1, shape), **kwargs)
+    dark = FrameData(rng.normal(10, 1, shape), **kwargs)
+    flat = FrameData(rng.normal(1, 0.01, shape), unit='',
+                     use_memmap_backend=False)
+    return image, bias, dark, flat
+
+
+def _chained(image, bias, dark, flat):
+    ccd = subtract_bias(image, bias)
+    ccd = subtract_dark(ccd, dark, 1.0, 2.0)
+    ccd = flat_correct(ccd, flat)
+    return gain_correct(ccd, 1.5)
+
+
+def _fused(image, bias, dark, flat, engine):
+    return calibrate_frame(image, master_bias=bias, master_dark=dark,
+                           master_flat=flat, gain=1.5, dark_exposure=1.0,
+                           image_exposure=2.0, engine=engine)
+
+
+def _measure(func, repeat=3):
+    best = np.inf
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del res
+    return best, peak
+
+
+def main(sizes=(2048, 4096)):
+    engines = []
+    for engine in calibration_engines:
+        try:
+            engines.append(_calibration_engine(engine))
+        except ImportError:
+            pass
+    for size in sizes:
+        frames = _frames(size)
+        print(f'{size}x{size} float64 ({size*size*8/2**20:.0f} MiB/array)')
+        cases = [('chained steps', lambda: _chained(*frames))]
+        cases += [(f'calibrate_frame {e}',
+                   lambda e=e: _fused(*frames, e)) for e in engines]
+        for name, func in cases:
+            t, m = _measure(func)
+            print(f'    {name:<28} {t*1000:9.1f} ms {m/2**20:9.1f} MiB')
+
+
+if __name__ == '__main__':
+    main([int(i) for i in sys.argv[1:]] or (2048, 4096))
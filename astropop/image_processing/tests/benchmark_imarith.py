@@ -0,0 +1,65 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Benchmark of imarith time and peak memory.
+
+Not collected by pytest. Run with:
+
+    python -m astropop.image_processing.tests.benchmark_imarith [sizes]
+
+Default sizes are 2048 4096 8192. Peak memory is the largest memory
+allocated by numpy during the operation, traced with `tracemalloc`.
+"""
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from astropop.framedata import FrameData
+from astropop.image_processing.imarith import imarith
+
+
+def _frames(size):
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000, 10, (size, size))
+    frame1 = FrameData(data, unit='adu', uncertainty=np.sqrt(data),
+                       use_memmap_backend=False)
+    frame2 = FrameData(data[::-1], unit='adu', uncertainty=5.0,
+                       use_memmap_backend=False)
+    return frame1, frame2
+
+
+def benchmark_imarith(size, operation, propagate_errors=False,
+                      inplace=False, repeat=3):
+    """Best time, in seconds, and peak memory, in bytes, of a operation."""
+    frame1, frame2 = _frames(size)
+    best = np.inf
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        res = imarith(frame1, frame2, operation,
+                      propagate_errors=propagate_errors, inplace=inplace)
+        best = min(best, time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del res
+    return best, peak
+
+
+def main(sizes=(2048, 4096, 8192)):
+    for size in sizes:
+        print(f'{size}x{size} float64 ({size*size*8/2**20:.0f} MiB/array)')
+        for operation in ['+', '*', '/']:
+            for propagate in [False, True]:
+                for inplace in [False, True]:
+                    t, m = benchmark_imarith(size, operation, propagate,
+                                             inplace)
+                    name = f'{operation} propagate_errors={propagate}'
+                    if inplace:
+                        name += ' inplace'
+                    print(f'    {name:<36} {t*1000:9.1f} ms '
+                          f'{m/2**20:9.1f} MiB')
+
+
+if __name__ == '__main__':
+    main([int(i) for i in sys.argv[1:]] or (2048, 4096, 8192))
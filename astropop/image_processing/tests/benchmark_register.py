@@ -0,0 +1,138 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Benchmark of the image registration and shift functions.
+
+Not collected by pytest. Run with:
+
+    python -m astropop.image_processing.tests.benchmark_register [n] [size]
+
+Default is 100 frames of 4096x4096. The per image skimage registration,
+used before `FFTRegister`, is timed in a few frames and extrapolated.
+`translate` and the complex FFT shift are compared with their former
+implementations, kept here.
+"""
+
+import sys
+import time
+import numpy as np
+from scipy.ndimage import shift as scipy_shift, fourier_shift
+from scipy.signal import correlate2d
+
+from astropop.image_processing.register import FFTRegister, fft_engines, \
+    _fft_module, translate, fft_shift, apply_shift_list
+
+try:
+    from skimage.registration import phase_cross_correlation
+except ImportError:
+    from skimage.feature import register_translation \
+        as phase_cross_correlation
+
+
+def _translate_old(image, shift, cval=0):
+    """Former subpixel translate: rot90, spline shift and correlate2d."""
+    rot = 0
+    dy, dx = shift
+    dx, dy = -dx, -dy
+    if dx >= 0 and dy >= 0:
+        rot = 2
+    elif dx >= 0 and dy < 0:
+        rot = 1
+    elif dx < 0 and dy >= 0:
+        rot = 3
+    elif dx < 0 and dy < 0:
+        rot = 0
+    dx, dy = np.abs([dx, dy])
+    if rot % 2 != 0:
+        dx, dy = dy, dx
+
+    nim = np.rot90(image, rot)
+    nim = scipy_shift(nim, (dy, dx), mode='constant', cval=cval)
+    x, y = dx % 1.0, dy % 1.0
+    kernel = np.array([[x*y, (1-x)*y],
+                       [(1-y)*x, (1-y)*(1-x)]])
+    nim = correlate2d(nim, kernel, mode='full', fillvalue=cval)
+    return np.rot90(nim, -rot % 4).astype(image.dtype)[:-1, :-1]
+
+
+def _fft_shift_old(image, shift):
+    """Former fft apply_shift: full complex FFTs."""
+    nimage = fourier_shift(np.fft.fftn(image), np.array(shift))
+    return np.fft.ifftn(nimage).real.astype(image.dtype)
+
+
+def _frames(n, size):
+    rng = np.random.default_rng(0)
+    ref = rng.normal(100, 1, (size, size)).astype('f4')
+    for _ in range(200):
+        y, x = rng.integers(10, size-10, 2)
+        ref[y-2:y+3, x-2:x+3] += 1000
+    shifts = rng.integers(-20, 20, (n, 2))
+    return ref, (np.roll(ref, s, axis=(0, 1)) for s in shifts)
+
+
+def _timeit(func):
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def translate_benchmark(size=2048):
+    image = np.random.default_rng(0).normal(100, 1, (size, size))
+    image = image.astype('f4')
+    shift = (3.3, -7.6)
+    print(f'translate {size}x{size} float32, shift {shift}')
+    t_old = _timeit(lambda: _translate_old(image, shift))
+    t_new = _timeit(lambda: translate(image, shift))
+    t_foot = _timeit(lambda: translate(image, shift, footprint=True))
+    print(f'    {"former translate":<32} {t_old*1000:9.1f} ms')
+    print(f'    {"translate":<32} {t_new*1000:9.1f} ms  speedup '
+          f'{t_old/t_new:6.1f}x')
+    print(f'    {"translate with footprint":<32} {t_foot*1000:9.1f} ms')
+
+
+def shift_benchmark(n=300, size=1024):
+    rng = np.random.default_rng(0)
+    images = [rng.normal(100, 1, (size, size)).astype('f4')
+              for _ in range(n)]
+    shifts = rng.uniform(-10, 10, (n, 2))
+    print(f'shift {n} frames of {size}x{size} float32')
+    t_old = _timeit(lambda: [_fft_shift_old(i, s)
+                             for i, s in zip(images, shifts)])
+    t_new = _timeit(lambda: [fft_shift(i, s)
+                             for i, s in zip(images, shifts)])
+    t_list = _timeit(lambda: apply_shift_list(images, shifts))
+    print(f'    {"complex fft, per image":<32} {t_old:9.2f} s')
+    print(f'    {"fft_shift, per image":<32} {t_new:9.2f} s  speedup '
+          f'{t_old/t_new:6.1f}x')
+    print(f'    {"apply_shift_list, threads":<32} {t_list:9.2f} s  speedup '
+          f'{t_old/t_list:6.1f}x')
+
+
+def main(n=100, size=4096):
+    ref, _ = _frames(n, size)
+    print(f'{n} frames of {size}x{size} float32')
+    n_old = min(n, 5)
+    _, frames = _frames(n_old, size)
+    t = _timeit(lambda: [phase_cross_correlation(ref, f) for f in frames])
+    t_old = t*n/n_old
+    print(f'    {"skimage, per image":<32} {t_old:9.2f} s (extrapolated)')
+
+    engines = []
+    for engine in fft_engines:
+        try:
+            _fft_module(engine)
+            engines.append(engine)
+        except ImportError:
+            pass
+    for engine in engines:
+        for downsample in (None, 4):
+            _, frames = _frames(n, size)
+            t = _timeit(lambda: FFTRegister(ref, downsample=downsample,
+                                            engine=engine).register(frames))
+            name = f'FFTRegister {engine}, downsample {downsample}'
+            print(f'    {name:<32} {t:9.2f} s  speedup {t_old/t:6.1f}x')
+
+
+if __name__ == '__main__':
+    translate_benchmark()
+    shift_benchmark()
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,324 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+import pytest_check as check
+from astropy import units as u
+
+from astropop.image_processing.ccd_processing import calibrate_frame, \
+                                                     subtract_bias, \
+                                                     subtract_dark, \
+                                                     flat_correct, \
+                                                     gain_correct, \
+                                                     subtract_overscan, \
+                                                     trim_image, \
+                                                     block_reduce, \
+                                                     process_image, \
+                                                     process_ccd
+from astropop.framedata import FrameData, framedata_read_fits, \
+                               framedata_write_fits
+
+
+def _frames(shape=(20, 30)):
+    rng = np.random.default_rng(42)
+    image = FrameData(rng.normal(1000, 10, shape), unit='adu',
+                      uncertainty=30.0, u_unit='adu')
+    bias = FrameData(rng.normal(100, 1, shape), unit='adu',
+                     uncertainty=1.0, u_unit='adu')
+    dark = FrameData(rng.normal(10, 1, shape), unit='adu',
+                     uncertainty=2.0, u_unit='adu')
+    flat = FrameData(rng.normal(1, 0.1, shape), unit='',
+                     uncertainty=0.01, u_unit='')
+    return image, bias, dark, flat
+
+
+def _expected(image, bias, dark, flat, scale=2.0, gain=1.5):
+    img = np.asarray(image.data)
+    r = img - np.asarray(bias.data) - scale*np.asarray(dark.data)
+    f = np.asarray(flat.data)
+    var = 30.0**2 + 1.0**2 + (scale*2.0)**2
+    unct = np.sqrt(var/f**2 + (r/f**2*0.01)**2)*gain
+    return r/f*gain, unct
+
+
+@pytest.mark.parametrize('chunk_rows', [None, 3])
+def test_calibrate_frame(chunk_rows):
+    image, bias, dark, flat = _frames()
+    data, unct = _expected(image, bias, dark, flat)
+    res = calibrate_frame(image, master_bias=bias, master_dark=dark,
+                          master_flat=flat, gain=1.5*u.electron/u.adu,
+                          dark_exposure=1.0, image_exposure=2.0,
+                          propagate_errors=True, engine='numpy',
+                          chunk_rows=chunk_rows)
+    check.is_false(res is image)
+    check.equal(res.unit, u.electron)
+    npt.assert_array_almost_equal(res.data, data)
+    npt.assert_array_almost_equal(res.uncertainty, unct)
+    check.is_true(res.header['hierarch astropop bias_corrected'])
+    check.is_true(res.header['hierarch astropop flat_corrected'])
+    check.equal(res.header['hierarch astropop dark_corrected_scale'], 2.0)
+    check.equal(res.header['hierarch astropop gain_corrected_value'], 1.5)
+
+
+def test_calibrate_frame_matches_steps():
+    image, bias, dark, flat = _frames()
+    expect = subtract_bias(image, bias)
+    expect = subtract_dark(expect, dark, 1.0, 2.0)
+    expect = flat_correct(expect, flat, min_value=0.9)
+    expect = gain_correct(expect, 1.5)
+    res = calibrate_frame(image, master_bias=bias, master_dark=dark,
+                          master_flat=flat, gain=1.5, dark_exposure=1.0,
+                          image_exposure=2.0, flat_min_value=0.9,
+                          chunk_rows=7)
+    npt.assert_array_almost_equal(res.data, expect.data)
+
+
+def test_calibrate_frame_flat_options():
+    image, _, _, flat = _frames()
+    flat_data = np.asarray(flat.data).copy()
+    res = calibrate_frame(image, master_flat=flat, flat_min_value=0.95,
+                          flat_norm_value=2.0)
+    f = np.maximum(flat_data, 0.95)/2.0
+    npt.assert_array_almost_equal(res.data, np.asarray(image.data)/f)
+    # the master flat is not changed
+    npt.assert_array_equal(flat.data, flat_data)
+
+
+def test_calibrate_frame_inplace():
+    image, bias, _, flat = _frames()
+    data, _ = _expected(image, bias, FrameData(np.zeros((20, 30)),
+                                               unit='adu'),
+                        flat, gain=1.0)
+    buffers = image.data._contained, image._unct._contained
+    res = calibrate_frame(image, master_bias=bias, master_flat=flat,
+                          propagate_errors=True, inplace=True, chunk_rows=4)
+    check.is_true(res is image)
+    npt.assert_array_almost_equal(image.data, data)
+    check.is_true(image.data._contained is buffers[0])
+    # constant uncertainties get new buffers
+    check.is_false(image._unct._contained is buffers[1])
+
+
+def test_calibrate_frame_integer():
+    image = FrameData(np.full((10, 10), 1100, dtype='uint16'), unit='adu')
+    bias = FrameData(np.full((10, 10), 1200, dtype='uint16'), unit='adu')
+    res = calibrate_frame(image, master_bias=bias, inplace=True)
+    check.equal(res.data.dtype, np.dtype('f8'))
+    npt.assert_array_equal(res.data, np.full((10, 10), -100.0))
+
+
+def test_calibrate_frame_mask():
+    image, bias, _, flat = _frames((10, 10))
+    image.mask = np.eye(10, dtype=bool)
+    flat.mask = np.eye(10, dtype=bool)[::-1]
+    res = calibrate_frame(image, master_bias=bias, master_flat=flat,
+                          handle_mask=True, chunk_rows=3)
+    npt.assert_array_equal(res.mask, np.eye(10, dtype=bool) |
+                           np.eye(10, dtype=bool)[::-1])
+    res = calibrate_frame(image, master_bias=bias)
+    check.equal(np.count_nonzero(res.mask), 0)
+
+
+@pytest.mark.parametrize('engine', ['numexpr', 'numba'])
+@pytest.mark.parametrize('kwargs', [{}, {'chunk_rows': 3},
+                                    {'flat_min_value': 0.95,
+                                     'flat_norm_value': 2.0},
+                                    {'master_dark': None},
+                                    {'master_flat': None, 'gain': None}])
+def test_calibrate_frame_engines(engine, kwargs):
+    pytest.importorskip(engine)
+    image, bias, dark, flat = _frames()
+    image.uncertainty = np.random.default_rng(0).uniform(20, 40, (20, 30))
+    image.mask = np.eye(20, 30, dtype=bool)
+    flat.mask = np.eye(20, 30, k=3, dtype=bool)
+    calib = dict(master_bias=bias, master_dark=dark, master_flat=flat,
+                 gain=1.5*u.electron/u.adu, dark_exposure=1.0,
+                 image_exposure=2.0, propagate_errors=True,
+                 handle_mask=True)
+    calib.update(kwargs)
+    expect = calibrate_frame(image, engine='numpy', **calib)
+    res = calibrate_frame(image, engine=engine, **calib)
+    check.equal(res.unit, expect.unit)
+    npt.assert_allclose(res.data, expect.data, rtol=1e-12)
+    npt.assert_allclose(res.uncertainty, expect.uncertainty, rtol=1e-12)
+    npt.assert_array_equal(res.mask, expect.mask)
+    check.equal(res.header, expect.header)
+
+
+@pytest.mark.parametrize('engine', ['numexpr', 'numba'])
+def test_calibrate_frame_engines_inplace(engine):
+    pytest.importorskip(engine)
+    image, bias, _, flat = _frames()
+    expect = calibrate_frame(image, master_bias=bias, master_flat=flat,
+                             propagate_errors=True, engine='numpy')
+    buffer = image.data._contained
+    res = calibrate_frame(image, master_bias=bias, master_flat=flat,
+                          propagate_errors=True, inplace=True,
+                          engine=engine, chunk_rows=4)
+    check.is_true(res is image)
+    check.is_true(image.data._contained is buffer)
+    npt.assert_allclose(image.data, expect.data, rtol=1e-12)
+    npt.assert_allclose(image.uncertainty, expect.uncertainty, rtol=1e-12)
+
+
+def test_calibrate_frame_errors():
+    image, bias, _, _ = _frames()
+    with pytest.raises(ValueError):
+        calibrate_frame(image, master_bias=bias, engine='not an engine')
+    with pytest.raises(ValueError):
+        calibrate_frame(image, master_bias=FrameData(np.zeros((5, 5)),
+                                                     unit='adu'))
+    with pytest.raises(ValueError):
+        calibrate_frame(image, master_bias=FrameData(np.zeros((20, 30)),
+                                                     unit='s'))
+
+
+def test_process_image_header_keys():
+    image, bias, dark, flat = _frames()
+    image.header['EXPTIME'] = 2.0
+    image.header['GAIN'] = 1.5
+    dark.header['EXPTIME'] = 1.0
+    data, _ = _expected(image, bias, dark, flat)
+    res = process_image(image, master_bias=bias, master_dark=dark,
+                        master_flat=flat, gain_key='GAIN',
+                        exposure_key='EXPTIME',
+                        badpixmask=np.eye(20, 30, dtype=bool))
+    npt.assert_array_almost_equal(res.data, data)
+    check.equal(res.header['hierarch astropop dark_corrected_scale'], 2.0)
+    check.equal(res.header['hierarch astropop gain_corrected_value'], 1.5)
+    npt.assert_array_equal(res.mask, np.eye(20, 30, dtype=bool))
+
+
+def test_process_image_geometry():
+    data = np.zeros((20, 34)) + np.arange(20)[:, None]
+    data[:, :30] += 1
+    image = FrameData(data, unit='adu')
+    bias = FrameData(np.full((20, 30), 0.5), unit='adu')
+    res = process_image(image, master_bias=bias, overscan='[31:34,*]',
+                        trim='[1:30,*]', rebin_size=2)
+    check.equal(res.shape, (10, 15))
+    npt.assert_array_almost_equal(res.data, np.full((10, 15), 2.0))
+    check.is_true(res.header['hierarch astropop overscan_subtracted'])
+    check.equal(res.header['hierarch astropop trimmed_section'],
+                '[1:30,1:20]')
+
+
+@pytest.mark.parametrize('fit', ['median', 'poly', 'spline'])
+def test_subtract_overscan(fit):
+    rows = np.arange(40)[:, None]
+    data = np.zeros((40, 50)) + 100 + 0.5*rows
+    image = FrameData(data, unit='adu', uncertainty=1.0, u_unit='adu')
+    res = subtract_overscan(image, (slice(None), slice(40, 50)), fit=fit,
+                            fit_order=1 if fit == 'poly' else 3)
+    npt.assert_array_almost_equal(res.data, np.zeros((40, 50)))
+    npt.assert_array_almost_equal(res.uncertainty, np.ones((40, 50)))
+    check.equal(res.header['hierarch astropop overscan_section'],
+                '[41:50,1:40]')
+    check.equal(res.header['hierarch astropop overscan_fit'], fit)
+
+
+def test_subtract_overscan_errors():
+    image = FrameData(np.zeros((40, 50)), unit='adu')
+    with pytest.raises(ValueError):
+        subtract_overscan(image, '[41:50,*]', fit='not a fit')
+    with pytest.raises(ValueError):
+        # median overscan must cover all rows
+        subtract_overscan(image, '[41:50,1:20]')
+    with pytest.raises(ValueError):
+        subtract_overscan(image, '[41:50]')
+
+
+@pytest.mark.parametrize('mask_mode', ['bool', 'packed', 'flags'])
+def test_trim_image_views(mask_mode):
+    data = np.arange(200, dtype='f8').reshape((10, 20))
+    mask = np.zeros((10, 20), dtype=bool)
+    mask[2, 3] = True
+    image = FrameData(data, unit='adu', uncertainty=data+1, u_unit='adu',
+                      mask=mask, mask_mode=mask_mode)
+    res = trim_image(image, '[2:10,2:5]')
+    check.equal(res.shape, (4, 9))
+    npt.assert_array_equal(res.data, data[1:5, 1:10])
+    npt.assert_array_equal(res.uncertainty, data[1:5, 1:10]+1)
+    npt.assert_array_equal(res.mask, mask[1:5, 1:10])
+    check.is_true(np.shares_memory(res.data._contained,
+                                   image.data._contained))
+    check.equal(res.header['hierarch astropop trimmed_section'],
+                '[2:10,2:5]')
+
+    # writes do not change the original
+    res.data[0, 0] = -1
+    check.equal(res.data[0, 0], -1)
+    check.equal(image.data[1, 1], 21)
+
+
+def test_trim_image_inplace_memmap(tmpdir):
+    data = np.arange(200, dtype='f8').reshape((10, 20))
+    image = FrameData(data, unit='adu', use_memmap_backend=True,
+                      cache_folder=tmpdir.strpath)
+    res = trim_image(image, (slice(2, 6), slice(5, 15)), inplace=True)
+    check.is_true(res is image)
+    check.is_true(res.data.memmap)
+    npt.assert_array_equal(res.data, data[2:6, 5:15])
+    res.data[0, 0] = -1
+    npt.assert_array_equal(res.data[0, 1:], data[2, 6:15])
+    check.equal(res.data[0, 0], -1)
+    with pytest.raises(ValueError):
+        trim_image(image, (slice(0, 4, 2),))
+
+
+@pytest.mark.parametrize('func', [np.sum, np.mean])
+def test_block_reduce(func):
+    data = np.arange(8*11, dtype='f8').reshape((8, 11))
+    mask = np.zeros((8, 11), dtype=bool)
+    mask[5, 1] = True
+    image = FrameData(data, unit='adu', uncertainty=2.0, u_unit='adu',
+                      mask=mask)
+    res = block_reduce(image, (2, 5), func=func)
+    expect = func(data[:, :10].reshape((4, 2, 2, 5)), axis=(1, 3))
+    check.equal(res.shape, (4, 2))
+    npt.assert_array_almost_equal(res.data, expect)
+    unct = np.sqrt(10*4.0)
+    if func is np.mean:
+        unct /= 10
+    npt.assert_array_almost_equal(res.uncertainty, np.full((4, 2), unct))
+    npt.assert_array_equal(res.mask, [[0, 0], [0, 0], [1, 0], [0, 0]])
+    check.equal(res.header['hierarch astropop rebin_size'], '(2, 5)')
+
+
+def test_block_reduce_inplace():
+    image = FrameData(np.ones((6, 6)), unit='adu', uncertainty=1.0,
+                      u_unit='adu')
+    res = block_reduce(image, 3, func=np.median, inplace=True)
+    check.is_true(res is image)
+    npt.assert_array_equal(res.data, np.ones((2, 2)))
+    # median do not propagate errors
+    check.is_true(res._unct.empty)
+    with pytest.raises(ValueError):
+        block_reduce(image, 3)
+
+
+@pytest.mark.parametrize('n_processes', [1, 2])
+def test_process_ccd(tmpdir, n_processes):
+    image, bias, dark, flat = _frames()
+    data, _ = _expected(image, bias, dark, flat)
+    bias_file = tmpdir.join('bias.fits').strpath
+    framedata_write_fits(bias, bias_file)
+    files = []
+    for i in range(5):
+        files.append(tmpdir.join(f'sci_{i}.fits').strpath)
+        framedata_write_fits(image, files[-1])
+
+    out = tmpdir.join('out').strpath
+    res = process_ccd(iter(files), out, master_bias=bias_file,
+                      master_dark=dark, master_flat=flat, gain=1.5,
+                      dark_exposure=1.0, image_exposure=2.0,
+                      append_to_name='_calib', n_processes=n_processes,
+                      max_pending=2)
+    check.equal(res, [tmpdir.join('out', f'sci_{i}_calib.fits').strpath
+                      for i in range(5)])
+    for f in res:
+        npt.assert_array_almost_equal(framedata_read_fits(f).data, data)
+    with pytest.raises(OSError):
+        process_ccd(files, out, master_bias=bias, append_to_name='_calib',
+                    n_processes=n_processes)
@@ -4,9 +4,10 @@ import numpy as np
 import numpy.testing as npt
 import pytest
 import pytest_check as check
+from astropy import units as u
 
-from astropop.image_processing.imarith import imarith
-from astropop.framedata import FrameData
+from astropop.image_processing.imarith import imarith, imcombine, Combiner
+from astropop.framedata import FrameData, framedata_write_fits
 
 
 # TODO: Continue the tests
@@ -92,3 +93,261 @@ def test_imarith_add_mask(inplace):
         check.is_true(res is frame1)
     else:
         check.is_false(res is frame1)
+
+
+@pytest.mark.parametrize('mask_mode', ['packed', 'flags'])
+@pytest.mark.parametrize('inplace', [True, False])
+def test_imarith_add_compact_mask(inplace, mask_mode):
+    mask1 = np.zeros((10, 13), dtype=bool)
+    mask2 = np.zeros((10, 13), dtype=bool)
+    mask1[5, 5] = 1
+    mask2[3, 12] = 1
+    frame1 = FrameData(np.ones((10, 13)), unit='adu', mask=mask1,
+                       mask_mode=mask_mode)
+    frame2 = FrameData(np.ones((10, 13)), unit='adu', mask=mask2,
+                       mask_mode=mask_mode)
+    res = imarith(frame1, frame2, '+', handle_mask=True, inplace=inplace)
+    check.equal(res.mask_mode, mask_mode)
+    npt.assert_array_equal(res.mask, mask1 | mask2)
+    check.equal(np.count_nonzero(res.mask), 2)
+
+
+def test_imarith_dask_lazy():
+    da = pytest.importorskip('dask.array')
+    frame1 = FrameData(np.full((10, 10), 3.0), unit='adu', uncertainty=1.0,
+                       backend='dask')
+    frame2 = FrameData(np.full((10, 10), 2.0), unit='adu', uncertainty=1.0)
+    res = imarith(frame1, frame2, '*', propagate_errors=True,
+                  handle_mask=True)
+    check.equal(res.backend, 'dask')
+    check.is_instance(res.data._contained, da.Array)
+    check.is_instance(res._unct._contained, da.Array)
+    check.equal(res.unit, u.adu*u.adu)
+    npt.assert_array_almost_equal(res.data, np.full((10, 10), 6.0))
+    npt.assert_array_almost_equal(res.uncertainty,
+                                  np.full((10, 10), 6*np.sqrt(1/9 + 1/4)))
+
+
+@pytest.mark.parametrize('op,unit,value', [('+', 'm', 1.01),
+                                           ('-', 'm', 0.99),
+                                           ('*', 'm cm', 1.0),
+                                           ('/', 'm / cm', 1.0)])
+def test_imarith_units(op, unit, value):
+    frame1 = FrameData(np.ones((5, 5)), unit='m')
+    frame2 = FrameData(np.ones((5, 5)), unit='cm')
+    res = imarith(frame1, frame2, op)
+    check.equal(res.unit, u.Unit(unit))
+    npt.assert_array_almost_equal(res.data, np.full((5, 5), value))
+
+
+@pytest.mark.parametrize('inplace', [True, False])
+def test_imarith_incompatible_units(inplace):
+    frame1 = FrameData(np.ones((5, 5)), unit='m')
+    frame2 = FrameData(np.ones((5, 5)), unit='s')
+    buffer = frame1.data._contained
+    with pytest.raises(ValueError, match='Could not process the operation'):
+        imarith(frame1, frame2, '+', inplace=inplace)
+    # nothing written in the operand
+    check.is_true(frame1.data._contained is buffer)
+    npt.assert_array_equal(frame1.data, np.ones((5, 5)))
+
+
+def test_imarith_scalar_power():
+    frame = FrameData(np.full((5, 5), 3.0), unit='adu')
+    res = imarith(frame, 2, '**')
+    check.equal(res.unit, u.adu**2)
+    npt.assert_array_equal(res.data, np.full((5, 5), 9.0))
+
+
+@pytest.mark.parametrize('op', ['+', '-', '*', '/', '**'])
+def test_imarith_inplace_buffers(op):
+    data = np.arange(1, 101, dtype='f8').reshape((10, 10))
+    # non-scalar exponents need dimensionless data
+    unit = '' if op == '**' else 'adu'
+    frame1 = FrameData(data.copy(), unit=unit, uncertainty=np.sqrt(data),
+                       u_unit=unit, mask=data > 90)
+    frame2 = FrameData(np.full((10, 10), 2.0), unit=unit, uncertainty=0.5,
+                       u_unit=unit, mask=data < 5)
+    expect = imarith(frame1, frame2, op, propagate_errors=True,
+                     handle_mask=True)
+    buffers = [frame1.data._contained, frame1._unct._contained,
+               frame1._mask._contained]
+    res = imarith(frame1, frame2, op, inplace=True, propagate_errors=True,
+                  handle_mask=True)
+    check.is_true(res is frame1)
+    check.is_true(res.data._contained is buffers[0])
+    check.is_true(res._unct._contained is buffers[1])
+    check.is_true(res._mask._contained is buffers[2])
+    check.equal(res.unit, expect.unit)
+    npt.assert_array_almost_equal(res.data, expect.data)
+    npt.assert_array_almost_equal(res.uncertainty, expect.uncertainty)
+    npt.assert_array_equal(res.mask, expect.mask)
+
+
+def test_imarith_inplace_memmap(tmpdir):
+    frame1 = FrameData(np.full((10, 10), 3.0), unit='adu',
+                       cache_folder=tmpdir, use_memmap_backend=True)
+    frame2 = FrameData(np.full((10, 10), 2.0), unit='adu')
+    mm = frame1.data._contained
+    imarith(frame1, frame2, '-', inplace=True)
+    check.is_true(frame1.data._contained is mm)
+    npt.assert_array_equal(np.asarray(mm), np.ones((10, 10)))
+
+
+def test_imarith_inplace_integer_guard():
+    # Results that do not fit in integer data create new arrays
+    frame = FrameData(np.full((5, 5), 7, dtype='uint16'), unit='adu')
+    buffer = frame.data._contained
+    res = imarith(frame, 2, '/', inplace=True)
+    check.is_true(res is frame)
+    check.is_false(res.data._contained is buffer)
+    check.equal(res.data.dtype, np.dtype('f8'))
+    npt.assert_array_equal(res.data, np.full((5, 5), 3.5))
+    npt.assert_array_equal(buffer, np.full((5, 5), 7))
+
+    # Same dtype results are written in place
+    frame = FrameData(np.full((5, 5), 7, dtype='uint16'), unit='adu')
+    buffer = frame.data._contained
+    imarith(frame, FrameData(np.ones((5, 5), dtype='uint16'), unit='adu'),
+            '-', inplace=True)
+    check.is_true(frame.data._contained is buffer)
+    npt.assert_array_equal(buffer, np.full((5, 5), 6))
+
+
+def test_imarith_inplace_same_operand():
+    frame = FrameData(np.full((5, 5), 3.0), unit='adu', uncertainty=1.0,
+                      u_unit='adu')
+    res = imarith(frame, frame, '*', inplace=True, propagate_errors=True)
+    npt.assert_array_almost_equal(res.data, np.full((5, 5), 9.0))
+    npt.assert_array_almost_equal(res.uncertainty,
+                                  np.full((5, 5), 9*np.sqrt(2/9)))
+
+
+def _stack(n=7, shape=(12, 9)):
+    rng = np.random.default_rng(1)
+    data = rng.normal(100, 5, (n,) + shape)
+    return data, [FrameData(d, unit='adu') for d in data]
+
+
+@pytest.mark.parametrize('method', ['median', 'average', 'sum'])
+@pytest.mark.parametrize('mem_limit', [1e8, 1])
+def test_imcombine_methods(method, mem_limit):
+    data, frames = _stack()
+    func = {'median': np.median, 'average': np.mean, 'sum': np.sum}[method]
+    res = imcombine(frames, method=method, mem_limit=mem_limit)
+    npt.assert_array_almost_equal(res.data, func(data, axis=0))
+    check.equal(res.unit, u.adu)
+    check.equal(np.count_nonzero(res.mask), 0)
+    check.equal(res.header['hierarch astropop imcombine nimages'], 7)
+    unct = np.std(data, axis=0)
+    if method == 'sum':
+        unct *= np.sqrt(7)
+    else:
+        unct /= np.sqrt(7)
+    if method == 'median':
+        unct *= np.sqrt(np.pi/2)
+    npt.assert_array_almost_equal(res.uncertainty, unct)
+
+
+def test_imcombine_reject():
+    data, frames = _stack()
+    frames[2].data[3, 4] = 1e5
+    res = imcombine(frames, method='average', reject='sigmaclip',
+                    sigma_clip_low=2, sigma_clip_high=2, mem_limit=1)
+    check.less(res.data[3, 4], 200)
+
+    res = imcombine(frames, method='sum', reject=['minmax'])
+    expect = np.sort(np.asarray([f.data for f in frames]), axis=0)[1:-1]
+    npt.assert_array_almost_equal(res.data, expect.sum(axis=0))
+    with pytest.raises(ValueError):
+        imcombine(frames, reject='not a rejection')
+    with pytest.raises(ValueError):
+        imcombine(frames, method='not a method')
+
+
+def test_imcombine_scale_weights_mask():
+    data, frames = _stack(3, (4, 4))
+    for f in frames:
+        f.uncertainty = np.full((4, 4), 2.0)
+    frames[0].mask = np.eye(4, dtype=bool)
+    frames[1].mask = np.eye(4, dtype=bool)
+    frames[2].mask = np.eye(4, dtype=bool)[::-1]
+    frames[2].mask[0, 0] = True
+
+    res = imcombine(frames, method='average', weights=[1, 2, 3],
+                    scale=lambda x: 2)
+    w = np.array([1, 2, 3])[:, None, None] * \
+        ~np.array([f.mask for f in frames])
+    expect = np.sum(2*data*w, axis=0)/np.sum(w, axis=0)
+    npt.assert_array_almost_equal(res.data[~res.mask], expect[~res.mask])
+    unct = 4*np.sqrt(np.sum(w**2, axis=0))/np.sum(w, axis=0)
+    npt.assert_array_almost_equal(res.uncertainty[~res.mask],
+                                  unct[~res.mask])
+    # only the first pixel is masked in all images
+    check.is_true(res.mask[0, 0])
+    check.equal(np.count_nonzero(res.mask), 1)
+
+
+def test_imcombine_files(tmpdir):
+    data, frames = _stack(4)
+    files = []
+    for i, f in enumerate(frames):
+        files.append(tmpdir.join(f'image_{i}.fits').strpath)
+        framedata_write_fits(f, files[-1])
+    output = tmpdir.join('combined.fits').strpath
+    res = imcombine(files, output, method='median', mem_limit=1)
+    npt.assert_array_almost_equal(res.data, np.median(data, axis=0))
+    res = imcombine(files, output, method='average', overwrite=True)
+    npt.assert_array_almost_equal(res.data, np.mean(data, axis=0))
+    with pytest.raises(OSError):
+        imcombine(files, output)
+
+
+@pytest.mark.parametrize('method', ['average', 'sum'])
+def test_combiner(method):
+    data, frames = _stack()
+    comb = Combiner(method)
+    for f in frames:
+        comb.add(f)
+    check.equal(len(comb), 7)
+    res = comb.result()
+    expect = imcombine(frames, method=method)
+    npt.assert_array_almost_equal(res.data, expect.data)
+    npt.assert_array_almost_equal(res.uncertainty, expect.uncertainty)
+    check.equal(res.unit, u.adu)
+
+
+def test_combiner_arrays_and_masks():
+    data, _ = _stack(3, (4, 4))
+    data[1, 0, 0] = np.nan
+    comb = Combiner('average')
+    for d in data:
+        comb.add(d, weight=2.0)
+    res = comb.result()
+    check.almost_equal(res.data[0, 0], (data[0, 0, 0] + data[2, 0, 0])/2)
+    npt.assert_array_almost_equal(res.data[1:], np.mean(data[:, 1:], axis=0))
+
+    comb = Combiner('average')
+    comb.add(FrameData(np.ones((2, 2)), unit='adu', mask=np.eye(2)))
+    res = comb.result()
+    npt.assert_array_equal(res.mask, np.eye(2, dtype=bool))
+    with pytest.raises(ValueError):
+        comb.add(np.ones((3, 3)))
+    with pytest.raises(ValueError):
+        Combiner('median')
+
+
+def test_combiner_inverse_variance():
+    frames = [FrameData(np.full((3, 3), 10.0), unit='adu', uncertainty=1.0,
+                        u_unit='adu'),
+              FrameData(np.full((3, 3), 20.0), unit='adu', uncertainty=2.0,
+                        u_unit='adu')]
+    comb = Combiner('average', weights='inverse_variance')
+    for f in frames:
+        comb.add(f)
+    res = comb.result()
+    npt.assert_array_almost_equal(res.data, np.full((3, 3), 12.0))
+    npt.assert_array_almost_equal(res.uncertainty,
+                                  np.full((3, 3), np.sqrt(1/1.25)))
+    with pytest.raises(ValueError):
+        comb.add(FrameData(np.ones((3, 3)), unit='adu'))
@@ -0,0 +1,194 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+import pytest_check as check
+from scipy.ndimage import fourier_shift
+
+from astropop.image_processing.register import FFTRegister, \
+                                               create_fft_shift_list, \
+                                               translate, fft_shift, \
+                                               apply_shift, apply_shift_list, \
+                                               hdu_shift_images
+from astropop.image_processing import register
+from astropop.framedata import FrameData
+
+
+def _stars(shape=(128, 160), n=30, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.normal(10, 0.1, shape)
+    y, x = np.indices(shape)
+    for yi, xi in zip(rng.uniform(10, shape[0]-10, n),
+                      rng.uniform(10, shape[1]-10, n)):
+        image += 1000*np.exp(-((y-yi)**2 + (x-xi)**2)/(2*1.5**2))
+    return image
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'batch_size': 1},
+                                    {'downsample': 4, 'refine_size': 64},
+                                    {'region': (slice(8, 120),
+                                                slice(0, 150))}])
+def test_fft_register_integer(kwargs):
+    ref = _stars()
+    shifts = [(3, -5), (-7, 2), (0, 11)]
+    images = [np.roll(ref, s, axis=(0, 1)) for s in shifts]
+    res = FFTRegister(ref, engine='scipy', **kwargs).register(iter(images))
+    npt.assert_array_almost_equal(res, -np.array(shifts))
+
+
+def test_fft_register_subpixel():
+    ref = _stars()
+    image = np.fft.ifftn(fourier_shift(np.fft.fftn(ref), (1.3, -2.6))).real
+    res = FFTRegister(ref, subpixel=True).register([image])
+    npt.assert_allclose(res, [(-1.3, 2.6)], atol=0.25)
+
+
+def test_create_fft_shift_list():
+    ref = _stars()
+    images = [ref, np.roll(ref, (2, 4), axis=(0, 1)), ref.astype('f4')]
+    res = create_fft_shift_list(images)
+    npt.assert_array_almost_equal(res, [(0, 0), (-2, -4), (0, 0)])
+    check_shape = FFTRegister(ref)
+    with pytest.raises(ValueError):
+        check_shape.register([np.zeros((10, 10))])
+    with pytest.raises(ValueError):
+        FFTRegister(ref, engine='not an engine')
+
+
+@pytest.mark.parametrize('dtype', ['f4', 'f8', 'i4'])
+def test_translate(dtype):
+    image = np.arange(48, dtype=dtype).reshape((6, 8))
+    res = translate(image, (2, -3), cval=-1)
+    check.equal(res.dtype, np.dtype(dtype))
+    npt.assert_array_equal(res[2:, :5], image[:4, 3:])
+    npt.assert_array_equal(res[:2], -1)
+    npt.assert_array_equal(res[:, 5:], -1)
+
+
+def test_translate_subpixel():
+    y, x = np.indices((10, 12))
+    image = 2.0*y + 3.0*x
+    res, foot = translate(image, (0.25, -1.5), footprint=True)
+    # linear images are exactly interpolated
+    npt.assert_array_almost_equal(res[1:, :-2],
+                                  (2*(y-0.25) + 3*(x+1.5))[1:, :-2])
+    npt.assert_array_almost_equal(foot[0], 0.75*np.r_[np.ones(10), 0.5, 0])
+    npt.assert_array_almost_equal(foot[1:, :-2], 1)
+    res = translate(image, (0.25, -1.5), subpixel=False)
+    npt.assert_array_equal(res[:, :-2], image[:, 2:])
+
+
+def _fourier_shift(image, shift):
+    return np.fft.ifftn(fourier_shift(np.fft.fftn(image), shift)).real
+
+
+@pytest.mark.parametrize('shape', [(32, 40), (32, 45), (31, 40), (31, 45)])
+def test_fft_shift(shape):
+    image = _stars(shape, n=3)
+    npt.assert_allclose(fft_shift(image, (2.3, -4.6)),
+                        _fourier_shift(image, (2.3, -4.6)),
+                        rtol=0, atol=1e-8)
+    noise = np.random.default_rng(0).normal(0, 1, shape)
+    npt.assert_allclose(fft_shift(noise, (0.5, 1.7)),
+                        _fourier_shift(noise, (0.5, 1.7)),
+                        rtol=0, atol=1e-10)
+    npt.assert_array_almost_equal(fft_shift(image, (3, -5)),
+                                  np.roll(image, (3, -5), axis=(0, 1)))
+    res = fft_shift(image.astype('f4'), (1, 1))
+    check.equal(res.dtype, np.dtype('f4'))
+
+
+@pytest.mark.parametrize('shape', [(128, 160), (127, 161)])
+def test_apply_shift_list(shape):
+    images = [_stars(shape, seed=i) for i in range(5)]
+    shifts = [(i, -0.5*i) for i in range(5)]
+    for method in ['fft', 'simple']:
+        res = apply_shift_list(images, shifts, method=method, n_threads=3)
+        for r, i, s in zip(res, images, shifts):
+            npt.assert_allclose(r, apply_shift(i, s, method=method),
+                                rtol=0, atol=1e-10)
+    res = apply_shift_list(images, shifts, method='fft', n_threads=3)
+    for r, i, s in zip(res, images, shifts):
+        npt.assert_allclose(r, _fourier_shift(i, s), rtol=0, atol=1e-8)
+    res = apply_shift_list(images, shifts, footprint=True)
+    check.equal(len(res[0]), 2)
+    with pytest.raises(ValueError):
+        apply_shift(images[0], (1, 1), method='not a method')
+
+
+def _shifted_frames():
+    ref = _stars()
+    shifts = [(0, 0), (3, -5), (-4, 2)]
+    return [FrameData(np.roll(ref, s, axis=(0, 1)), unit='adu')
+            for s in shifts], shifts
+
+
+@pytest.mark.parametrize('n_processes', [1, 2])
+def test_hdu_shift_images(n_processes):
+    frames, shifts = _shifted_frames()
+    ref = np.array(frames[0].data)
+    res = hdu_shift_images(frames, method='fft', footprint=True,
+                           n_processes=n_processes)
+    for ccd, s in zip(res, shifts):
+        check.is_true(ccd.header['hierarch astropop registered'])
+        # shifts are stored as strings, so -0.0 may be written
+        sh = ccd.header['hierarch astropop register_shift'].split(',')
+        npt.assert_array_equal([float(i) for i in sh], [-s[1], -s[0]])
+        check.is_in('hierarch astropop register_time', ccd.header)
+        # integer shifts are periodic, so the whole image is recovered
+        npt.assert_allclose(ccd.data, ref, rtol=0, atol=1e-8)
+        check.equal(ccd.footprint.shape, ref.shape)
+    with pytest.raises(ValueError):
+        hdu_shift_images(frames, method='not a method')
+
+
+@pytest.mark.parametrize('n_processes', [1, 2])
+def test_hdu_shift_images_asterism(n_processes):
+    pytest.importorskip('astroalign')
+    frames, shifts = _shifted_frames()
+    ref = np.array(frames[0].data)
+    res = hdu_shift_images(frames, method='asterism', footprint=True,
+                           n_processes=n_processes)
+    for ccd, s in zip(res, shifts):
+        check.is_true(ccd.header['hierarch astropop registered'])
+        check.equal(ccd.header['hierarch astropop transform_method'],
+                    'similarity_transform')
+        check.equal(ccd.footprint.shape, ref.shape)
+        # borders are not covered by the shifted frames. Source centroids
+        # have small errors, compared to the 1000 counts peaks.
+        npt.assert_allclose(ccd.data[10:-10, 10:-10], ref[10:-10, 10:-10],
+                            rtol=0, atol=0.1)
+
+
+def test_hdu_shift_images_cache(tmpdir, monkeypatch):
+    cache = str(tmpdir.join('transforms.json'))
+    frames, _ = _shifted_frames()
+    first = hdu_shift_images(frames, n_processes=1, cache_file=cache)
+
+    def _fail(data):
+        raise AssertionError('frame registered again')
+
+    monkeypatch.setattr(register, '_register_frame', _fail)
+    frames, _ = _shifted_frames()
+    second = hdu_shift_images(frames, n_processes=1, cache_file=cache)
+    for a, b in zip(first, second):
+        npt.assert_array_equal(a.data, b.data)
+        check.equal(b.header['hierarch astropop register_time'], 0)
+
+
+def test_hdu_shift_images_parallel_cache(tmpdir):
+    # same shifts in serial and parallel, with and without the cache
+    results = []
+    for n_processes in [1, 2]:
+        for cache in [None, str(tmpdir.join(f'cache{n_processes}.json'))]:
+            for _ in range(2 if cache else 1):
+                frames, _ = _shifted_frames()
+                res = hdu_shift_images(frames, n_processes=n_processes,
+                                       cache_file=cache)
+                results.append(res)
+    for res in results[1:]:
+        for a, b in zip(results[0], res):
+            check.equal(a.header['hierarch astropop register_shift'],
+                        b.header['hierarch astropop register_shift'])
+            npt.assert_array_equal(a.data, b.data)
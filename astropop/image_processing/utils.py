@@ -81,7 +81,7 @@ def combine_flat(image_list, save_file=None,
                  logger=logger, **kwargs):
     """Process and combine flat images (normalizing)."""
     hdus = process_list(process_image, image_list, rebin_size=rebin_size,
-                        master_bias=master_bias, dark_frame=dark_frame,
+                        master_bias=master_bias, master_dark=dark_frame,
                         gain=gain, gain_key=gain_key, rebin_func=rebin_func,
                         readnoise_key=readnoise_key, exposure_key=exposure_key,
                         lacosmic=remove_cosmics, inplace=inplace,
@@ -2,17 +2,75 @@
 
 import sep
 import numpy as np
-from scipy.stats import sigmaclip
 from astropy.table import Table
 
-from ..math.array import xy2r, trim_array
 from ._utils import _sep_fix_byte_order
 from .detection import calc_fwhm
 from ..logger import logger
 from ..fits_utils import imhdus
 
 
-def sky_annulus(data, x, y, r_ann, algorithm='mmm', mask=None, logger=logger):
+sky_algorithms = ['mmm', 'sigmaclip']
+
+
+def _annulus_stencil(r_in, r_out):
+    """Pixel offsets, from the pixel containing a source, that can be in
+    its annulus for any subpixel position of the source."""
+    n = int(np.ceil(r_out)) + 1
+    oy, ox = np.mgrid[-n:n+2, -n:n+2]
+
+    # Distance range of each offset for source fractions in [0, 1)
+    def _axis(o):
+        return (np.where(o < 0, -o, np.maximum(o - 1, 0)),
+                np.maximum(np.abs(o), np.abs(o - 1)))
+
+    xmin, xmax = _axis(ox)
+    ymin, ymax = _axis(oy)
+    filt = (np.hypot(xmin, ymin) <= r_out) & (np.hypot(xmax, ymax) >= r_in)
+    return oy[filt], ox[filt]
+
+
+def _annulus_pixels(data, mask, x, y, r_ann, stencil):
+    """Gather the annulus pixels of a batch of sources in a 2D array, one
+    row per source, padded with nan."""
+    oy, ox = stencil
+    # Distances are computed to pixel centers
+    xi, yi = x - 0.5, y - 0.5
+    bx, by = np.floor(xi), np.floor(yi)
+    ix = bx[:, None].astype(int) + ox
+    iy = by[:, None].astype(int) + oy
+    r = np.hypot(ix - xi[:, None], iy - yi[:, None])
+
+    filt = (r >= r_ann[0]) & (r <= r_ann[1])
+    filt &= (ix >= 0) & (ix < data.shape[1]) & (iy >= 0) & \
+        (iy < data.shape[0])
+    ix = np.clip(ix, 0, data.shape[1]-1)
+    iy = np.clip(iy, 0, data.shape[0]-1)
+    f = data[iy, ix].astype('f8')
+    if mask is not None:
+        filt &= ~mask[iy, ix]
+    f[~filt] = np.nan
+    return f
+
+
+def _sigmaclip_rows(f, low=4.0, high=4.0):
+    """Iterative sigma clipping of each row, inplace, with clipped values set
+    to nan. Same criteria of `scipy.stats.sigmaclip`."""
+    rows = np.arange(f.shape[0])
+    while len(rows):
+        sub = f[rows]
+        mean = np.nanmean(sub, axis=1)[:, None]
+        std = np.nanstd(sub, axis=1)[:, None]
+        clip = (sub < mean - std*low) | (sub > mean + std*high)
+        sub[clip] = np.nan
+        f[rows] = sub
+        # Only rows that changed need another iteration
+        rows = rows[np.any(clip, axis=1)]
+    return f
+
+
+def sky_annulus(data, x, y, r_ann, algorithm='mmm', mask=None,
+                batch_size=None, logger=logger):
     """Determine the sky value of a single pixel based on a sky annulus.
 
     Parameters:
@@ -29,6 +87,9 @@ def sky_annulus(data, x, y, r_ann, algorithm='mmm', mask=None, logger=logger):
             mode) should be better for populated fields, while 'sigmaclip'
             (clipped mean) should be better for sparse fields.
             Default: 'mmm'
+        - batch_size : int (optional)
+            Number of sources processed at once. If None, batches of about
+            4 million annulus pixels are used.
 
     Return:
     -------
@@ -37,55 +98,53 @@ def sky_annulus(data, x, y, r_ann, algorithm='mmm', mask=None, logger=logger):
         - sky_error : array_like
             The error of sky value, computed as the sigma cliped stddev.
     """
-    # TODO: this code needs optimization for faster work
     if len(x) != len(y):
         raise ValueError('x and y variables don\'t have the same lenght.')
 
     if len(r_ann) != 2:
         raise ValueError('r_ann must have two components (r_in, r_out)')
 
+    if algorithm not in sky_algorithms:
+        raise ValueError(f'Sky algorithm {algorithm} not supported.')
+
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    data = np.asarray(data)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+
     sky = np.zeros_like(x, dtype='f8')
     sky.fill(np.nan)
     sky_error = np.zeros_like(x, dtype='f8')
     sky_error.fill(np.nan)
 
-    box_size = 2*int(np.max(r_ann)+2)  # Ensure the aperture is entirely in box
     r_ann = sorted(r_ann)
+    # Offsets of the annulus pixels are computed only once for all sources
+    stencil = _annulus_stencil(*r_ann)
+    if batch_size is None:
+        batch_size = max(1, 2**22//max(len(stencil[0]), 1))
 
-    indices = np.indices(data.shape)
-    for i in range(len(x)):
-        xi, yi = x[i]-0.5, y[i]-0.5  # needed to check pixel centers
-        d, ix, iy = trim_array(data, box_size, (xi, yi), indices)
-        if mask is not None:
-            m = np.ravel(mask[iy, ix])
-        r, f = xy2r(ix, iy, d, xi, yi)
-
-        # Filter only values inside the annulus
-        # To think: this do not perform subpixel, just check the pixel center
-        filt = (r >= r_ann[0]) & (r <= r_ann[1])
-        # mask nans here to go faster
-        filt = filt & ~np.isnan(f)
-        if mask is not None:
-            filt = filt & ~m
-        f = f[np.where(filt)]
-        if len(f) < 1:
+    for i in range(0, len(x), batch_size):
+        sl = slice(i, i+batch_size)
+        f = _annulus_pixels(data, mask, x[sl], y[sl], r_ann, stencil)
+        empty = np.all(np.isnan(f), axis=1)
+        for j in np.where(empty)[0]:
             logger.warn('No pixels for sky subtraction found at position'
-                        f' {x[i]}x{y[i]}.')
-            sky[i] = 0
-            sky_error[i] = 0
-        else:
-            for _ in range(3):
-                f, _, _ = sigmaclip(f)
-            mean = np.nanmean(f)
-            median = np.nanmedian(f)
-            sky_error[i] = np.nanstd(f)
+                        f' {x[i+j]}x{y[i+j]}.')
+        bsky = np.zeros(len(f))
+        berr = np.zeros(len(f))
+        f = _sigmaclip_rows(f[~empty])
+        if len(f):
+            mean = np.nanmean(f, axis=1)
+            median = np.nanmedian(f, axis=1)
+            berr[~empty] = np.nanstd(f, axis=1)
             if algorithm == 'mmm':
                 # mimic daophot using sigmaclip
-                sky[i] = 3*median - 2*mean  # mmm mode estimator
-            elif algorithm == 'sigmaclip':
-                sky[i] = mean
+                bsky[~empty] = 3*median - 2*mean  # mmm mode estimator
             else:
-                raise ValueError(f'Sky algorithm {algorithm} not supported.')
+                bsky[~empty] = mean
+        sky[sl] = bsky
+        sky_error[sl] = berr
 
     return sky, sky_error
 
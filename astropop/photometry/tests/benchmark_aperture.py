@@ -0,0 +1,75 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""Benchmark of the sky annulus background.
+
+Not collected by pytest. Run with:
+
+    python -m astropop.photometry.tests.benchmark_aperture [n] [size]
+
+Default is 20000 sources in a 4096x4096 image. The former per source
+implementation of `sky_annulus` is kept here for comparison, timed in a
+subset of the sources and extrapolated.
+"""
+
+import sys
+import time
+import numpy as np
+from scipy.stats import sigmaclip
+
+from astropop.math.array import xy2r, trim_array
+from astropop.photometry.aperture import sky_annulus
+
+
+def _sky_annulus_old(data, x, y, r_ann, algorithm='mmm'):
+    sky = np.full(len(x), np.nan)
+    sky_error = np.full(len(x), np.nan)
+    box_size = 2*int(np.max(r_ann)+2)
+    r_ann = sorted(r_ann)
+    indices = np.indices(data.shape)
+    for i in range(len(x)):
+        xi, yi = x[i]-0.5, y[i]-0.5
+        d, ix, iy = trim_array(data, box_size, (xi, yi), indices)
+        r, f = xy2r(ix, iy, d, xi, yi)
+        filt = (r >= r_ann[0]) & (r <= r_ann[1]) & ~np.isnan(f)
+        f = f[np.where(filt)]
+        if len(f) < 1:
+            sky[i] = sky_error[i] = 0
+            continue
+        for _ in range(3):
+            f, _, _ = sigmaclip(f)
+        mean = np.nanmean(f)
+        sky_error[i] = np.nanstd(f)
+        if algorithm == 'mmm':
+            sky[i] = 3*np.nanmedian(f) - 2*mean
+        else:
+            sky[i] = mean
+    return sky, sky_error
+
+
+def _timeit(func):
+    t0 = time.perf_counter()
+    res = func()
+    return time.perf_counter() - t0, res
+
+
+def main(n=20000, size=4096, r_ann=(10, 15)):
+    rng = np.random.default_rng(0)
+    data = rng.normal(100, 5, (size, size))
+    x = rng.uniform(-5, size+5, n)
+    y = rng.uniform(-5, size+5, n)
+    print(f'{n} sources in {size}x{size}, annulus {r_ann}')
+
+    n_old = min(n, 1000)
+    for algorithm in ['mmm', 'sigmaclip']:
+        t_old, old = _timeit(lambda: _sky_annulus_old(data, x[:n_old],
+                                                      y[:n_old], r_ann,
+                                                      algorithm))
+        t_old *= n/n_old
+        t, new = _timeit(lambda: sky_annulus(data, x, y, r_ann, algorithm))
+        diff = max(np.max(np.abs(o - v[:n_old])) for o, v in zip(old, new))
+        print(f'    {algorithm:<10} old {t_old:9.2f} s (extrapolated)  '
+              f'new {t:7.2f} s  speedup {t_old/t:6.1f}x  '
+              f'max diff {diff:.2e}')
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,110 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+import pytest_check as check
+from scipy.stats import sigmaclip
+
+from astropop.math.array import xy2r, trim_array
+from astropop.photometry.aperture import sky_annulus, _annulus_stencil, \
+                                         _sigmaclip_rows
+
+
+def _sky_annulus_loop(data, x, y, r_ann, algorithm='mmm', mask=None):
+    # Former per source implementation, used as reference.
+    sky = np.full(len(x), np.nan)
+    sky_error = np.full(len(x), np.nan)
+    box_size = 2*int(np.max(r_ann)+2)
+    r_ann = sorted(r_ann)
+    indices = np.indices(data.shape)
+    for i in range(len(x)):
+        xi, yi = x[i]-0.5, y[i]-0.5
+        d, ix, iy = trim_array(data, box_size, (xi, yi), indices)
+        r, f = xy2r(ix, iy, d, xi, yi)
+        filt = (r >= r_ann[0]) & (r <= r_ann[1]) & ~np.isnan(f)
+        if mask is not None:
+            filt &= ~np.ravel(mask[iy, ix])
+        f = f[np.where(filt)]
+        if len(f) < 1:
+            sky[i] = sky_error[i] = 0
+            continue
+        for _ in range(3):
+            f, _, _ = sigmaclip(f)
+        mean = np.nanmean(f)
+        sky_error[i] = np.nanstd(f)
+        if algorithm == 'mmm':
+            sky[i] = 3*np.nanmedian(f) - 2*mean
+        else:
+            sky[i] = mean
+    return sky, sky_error
+
+
+def _sky_image(shape=(60, 80), seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 5, shape)
+    # outliers to be clipped
+    data.flat[rng.choice(data.size, 100, replace=False)] += 1000
+    data[5, 5] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('algorithm', ['mmm', 'sigmaclip'])
+@pytest.mark.parametrize('use_mask', [False, True])
+def test_sky_annulus(algorithm, use_mask):
+    data = _sky_image()
+    mask = None
+    if use_mask:
+        mask = np.zeros(data.shape, dtype=bool)
+        mask[20:40, 30:50] = True
+    rng = np.random.default_rng(1)
+    # sources inside the image, with annulus crossing the borders, and
+    # outside the image
+    x = np.concatenate([rng.uniform(0, 80, 40), [-3.2, 82.7, 0.5, 40]])
+    y = np.concatenate([rng.uniform(0, 60, 40), [10.4, 58.1, -1.3, 100]])
+    r_ann = (8, 4.5)
+    sky, err = sky_annulus(data, x, y, r_ann, algorithm=algorithm,
+                           mask=mask, batch_size=7)
+    esky, eerr = _sky_annulus_loop(data, x, y, r_ann, algorithm=algorithm,
+                                   mask=mask)
+    npt.assert_allclose(sky, esky, rtol=1e-10)
+    npt.assert_allclose(err, eerr, rtol=1e-10, atol=1e-12)
+    # no pixels in the annulus
+    check.equal(sky[-1], 0)
+    check.equal(err[-1], 0)
+
+
+def test_sky_annulus_errors():
+    data = _sky_image()
+    with pytest.raises(ValueError):
+        sky_annulus(data, [1, 2], [1], (4, 8))
+    with pytest.raises(ValueError):
+        sky_annulus(data, [1], [1], (4, 8, 10))
+    with pytest.raises(ValueError):
+        sky_annulus(data, [1], [1], (4, 8), algorithm='not an algorithm')
+
+
+@pytest.mark.parametrize('r_ann', [(0, 3), (4, 8), (2.5, 7.3)])
+def test_annulus_stencil(r_ann):
+    oy, ox = _annulus_stencil(*r_ann)
+    rng = np.random.default_rng(0)
+    stencil = set(zip(oy, ox))
+    n = int(np.ceil(r_ann[1])) + 3
+    gy, gx = np.mgrid[-n:n+1, -n:n+1]
+    # all offsets in the annulus of any subpixel position are in stencil
+    for fy, fx in rng.uniform(0, 1, (50, 2)):
+        r = np.hypot(gy - fy, gx - fx)
+        filt = (r >= r_ann[0]) & (r <= r_ann[1])
+        check.is_true(set(zip(gy[filt], gx[filt])) <= stencil)
+
+
+def test_sigmaclip_rows():
+    rng = np.random.default_rng(0)
+    f = rng.normal(0, 1, (5, 50))
+    f[:, :3] = 30
+    f[2, 10:] = np.nan
+    res = _sigmaclip_rows(f.copy())
+    for row, expect in zip(res, f):
+        expect, _, _ = sigmaclip(expect[~np.isnan(expect)])
+        npt.assert_array_equal(np.sort(row[~np.isnan(row)]),
+                               np.sort(expect))
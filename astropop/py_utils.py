@@ -5,12 +5,13 @@ import select
 import shlex
 import six
 import errno
+import multiprocessing
 from os import path, makedirs
 
 from .logger import logger, resolve_level_string
 
 __all__ = ['mkdir_p', 'string_fix', 'process_list', 'check_iterable',
-           'batch_key_replace', 'IndexedDict']
+           'batch_key_replace', 'IndexedDict', 'pool_context']
 
 
 def mkdir_p(fname):
@@ -56,6 +57,19 @@ def check_iterable(value):
     return False
 
 
+def pool_context():
+    """Multiprocessing context for the worker pools.
+
+    Forked workers inherit the thread pools of the parent, like the numba
+    parallel ufuncs, that deadlock after a fork. The forkserver starts the
+    workers from a clean process. Returns `None`, the default context, where
+    forkserver is not available.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return None
+
+
 def batch_key_replace(dictionary, key=None):
     """Scan and replace {key} values in a dict by dict['key'] value.
 